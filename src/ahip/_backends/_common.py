@@ -1,12 +1,24 @@
+import socket
+
 from .. import util
 
-__all__ = ["is_readable", "LoopAbort"]
+__all__ = ["is_readable", "LoopAbort", "resolve_timeout"]
 
 
 def is_readable(sock):
     return util.wait_for_read(sock, timeout=0)
 
 
+def resolve_timeout(timeout):
+    """
+    Turn a connect or read timeout into a number of seconds, or ``None`` for
+    no timeout.
+    """
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        return socket.getdefaulttimeout()
+    return timeout
+
+
 class LoopAbort(Exception):
     """
     Tell backends that enough bytes have been consumed
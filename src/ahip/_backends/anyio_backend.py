@@ -1,14 +1,28 @@
+import socket
 from ssl import SSLContext
 
 import anyio
 
-from ._common import is_readable, LoopAbort
+from ..util.timeout import current_time
+from ._common import is_readable, LoopAbort, resolve_timeout
 from .async_backend import AsyncBackend, AsyncSocket
 
 BUFSIZE = 65536
 
 
-# XX support connect_timeout and read_timeout
+async def _with_timeout(timeout, async_fn, *args, **kwargs):
+    """
+    Run ``async_fn(*args, **kwargs)``, raising :class:`socket.timeout` if it
+    takes more than ``timeout`` seconds.
+    """
+    timeout = resolve_timeout(timeout)
+    if timeout is None:
+        return await async_fn(*args, **kwargs)
+    try:
+        async with anyio.fail_after(timeout):
+            return await async_fn(*args, **kwargs)
+    except TimeoutError:
+        raise socket.timeout()
 
 
 class AnyIOBackend(AsyncBackend):
@@ -16,30 +30,101 @@ class AnyIOBackend(AsyncBackend):
         self, host, port, connect_timeout, source_address=None, socket_options=None
     ):
         bind_host, bind_port = source_address or (None, None)
-        stream = await anyio.connect_tcp(
-            host, port, bind_host=bind_host, bind_port=bind_port
+        stream = await _with_timeout(
+            connect_timeout,
+            anyio.connect_tcp,
+            host,
+            port,
+            bind_host=bind_host,
+            bind_port=bind_port,
         )
 
         if socket_options:
             for (level, optname, value) in socket_options:
                 stream.setsockopt(level, optname, value)
 
-        return AnyIOSocket(stream)
+        return AnyIOSocket(stream, connect_timeout)
+
+    def create_event(self):
+        return anyio.create_event()
+
+    async def staggered_race(self, async_fns, delay, discard):
+        result = []
+        errors = []
+
+        async def attempt(async_fn, failed, tg):
+            try:
+                value = await async_fn()
+            except Exception as exc:
+                errors.append(exc)
+                await failed.set()
+            else:
+                if result:
+                    # The task group may already be cancelled by the winner,
+                    # but the loser's connection still has to be given back.
+                    async with anyio.open_cancel_scope(shield=True):
+                        await discard(value)
+                    return
+                result.append(value)
+                await tg.cancel_scope.cancel()
+
+        async with anyio.create_task_group() as tg:
+            for async_fn in async_fns:
+                if result:
+                    break
+                failed = anyio.create_event()
+                await tg.spawn(attempt, async_fn, failed, tg)
+                async with anyio.move_on_after(delay):
+                    await failed.wait()
+
+        if result:
+            return result[0]
+        raise errors[-1]
+
+    async def gather(self, async_fns):
+        async_fns = list(async_fns)
+        results = [None] * len(async_fns)
+
+        async def run(i, async_fn):
+            results[i] = await async_fn()
+
+        async with anyio.create_task_group() as tg:
+            for i, async_fn in enumerate(async_fns):
+                await tg.spawn(run, i, async_fn)
+
+        return results
+
+    async def run_sync_in_worker_thread(self, fn, *args):
+        return await anyio.run_in_thread(fn, *args)
 
 
-# XX it turns out that we don't need SSLStream to be robustified against
-# cancellation, but we probably should do something to detect when the stream
-# has been broken by cancellation (e.g. a timeout) and make is_readable return
-# True so the connection won't be reused.
+# A stream operation that is interrupted, whether by a timeout, an error or
+# the caller being cancelled, can leave the stream (and especially a TLS
+# stream) in the middle of a message. We don't try to recover from that: the
+# socket is marked broken, and is_readable returns True so that the
+# connection is thrown away instead of being reused.
 
 
 class AnyIOSocket(AsyncSocket):
-    def __init__(self, stream: anyio.SocketStream):
+    def __init__(self, stream: anyio.SocketStream, connect_timeout=None):
         self._stream = stream
+        self._connect_timeout = connect_timeout
+        self._broken = False
+
+    async def _run(self, timeout, async_fn, *args, **kwargs):
+        try:
+            return await _with_timeout(timeout, async_fn, *args, **kwargs)
+        except BaseException:
+            self._broken = True
+            raise
 
     async def start_tls(self, server_hostname, ssl_context: SSLContext):
-        await self._stream.start_tls(
-            ssl_context, suppress_ragged_eofs=True, server_hostname=server_hostname
+        await self._run(
+            self._connect_timeout,
+            self._stream.start_tls,
+            ssl_context,
+            suppress_ragged_eofs=True,
+            server_hostname=server_hostname,
         )
         return self
 
@@ -47,29 +132,68 @@ class AnyIOSocket(AsyncSocket):
         return self._stream.getpeercert(binary_form=binary_form)
 
     async def receive_some(self, read_timeout):
-        return await self._stream.receive_some(BUFSIZE)
+        return await self._run(read_timeout, self._stream.receive_some, BUFSIZE)
+
+    async def wait_readable(self, timeout):
+        # Only the raw socket is waited on, so a timeout doesn't interrupt an
+        # operation on the stream and it stays usable.
+        timeout = resolve_timeout(timeout)
+        sock = self._stream._socket._raw_socket
+        if timeout is None:
+            await anyio.wait_socket_readable(sock)
+            return True
+        async with anyio.move_on_after(timeout):
+            await anyio.wait_socket_readable(sock)
+            return True
+        return False
 
     async def send_and_receive_for_a_while(
         self, produce_bytes, consume_bytes, read_timeout
     ):
+        # Like the sync backend, time out if neither sending nor receiving
+        # makes progress for read_timeout seconds.
+        read_timeout = resolve_timeout(read_timeout)
+        last_progress = [current_time()]
+        timed_out = []
+
         async def sender():
             while True:
                 outgoing = await produce_bytes()
                 if outgoing is None:
                     break
                 await self._stream.send_all(outgoing)
+                last_progress[0] = current_time()
 
         async def receiver():
             while True:
                 incoming = await self._stream.receive_some(BUFSIZE)
+                last_progress[0] = current_time()
                 consume_bytes(incoming)
 
+        async def watchdog(tg):
+            while True:
+                time_left = last_progress[0] + read_timeout - current_time()
+                if time_left <= 0:
+                    timed_out.append(True)
+                    await tg.cancel_scope.cancel()
+                    return
+                await anyio.sleep(time_left)
+
         try:
             async with anyio.create_task_group() as tg:
                 await tg.spawn(sender)
                 await tg.spawn(receiver)
+                if read_timeout is not None:
+                    await tg.spawn(watchdog, tg)
         except LoopAbort:
             pass
+        except BaseException:
+            self._broken = True
+            raise
+
+        if timed_out:
+            self._broken = True
+            raise socket.timeout()
 
     # We want this to be synchronous, and don't care about graceful teardown
     # of the SSL/TLS layer.
@@ -77,7 +201,7 @@ class AnyIOSocket(AsyncSocket):
         self._stream._socket._raw_socket.close()
 
     def is_readable(self):
-        return is_readable(self._stream._socket._raw_socket)
+        return self._broken or is_readable(self._stream._socket._raw_socket)
 
     def set_readable_watch_state(self, enabled):
         pass
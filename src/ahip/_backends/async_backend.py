@@ -1,9 +1,23 @@
 from abc import abstractmethod, ABC
 from ssl import SSLContext
-from typing import Optional, Tuple, Iterable, Union, Any, Dict, Callable, Awaitable
+from typing import (
+    Optional,
+    Tuple,
+    Iterable,
+    List,
+    Union,
+    Any,
+    Dict,
+    Callable,
+    Awaitable,
+)
 
 
 class AsyncBackend(ABC):
+    #: Exceptions, besides :class:`OSError`, that the backend's sockets raise
+    #: when the connection breaks.
+    connection_errors: Tuple[type, ...] = ()
+
     @abstractmethod
     async def connect(
         self,
@@ -13,6 +27,54 @@ class AsyncBackend(ABC):
         source_address: Optional[Tuple[str, int]] = None,
         socket_options: Optional[Iterable[Tuple[int, int, int]]] = None,
     ) -> "AsyncSocket":
+        """
+        Raise :class:`socket.timeout` if connecting, including any TLS
+        handshake, takes longer than ``connect_timeout`` seconds.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def create_event(self) -> Any:
+        """
+        Return an event object with awaitable ``set()`` and ``wait()``
+        methods, and a synchronous ``is_set()`` method.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def staggered_race(
+        self,
+        async_fns: Iterable[Callable[[], Awaitable[Any]]],
+        delay: Optional[float],
+        discard: Callable[[Any], Awaitable[None]],
+    ) -> Any:
+        """
+        Start each of ``async_fns`` in turn, launching the next one whenever
+        ``delay`` seconds pass without a result or as soon as an attempt
+        fails. Return the first result and cancel the other attempts; results
+        that still arrive are passed to ``discard``. If every attempt fails,
+        the last error is raised.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def gather(
+        self, async_fns: Iterable[Callable[[], Awaitable[Any]]]
+    ) -> List[Any]:
+        """
+        Run all of ``async_fns`` concurrently and return their results, in
+        the same order. If one fails, the others are cancelled and its error
+        is raised.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def run_sync_in_worker_thread(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Call ``fn(*args)`` in a worker thread, without blocking the event
+        loop, and return its result. If the caller is cancelled, this still
+        waits for ``fn`` to finish.
+        """
         raise NotImplementedError()
 
 
@@ -29,6 +91,18 @@ class AsyncSocket(ABC):
 
     @abstractmethod
     async def receive_some(self, read_timeout: Optional[float]) -> bytes:
+        """
+        Raise :class:`socket.timeout` if nothing arrives for ``read_timeout``
+        seconds.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def wait_readable(self, timeout: Optional[float]) -> bool:
+        """
+        Wait up to ``timeout`` seconds for data to arrive, without reading
+        it, and return whether it did.
+        """
         raise NotImplementedError()
 
     @abstractmethod
@@ -38,6 +112,10 @@ class AsyncSocket(ABC):
         consume_bytes: Callable[[bytes], None],
         read_timeout: Optional[float],
     ) -> None:
+        """
+        Raise :class:`socket.timeout` if neither sending nor receiving makes
+        progress for ``read_timeout`` seconds.
+        """
         raise NotImplementedError()
 
     @abstractmethod
@@ -46,6 +124,10 @@ class AsyncSocket(ABC):
 
     @abstractmethod
     def is_readable(self) -> bool:
+        """
+        Also return True once an operation on the socket has been interrupted
+        (by a timeout, an error or cancellation), so that it isn't reused.
+        """
         raise NotImplementedError()
 
     @abstractmethod
@@ -1,5 +1,7 @@
 import errno
 import socket
+import threading
+from ..packages.six.moves import queue
 from ..util.connection import create_connection
 from ..util.ssl_ import ssl_wrap_socket
 from .. import util
@@ -12,6 +14,8 @@ BUFSIZE = 65536
 
 
 class SyncBackend(object):
+    connection_errors = ()
+
     def connect(
         self, host, port, connect_timeout, source_address=None, socket_options=None
     ):
@@ -23,6 +27,95 @@ class SyncBackend(object):
         )
         return SyncSocket(conn)
 
+    def create_event(self):
+        return threading.Event()
+
+    def staggered_race(self, fns, delay, discard):
+        """
+        Call each of ``fns`` in its own thread, starting the next one whenever
+        ``delay`` seconds pass without a result (or immediately if an attempt
+        fails), and return the first result. Threads can't be cancelled, so
+        losing attempts run to completion and their results are handed to
+        ``discard``. If every attempt fails, the last error is raised.
+        """
+        lock = threading.Lock()
+        winner = []
+        outcomes = queue.Queue()
+
+        def attempt(fn):
+            try:
+                value = fn()
+            except BaseException as e:
+                outcomes.put((False, e))
+                return
+            with lock:
+                if winner:
+                    discard(value)
+                    return
+                winner.append(value)
+            outcomes.put((True, value))
+
+        pending = list(fns)
+        running = 0
+        error = None
+        while pending or running:
+            if pending:
+                thread = threading.Thread(target=attempt, args=(pending.pop(0),))
+                thread.daemon = True
+                thread.start()
+                running += 1
+
+            try:
+                ok, value = outcomes.get(timeout=delay if pending else None)
+            except queue.Empty:
+                continue
+
+            running -= 1
+            if ok:
+                return value
+            if not isinstance(value, Exception):
+                # Such as KeyboardInterrupt, which no other attempt can fix.
+                raise value
+            error = value
+
+        raise error
+
+    def gather(self, fns):
+        """
+        Call each of ``fns`` in its own thread and return their results, in
+        the same order. Threads can't be cancelled, so if any fail, the first
+        error is raised once they have all finished.
+        """
+        fns = list(fns)
+        results = [None] * len(fns)
+        errors = []
+
+        def run(i, fn):
+            try:
+                results[i] = fn()
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=run, args=(i, fn)) for i, fn in enumerate(fns)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def run_sync_in_worker_thread(self, fn, *args):
+        """
+        There's no event loop to keep responsive, so ``fn`` is simply called
+        in this thread.
+        """
+        return fn(*args)
+
 
 class SyncSocket(object):
     # _wait_for_socket is a hack for testing. See test_sync_connection.py for
@@ -67,6 +160,14 @@ class SyncSocket(object):
                 else:
                     raise
 
+    def wait_readable(self, timeout):
+        # An SSL socket may already hold decrypted data that select() can't
+        # see.
+        pending = getattr(self._sock, "pending", None)
+        if pending is not None and pending():
+            return True
+        return self._wait_for_socket(self._sock, read=True, timeout=timeout)
+
     def send_and_receive_for_a_while(self, produce_bytes, consume_bytes, read_timeout):
         outgoing_finished = False
         outgoing = b""
@@ -1,15 +1,22 @@
+import math
+import socket
+
 import trio
 
-from ._common import is_readable, LoopAbort
+from ._common import is_readable, LoopAbort, resolve_timeout
 from .async_backend import AsyncBackend, AsyncSocket
 
 BUFSIZE = 65536
 
 
-# XX support connect_timeout and read_timeout
+def _seconds(timeout):
+    timeout = resolve_timeout(timeout)
+    return math.inf if timeout is None else timeout
 
 
 class TrioBackend(AsyncBackend):
+    connection_errors = (trio.BrokenResourceError,)
+
     async def connect(
         self, host, port, connect_timeout, source_address=None, socket_options=None
     ):
@@ -21,24 +28,111 @@ class TrioBackend(AsyncBackend):
                 "trio backend doesn't support setting source_address"
             )
 
-        stream = await trio.open_tcp_stream(host, port)
+        with trio.move_on_after(_seconds(connect_timeout)) as scope:
+            stream = await trio.open_tcp_stream(host, port)
+        if scope.cancelled_caught:
+            raise socket.timeout()
 
         if socket_options:
             for (level, optname, value) in socket_options:
                 stream.setsockopt(level, optname, value)
 
-        return TrioSocket(stream)
+        return TrioSocket(stream, connect_timeout)
+
+    def create_event(self):
+        return TrioEvent()
+
+    async def staggered_race(self, async_fns, delay, discard):
+        result = []
+        errors = []
+
+        async def attempt(async_fn, failed, nursery):
+            try:
+                value = await async_fn()
+            except Exception as exc:
+                errors.append(exc)
+                failed.set()
+            else:
+                if result:
+                    # The nursery may already be cancelled by the winner, but
+                    # the loser's connection still has to be given back.
+                    with trio.CancelScope(shield=True):
+                        await discard(value)
+                    return
+                result.append(value)
+                nursery.cancel_scope.cancel()
+
+        async with trio.open_nursery() as nursery:
+            for async_fn in async_fns:
+                if result:
+                    break
+                failed = trio.Event()
+                nursery.start_soon(attempt, async_fn, failed, nursery)
+                with trio.move_on_after(delay):
+                    await failed.wait()
+
+        if result:
+            return result[0]
+        raise errors[-1]
+
+    async def gather(self, async_fns):
+        async_fns = list(async_fns)
+        results = [None] * len(async_fns)
+
+        async def run(i, async_fn):
+            results[i] = await async_fn()
+
+        async with trio.open_nursery() as nursery:
+            for i, async_fn in enumerate(async_fns):
+                nursery.start_soon(run, i, async_fn)
+
+        return results
+
+    async def run_sync_in_worker_thread(self, fn, *args):
+        return await trio.to_thread.run_sync(fn, *args)
+
 
+class TrioEvent(object):
+    # trio.Event.set() is synchronous, but the backend API awaits it so that
+    # it matches anyio's events.
+    def __init__(self):
+        self._event = trio.Event()
 
-# XX it turns out that we don't need SSLStream to be robustified against
-# cancellation, but we probably should do something to detect when the stream
-# has been broken by cancellation (e.g. a timeout) and make is_readable return
-# True so the connection won't be reused.
+    async def set(self):
+        self._event.set()
+
+    async def wait(self):
+        await self._event.wait()
+
+    def is_set(self):
+        return self._event.is_set()
+
+
+# A stream operation that is interrupted, whether by a timeout, an error or
+# the caller being cancelled, can leave the stream (and especially an
+# SSLStream) in the middle of a message. We don't try to recover from that:
+# the socket is marked broken, and is_readable returns True so that the
+# connection is thrown away instead of being reused.
 
 
 class TrioSocket(AsyncSocket):
-    def __init__(self, stream):
+    def __init__(self, stream, connect_timeout=None):
         self._stream: trio.SSLStream = stream
+        self._connect_timeout = connect_timeout
+        self._broken = False
+
+    async def _run(self, timeout, async_fn, *args):
+        """
+        Run ``async_fn(*args)``, raising :class:`socket.timeout` if it takes
+        more than ``timeout`` seconds.
+        """
+        try:
+            with trio.move_on_after(_seconds(timeout)):
+                return await async_fn(*args)
+            raise socket.timeout()
+        except BaseException:
+            self._broken = True
+            raise
 
     async def start_tls(self, server_hostname, ssl_context):
         wrapped = trio.SSLStream(
@@ -47,36 +141,62 @@ class TrioSocket(AsyncSocket):
             server_hostname=server_hostname,
             https_compatible=True,
         )
-        await wrapped.do_handshake()
+        await self._run(self._connect_timeout, wrapped.do_handshake)
         return TrioSocket(wrapped)
 
     def getpeercert(self, binary_form=False):
         return self._stream.getpeercert(binary_form=binary_form)
 
     async def receive_some(self, read_timeout):
-        return await self._stream.receive_some(BUFSIZE)
+        return await self._run(read_timeout, self._stream.receive_some, BUFSIZE)
+
+    async def wait_readable(self, timeout):
+        # Only the raw socket is waited on, so a timeout doesn't interrupt an
+        # operation on the stream and it stays usable.
+        with trio.move_on_after(_seconds(timeout)):
+            await trio.lowlevel.wait_readable(self._socket())
+            return True
+        return False
 
     async def send_and_receive_for_a_while(
         self, produce_bytes, consume_bytes, read_timeout
     ):
+        # Like the sync backend, time out if neither sending nor receiving
+        # makes progress for read_timeout seconds.
+        read_timeout = _seconds(read_timeout)
+        scope = trio.CancelScope(deadline=trio.current_time() + read_timeout)
+
+        def made_progress():
+            scope.deadline = trio.current_time() + read_timeout
+
         async def sender():
             while True:
                 outgoing = await produce_bytes()
                 if outgoing is None:
                     break
                 await self._stream.send_all(outgoing)
+                made_progress()
 
         async def receiver():
             while True:
                 incoming = await self._stream.receive_some(BUFSIZE)
+                made_progress()
                 consume_bytes(incoming)
 
         try:
-            async with trio.open_nursery() as nursery:
-                nursery.start_soon(sender)
-                nursery.start_soon(receiver)
+            with scope:
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(sender)
+                    nursery.start_soon(receiver)
         except LoopAbort:
             pass
+        except BaseException:
+            self._broken = True
+            raise
+
+        if scope.cancelled_caught:
+            self._broken = True
+            raise socket.timeout()
 
     # Pull out the underlying trio socket, because it turns out HTTP is not so
     # great at respecting abstraction boundaries.
@@ -94,7 +214,7 @@ class TrioSocket(AsyncSocket):
         self._socket().close()
 
     def is_readable(self):
-        return is_readable(self._socket())
+        return self._broken or is_readable(self._socket())
 
     def set_readable_watch_state(self, enabled):
         pass
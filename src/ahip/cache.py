@@ -0,0 +1,1044 @@
+"""
+A private or shared HTTP cache following RFC 7234, for use with
+:class:`~hip.poolmanager.PoolManager`::
+
+    http = PoolManager(cache=HTTPCache(MemoryCacheStore(max_size=32 * 2 ** 20)))
+    r = http.request('GET', 'http://example.com/')  # miss, stored
+    r = http.request('GET', 'http://example.com/')  # hit, no network traffic
+    http.cache.stats.hits
+
+Only ``GET`` responses are stored. Stale entries with a validator
+(``ETag`` or ``Last-Modified``) are revalidated with a conditional request,
+and a ``304 Not Modified`` answer refreshes the stored entry. Responses to
+unsafe methods, such as ``POST``, invalidate the entry for their URL.
+"""
+from __future__ import absolute_import
+import collections
+import copy
+import email.utils
+import errno
+import json
+import logging
+import mmap
+import os
+import tempfile
+from time import time as _now
+
+from ._collections import HTTPHeaderDict, RLock
+from .packages import six
+from .response import BytesBody, HTTPResponse, close_buffer
+from .util.unasync import anext
+
+
+__all__ = [
+    "CacheEntry",
+    "CacheStats",
+    "CacheStore",
+    "CacheWriter",
+    "DiskCacheStore",
+    "HTTPCache",
+    "MemoryCacheStore",
+]
+
+
+log = logging.getLogger("hip.cache")
+
+#: Status codes that may be stored without explicit freshness information,
+#: see RFC 7231, Section 6.1.
+CACHEABLE_BY_DEFAULT_STATUSES = frozenset(
+    [200, 203, 204, 300, 301, 404, 405, 410, 414, 501]
+)
+
+SAFE_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "TRACE"])
+
+# Request headers that mean the caller is doing its own cache validation.
+CONDITIONAL_HEADERS = frozenset(
+    [
+        "if-match",
+        "if-none-match",
+        "if-modified-since",
+        "if-unmodified-since",
+        "if-range",
+    ]
+)
+
+# Arguments of urlopen that are about reading the response, so that
+# responses built from the cache honor them too. Digests are only computed
+# on the response the caller gets, not on the one from the server too.
+_DIGEST_KW = ("digests", "check_digest_headers")
+_RESPONSE_KW = (
+    "decode_content",
+    "body_limits",
+    "deadline",
+    "thread_decode_threshold",
+) + _DIGEST_KW
+
+# Headers that describe the stored body and must not be replaced by the
+# headers of a 304 response, see RFC 7234, Section 4.3.4.
+_BODY_HEADERS = frozenset(["content-encoding", "content-length", "content-range"])
+
+
+def parse_cache_control(value):
+    """
+    Parse a ``Cache-Control`` header value into a dictionary mapping
+    lowercased directive names to their argument, or ``None`` for directives
+    without one.
+
+    >>> parse_cache_control('max-age=60, no-cache, private="set-cookie"')
+    {'max-age': '60', 'no-cache': None, 'private': 'set-cookie'}
+    """
+    directives = {}
+    for directive in (value or "").split(","):
+        name, _, argument = directive.partition("=")
+        name = name.strip().lower()
+        if not name:
+            continue
+        argument = argument.strip().strip('"')
+        directives[name] = argument or None
+    return directives
+
+
+def _parse_seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_http_date(value):
+    if not value:
+        return None
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+
+class CacheEntry(object):
+    """
+    A stored response.
+
+    :param body:
+        The response body as received, before any content decoding. This is
+        normally a byte string, but stores may use any object supporting the
+        buffer protocol.
+
+    :param vary:
+        A dictionary of the request headers (lowercased) named by the
+        response's ``Vary`` header, and their values in the request that
+        produced this entry.
+
+    :param request_time:
+        When the request was sent, in seconds since the epoch.
+
+    :param response_time:
+        When the response was received, in seconds since the epoch.
+    """
+
+    def __init__(
+        self,
+        status,
+        headers,
+        body=b"",
+        reason=None,
+        version=0,
+        vary=None,
+        request_time=None,
+        response_time=None,
+    ):
+        self.status = status
+        self.headers = HTTPHeaderDict(headers)
+        self.body = body
+        self.reason = reason
+        self.version = version
+        self.vary = vary or {}
+        self.response_time = _now() if response_time is None else response_time
+        self.request_time = self.response_time if request_time is None else request_time
+
+    @property
+    def size(self):
+        """Approximate number of bytes this entry takes up in a store."""
+        headers = sum(len(k) + len(v) for k, v in self.headers.items())
+        return len(self.body) + headers
+
+    @property
+    def cache_control(self):
+        return parse_cache_control(", ".join(self.headers.getlist("cache-control")))
+
+    def matches(self, headers):
+        """Is this entry valid for a request with these headers (see ``Vary``)?"""
+        headers = HTTPHeaderDict(headers)
+        for name, value in self.vary.items():
+            if headers.get(name) != value:
+                return False
+        return True
+
+    def age(self, now=None):
+        """The current age of the entry, see RFC 7234, Section 4.2.3."""
+        now = _now() if now is None else now
+        date = _parse_http_date(self.headers.get("date")) or self.response_time
+        apparent_age = max(0, self.response_time - date)
+        age_value = _parse_seconds(self.headers.get("age")) or 0
+        response_delay = self.response_time - self.request_time
+        corrected_initial_age = max(apparent_age, age_value + response_delay)
+        return corrected_initial_age + max(0, now - self.response_time)
+
+    def freshness_lifetime(self, shared=False):
+        """How long the entry stays fresh, see RFC 7234, Section 4.2.1."""
+        cc = self.cache_control
+        if shared and _parse_seconds(cc.get("s-maxage")) is not None:
+            return _parse_seconds(cc["s-maxage"])
+        if _parse_seconds(cc.get("max-age")) is not None:
+            return _parse_seconds(cc["max-age"])
+
+        date = _parse_http_date(self.headers.get("date")) or self.response_time
+        if "expires" in self.headers:
+            # Invalid dates, such as "0", mean "already expired".
+            expires = _parse_http_date(self.headers["expires"])
+            return max(0, expires - date) if expires is not None else 0
+
+        # Heuristic freshness (RFC 7234, Section 4.2.2): 10% of the time since
+        # the resource was last modified.
+        last_modified = _parse_http_date(self.headers.get("last-modified"))
+        if last_modified is not None and self.status in CACHEABLE_BY_DEFAULT_STATUSES:
+            return max(0, int((date - last_modified) / 10))
+
+        return 0
+
+    def is_fresh(self, request_cc=None, shared=False, now=None):
+        """Can this entry be served without revalidation?"""
+        request_cc = request_cc or {}
+        if "no-cache" in request_cc or "no-cache" in self.cache_control:
+            return False
+
+        age = self.age(now)
+        lifetime = self.freshness_lifetime(shared)
+        if "max-stale" in request_cc and not self.must_revalidate(shared):
+            max_stale = request_cc["max-stale"]
+            if max_stale is None:
+                # Any amount of staleness is acceptable.
+                lifetime = float("inf")
+            else:
+                lifetime += _parse_seconds(max_stale) or 0
+        max_age = _parse_seconds(request_cc.get("max-age"))
+        if max_age is not None:
+            lifetime = min(lifetime, max_age)
+        min_fresh = _parse_seconds(request_cc.get("min-fresh")) or 0
+        return age + min_fresh < lifetime
+
+    def must_revalidate(self, shared=False):
+        """May the entry only be served stale after revalidating it?"""
+        cc = self.cache_control
+        return "must-revalidate" in cc or (shared and "proxy-revalidate" in cc)
+
+    def conditional_headers(self):
+        """Headers to revalidate this entry with, empty if it has no validator."""
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+    def updated(self, response, request_time, response_time):
+        """
+        Return a copy of the entry freshened with the headers of a ``304 Not
+        Modified``. The entry itself is left alone, as the store and other
+        requests may be using it.
+        """
+        entry = copy.copy(self)
+        entry.headers = self.headers.copy()
+        entry.request_time = request_time
+        entry.response_time = response_time
+        for name in response.headers:
+            if name.lower() in _BODY_HEADERS:
+                continue
+            entry.headers.discard(name)
+            for value in response.headers.getlist(name):
+                entry.headers.add(name, value)
+        return entry
+
+    def close(self):
+        """
+        Release the body, such as a memory-mapped file, unless a response
+        built with :meth:`to_response` is using it.
+        """
+        close_buffer(self.body)
+
+    def to_response(self, request_url=None, decode_content=True, now=None, **kw):
+        """
+        Build an :class:`~hip.response.HTTPResponse` reading from the entry.
+        Additional parameters, such as ``body_limits`` and ``digests``, are
+        passed to the response.
+        """
+        headers = self.headers.copy()
+        headers["Age"] = str(int(self.age(now)))
+        return HTTPResponse(
+            body=BytesBody(self.body),
+            headers=headers,
+            status=self.status,
+            version=self.version,
+            reason=self.reason,
+            decode_content=decode_content,
+            request_url=request_url,
+            **kw
+        )
+
+
+class CacheStats(object):
+    """
+    Counters describing how well an :class:`HTTPCache` is doing.
+
+    * ``hits``: requests answered from the cache without network traffic.
+    * ``misses``: requests that needed a full response from the server.
+    * ``revalidations``: stale entries the server confirmed with a
+      ``304 Not Modified``, so that only headers went over the network.
+    * ``stores``: responses written to the store.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.stores = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of requests answered without downloading a body."""
+        total = self.hits + self.misses + self.revalidations
+        if not total:
+            return 0.0
+        return (self.hits + self.revalidations) / float(total)
+
+    def __repr__(self):
+        return (
+            "{cls.__name__}(hits={self.hits}, misses={self.misses}, "
+            "revalidations={self.revalidations}, stores={self.stores})"
+        ).format(cls=type(self), self=self)
+
+
+class CacheStore(object):
+    """
+    Base class for cache storage backends. Stores map keys (strings) to
+    :class:`CacheEntry` objects and must be safe to use from several threads.
+    """
+
+    #: Size in bytes of the largest entry the store can keep, or ``None`` if
+    #: there is no limit. :class:`HTTPCache` doesn't read bodies that won't
+    #: fit into the store.
+    max_size = None
+
+    def get(self, key):
+        """Return the entry for ``key``, or ``None``."""
+        raise NotImplementedError()
+
+    def set(self, key, entry):
+        """Store ``entry`` under ``key``, replacing any previous entry."""
+        raise NotImplementedError()
+
+    def update(self, key, entry):
+        """
+        Store ``entry``, the entry for ``key`` freshened by
+        :meth:`CacheEntry.updated`, under ``key``. Its body is the one already
+        stored, so stores that keep bodies apart from the headers can just
+        update the headers.
+        """
+        self.set(key, entry)
+
+    def delete(self, key):
+        """Remove the entry for ``key``, if there is one."""
+        raise NotImplementedError()
+
+    def clear(self):
+        """Remove all entries."""
+        raise NotImplementedError()
+
+    def writer(self, key):
+        """
+        Return a :class:`CacheWriter` to store an entry under ``key`` with a
+        body that is written to it bit by bit as it is downloaded.
+        """
+        return CacheWriter(self, key)
+
+
+class CacheWriter(object):
+    """
+    Receives the body of an entry as it is downloaded, see
+    :meth:`CacheStore.writer`. This implementation gathers the body in
+    memory and then passes the entry to :meth:`CacheStore.set`; stores can
+    return their own writers that put the body straight into storage.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        #: Number of bytes written so far.
+        self.size = 0
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+
+    def getvalue(self):
+        """The body written so far, as an object supporting the buffer protocol."""
+        return b"".join(self._chunks)
+
+    def commit(self, entry):
+        """Store ``entry`` with the written body as its body, and return it."""
+        entry.body = self.getvalue()
+        self._chunks = []
+        self.store.set(self.key, entry)
+        return entry
+
+    def discard(self):
+        """Give up on storing the body."""
+        self._chunks = []
+
+
+class MemoryCacheStore(CacheStore):
+    """
+    An in-memory store that evicts the least recently used entries once the
+    total size of the stored entries goes over ``max_size`` bytes.
+
+    :param int max_size:
+        Maximum number of bytes of headers and bodies to keep. Entries larger
+        than this are not stored at all.
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.lock = RLock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.delete(key)
+            if entry.size > self.max_size:
+                return
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def delete(self, key):
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCacheStore(CacheStore):
+    """
+    A store that keeps each body in its own file under ``directory``, with a
+    small JSON index of the headers and metadata. Entries survive restarts,
+    so a new process starts with a warm cache.
+
+    Bodies are written to their files as they are downloaded, and returned
+    memory-mapped: the :class:`CacheEntry` body is a read-only
+    :class:`mmap.mmap`, and responses built from it stream ``memoryview``
+    slices of the mapping instead of reading the file into memory. The
+    mapping is closed along with the response. The least recently used
+    entries are evicted once the total size goes over ``max_size`` bytes.
+
+    Changes to the index are appended to a journal, which is folded back
+    into the index once it grows longer than the index itself, so storing
+    an entry doesn't rewrite the whole index.
+
+    A directory must only be used by one store (and process) at a time.
+
+    :param str directory:
+        Where to keep the cache. It is created if needed.
+
+    :param int max_size:
+        Maximum number of bytes of headers and bodies to keep.
+    """
+
+    INDEX_NAME = "index.json"
+    JOURNAL_NAME = "journal"
+
+    #: The journal isn't folded into the index before it has this many
+    #: entries.
+    MIN_JOURNAL_LENGTH = 1000
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self.lock = RLock()
+        self._index = collections.OrderedDict()
+        self._journal = None
+        self._journal_length = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load_index()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _body_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_index(self):
+        try:
+            with open(self._body_path(self.INDEX_NAME)) as f:
+                records = json.load(f)
+        except (IOError, OSError, ValueError):
+            records = []
+
+        # The index is stored least recently used first, and the journal
+        # records what happened since, in order.
+        index = collections.OrderedDict(records)
+        try:
+            with open(self._body_path(self.JOURNAL_NAME)) as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # Cut short by a crash.
+                        break
+                    key = op[1]
+                    record = index.pop(key, None)
+                    if op[0] == "set":
+                        index[key] = op[2]
+                    elif op[0] == "get" and record is not None:
+                        index[key] = record
+        except (IOError, OSError):
+            pass
+
+        for key, record in index.items():
+            try:
+                body_size = os.path.getsize(self._body_path(record["file"]))
+            except OSError:
+                continue
+            if body_size != record["body_size"]:
+                continue
+            self._index[key] = record
+            self.size += record["size"]
+
+        # Remove bodies that aren't in the index, such as ones left by a
+        # crash in the middle of a download.
+        names = set(record["file"] for record in self._index.values())
+        names.update([self.INDEX_NAME, self.JOURNAL_NAME])
+        for name in os.listdir(self.directory):
+            if name not in names:
+                self._remove(name)
+
+        self._compact()
+
+    def _compact(self):
+        """Write the whole index, and start a new journal."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(list(self._index.items()), f, separators=(",", ":"))
+        _replace(tmp, self._body_path(self.INDEX_NAME))
+
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self._body_path(self.JOURNAL_NAME), "w")
+        self._journal_length = 0
+
+    def _log(self, *op):
+        """Append a change to the index to the journal."""
+        if self._journal_length >= max(len(self._index), self.MIN_JOURNAL_LENGTH):
+            self._compact()
+            return
+        self._journal.write(json.dumps(op, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        self._journal_length += 1
+
+    def _remove(self, name):
+        try:
+            os.remove(self._body_path(name))
+        except OSError as e:
+            # On Windows, files can't be removed while they are mapped. The
+            # orphaned file is removed the next time the store is opened.
+            if e.errno != errno.ENOENT:
+                log.debug("Could not remove cached body %s: %r", name, e)
+
+    def get(self, key):
+        with self.lock:
+            record = self._index.pop(key, None)
+            if record is None:
+                return None
+            self._index[key] = record
+            self._log("get", key)
+
+        try:
+            body = _map(self._body_path(record["file"]), record["body_size"])
+        except (IOError, OSError):
+            self.delete(key)
+            return None
+
+        version = record["version"]
+        if isinstance(version, six.text_type):
+            version = version.encode("latin-1")
+        return _DiskCacheEntry(
+            record["file"],
+            status=record["status"],
+            headers=record["headers"],
+            body=body,
+            reason=record["reason"],
+            version=version,
+            vary=record["vary"],
+            request_time=record["request_time"],
+            response_time=record["response_time"],
+        )
+
+    def writer(self, key):
+        return _DiskCacheWriter(self, key)
+
+    def set(self, key, entry):
+        writer = self.writer(key)
+        try:
+            writer.write(entry.body)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        self._add(key, entry, writer.name)
+
+    def update(self, key, entry):
+        with self.lock:
+            record = self._index.get(key)
+            if (
+                isinstance(entry, _DiskCacheEntry)
+                and record is not None
+                and record["file"] == entry.file
+            ):
+                # Index the new headers with the body file already there.
+                self._add(key, entry, entry.file)
+                return
+        # The body was stored again, or evicted, since the entry was read.
+        self.set(key, entry)
+
+    def _add(self, key, entry, name):
+        """Index ``entry``, whose body was written to the file ``name``."""
+        version = entry.version
+        if isinstance(version, bytes):
+            version = version.decode("latin-1")
+        record = {
+            "file": name,
+            "size": entry.size,
+            "body_size": len(entry.body),
+            "status": entry.status,
+            "reason": entry.reason,
+            "version": version,
+            "headers": entry.headers.items(),
+            "vary": entry.vary,
+            "request_time": entry.request_time,
+            "response_time": entry.response_time,
+        }
+
+        with self.lock:
+            self._discard(key, keep=name)
+            if record["size"] > self.max_size:
+                self._remove(name)
+                return
+            self._index[key] = record
+            self.size += record["size"]
+            self._log("set", key, record)
+            while self.size > self.max_size:
+                self._discard(next(iter(self._index)))
+
+    def _discard(self, key, keep=None):
+        record = self._index.pop(key, None)
+        if record is None:
+            return
+        self.size -= record["size"]
+        # Removing the file doesn't affect mappings of it that are still in
+        # use.
+        if record["file"] != keep:
+            self._remove(record["file"])
+        self._log("delete", key)
+
+    def delete(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self._index):
+                self._discard(key)
+            self._compact()
+
+
+class _DiskCacheEntry(CacheEntry):
+    """An entry read from a :class:`DiskCacheStore`, and the file of its body."""
+
+    def __init__(self, file, *args, **kwargs):
+        super(_DiskCacheEntry, self).__init__(*args, **kwargs)
+        self.file = file
+
+
+class _DiskCacheWriter(CacheWriter):
+    """Writes a body to a new file of a :class:`DiskCacheStore`."""
+
+    def __init__(self, store, key):
+        super(_DiskCacheWriter, self).__init__(store, key)
+        fd, path = tempfile.mkstemp(dir=store.directory, prefix="body-")
+        self.name = os.path.basename(path)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+    def getvalue(self):
+        if not self._file.closed:
+            self._file.flush()
+        return _map(self.store._body_path(self.name), self.size)
+
+    def commit(self, entry):
+        self.close()
+        entry.body = self.getvalue()
+        self.store._add(self.key, entry, self.name)
+        return entry
+
+    def discard(self):
+        self.close()
+        self.store._remove(self.name)
+
+
+def _map(path, size):
+    if not size:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+
+def _replace(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # Platform-specific: Python 2.7
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class HTTPCache(object):
+    """
+    An HTTP cache for :class:`~hip.poolmanager.PoolManager`, see the module
+    documentation.
+
+    :param store:
+        A :class:`CacheStore` holding the entries. Defaults to a new
+        :class:`MemoryCacheStore`.
+
+    :param bool shared:
+        Whether this is a shared cache, serving responses to several users.
+        Shared caches honor ``s-maxage`` and don't store ``private`` responses
+        or responses to requests with an ``Authorization`` header (unless the
+        response explicitly allows it).
+    """
+
+    def __init__(self, store=None, shared=False):
+        self.store = MemoryCacheStore() if store is None else store
+        self.shared = shared
+        self.stats = CacheStats()
+        self._stats_lock = RLock()
+        self._variants_lock = RLock()
+
+    def _count(self, stat):
+        with self._stats_lock:
+            setattr(self.stats, stat, getattr(self.stats, stat) + 1)
+
+    def cache_key(self, url):
+        """The store key for ``url``. Fragments are never sent, so drop them."""
+        return url.split("#", 1)[0]
+
+    def is_storable(self, method, request_headers, response):
+        """May ``response`` be stored, see RFC 7234, Section 3?"""
+        if method != "GET":
+            return False
+
+        request_cc = parse_cache_control(request_headers.get("cache-control"))
+        response_cc = parse_cache_control(
+            ", ".join(response.headers.getlist("cache-control"))
+        )
+        if "no-store" in request_cc or "no-store" in response_cc:
+            return False
+        if response.headers.get("vary", "").strip() == "*":
+            return False
+        # Entries hold whole bodies.
+        if response.status == 206:
+            return False
+
+        if self.shared:
+            if "private" in response_cc:
+                return False
+            if "authorization" in request_headers and not (
+                "public" in response_cc
+                or "s-maxage" in response_cc
+                or "must-revalidate" in response_cc
+            ):
+                return False
+
+        if response.status in CACHEABLE_BY_DEFAULT_STATUSES:
+            return True
+
+        return (
+            "max-age" in response_cc
+            or "expires" in response.headers
+            or (self.shared and "s-maxage" in response_cc)
+            or "public" in response_cc
+        )
+
+    async def urlopen(
+        self, send, method, url, headers=None, preload_content=True, **kw
+    ):
+        """
+        Answer a request from the cache if possible, otherwise call ``send``
+        (with the same arguments as
+        :meth:`hip.connectionpool.HTTPConnectionPool.urlopen`) and store the
+        response if allowed.
+        """
+        lookup = HTTPHeaderDict(headers)
+        method = method.upper()
+        key = self.cache_key(url)
+
+        if method not in SAFE_METHODS:
+            response = await send(
+                method, url, headers=headers, preload_content=preload_content, **kw
+            )
+            # RFC 7234, Section 4.4
+            if response.status < 400:
+                self._delete(key)
+            return response
+
+        # Entries hold whole bodies, so requests for part of one go to the
+        # server, see RFC 7234, Section 3.1.
+        if (
+            method != "GET"
+            or any(h in lookup for h in CONDITIONAL_HEADERS)
+            or "range" in lookup
+        ):
+            return await send(
+                method, url, headers=headers, preload_content=preload_content, **kw
+            )
+
+        request_cc = parse_cache_control(lookup.get("cache-control"))
+        response_kw = dict((name, kw[name]) for name in _RESPONSE_KW if name in kw)
+
+        entry = self._lookup(key, lookup)
+        if entry is not None and entry.is_fresh(request_cc, self.shared):
+            log.debug("Cache hit for %s", url)
+            self._count("hits")
+            response = entry.to_response(url, **response_kw)
+            if preload_content:
+                await response.preload_content()
+            return response
+
+        if "only-if-cached" in request_cc:
+            if entry is not None:
+                entry.close()
+            return HTTPResponse(status=504, reason="Gateway Timeout", request_url=url)
+
+        request_headers = headers
+        if entry is not None:
+            request_headers = lookup.copy()
+            request_headers.update(entry.conditional_headers())
+
+        send_kw = dict(
+            (name, value) for name, value in kw.items() if name not in _DIGEST_KW
+        )
+        request_time = _now()
+        response = upstream = await send(
+            method, url, headers=request_headers, preload_content=False, **send_kw
+        )
+        response_time = _now()
+
+        if entry is not None and response.status == 304:
+            log.debug("Cache entry for %s revalidated", url)
+            self._count("revalidations")
+            await response.drain_conn()
+            entry = entry.updated(response, request_time, response_time)
+            self.store.update(self._store_key(key, entry), entry)
+            response = entry.to_response(url, **response_kw)
+        elif self.is_storable(method, lookup, response):
+            self._count("misses")
+            if entry is not None:
+                entry.close()
+            entry = CacheEntry(
+                status=response.status,
+                headers=response.headers,
+                reason=response.reason,
+                version=response.version,
+                vary=self._vary(response, lookup),
+                request_time=request_time,
+                response_time=response_time,
+            )
+            if entry.freshness_lifetime(self.shared) or entry.conditional_headers():
+                response = await self._store(key, entry, response, url, response_kw)
+        else:
+            self._count("misses")
+            if entry is not None:
+                entry.close()
+
+        if response is upstream:
+            # It wasn't stored, so the caller reads it from the server.
+            response._add_digests(
+                kw.get("digests"), kw.get("check_digest_headers", False)
+            )
+        if preload_content:
+            await response.preload_content()
+        return response
+
+    async def _store(self, key, entry, response, url, response_kw):
+        """
+        Store ``entry`` with the body of ``response`` as it is read, and return
+        a response reading the stored body. If the body turns out to be too
+        large for the store, return a response reading the rest of it instead.
+        """
+        max_body_size = None
+        if self.store.max_size is not None:
+            max_body_size = self.store.max_size - entry.size
+            length = response._length_remaining()
+            if length is not None and length > max_body_size:
+                # Don't read a body that won't be stored.
+                return response
+
+        writer = self.store.writer(self._store_key(key, entry))
+        chunks = response.stream(decode_content=False)
+        try:
+            async for chunk in chunks:
+                writer.write(chunk)
+                if max_body_size is not None and writer.size > max_body_size:
+                    body = _PrefixedBody(writer.getvalue(), chunks, response)
+                    writer.discard()
+                    return HTTPResponse(
+                        body=body,
+                        headers=response.headers,
+                        status=response.status,
+                        version=response.version,
+                        reason=response.reason,
+                        retries=response.retries,
+                        request_url=url,
+                        **response_kw
+                    )
+        except BaseException:
+            writer.discard()
+            raise
+
+        self._count("stores")
+        return writer.commit(entry).to_response(url, **response_kw)
+
+    # Entries of responses with ``Vary`` are stored under a key of their own
+    # for each combination of the request headers it names. The URL's key
+    # then holds a placeholder entry, with a status of ``None``, whose vary
+    # names the headers and whose body lists the keys of the variants.
+
+    #: Most variants of a URL's response to keep, see ``Vary``.
+    max_variants = 16
+
+    def _variant_key(self, key, vary):
+        return key + " " + json.dumps(sorted(vary.items()), separators=(",", ":"))
+
+    def _variants(self, entry):
+        if entry is None:
+            return []
+        try:
+            if entry.status is not None:
+                return []
+            body = bytes(entry.body[:]).decode("utf-8")
+            return [k for k in body.split("\n") if k]
+        finally:
+            entry.close()
+
+    def _lookup(self, key, request_headers):
+        """The entry to answer a request with, or ``None``."""
+        entry = self.store.get(key)
+        if entry is not None and entry.status is None:
+            vary = dict((name, request_headers.get(name)) for name in entry.vary)
+            entry.close()
+            entry = self.store.get(self._variant_key(key, vary))
+        if entry is not None and not entry.matches(request_headers):
+            entry.close()
+            return None
+        return entry
+
+    def _store_key(self, key, entry):
+        """Where to store ``entry``, which is the response for ``key``."""
+        with self._variants_lock:
+            variants = self._variants(self.store.get(key))
+            if not entry.vary:
+                for variant_key in variants:
+                    self.store.delete(variant_key)
+                return key
+
+            variant_key = self._variant_key(key, entry.vary)
+            if variant_key in variants:
+                variants.remove(variant_key)
+            variants.append(variant_key)
+            while len(variants) > self.max_variants:
+                self.store.delete(variants.pop(0))
+            placeholder = CacheEntry(
+                status=None,
+                headers={},
+                body="\n".join(variants).encode("utf-8"),
+                vary=dict.fromkeys(entry.vary),
+            )
+            self.store.set(key, placeholder)
+            return variant_key
+
+    def _delete(self, key):
+        with self._variants_lock:
+            for variant_key in self._variants(self.store.get(key)):
+                self.store.delete(variant_key)
+            self.store.delete(key)
+
+    def _vary(self, response, request_headers):
+        vary = {}
+        for field in ", ".join(response.headers.getlist("vary")).split(","):
+            name = field.strip().lower()
+            if name:
+                vary[name] = request_headers.get(name)
+        return vary
+
+
+class _PrefixedBody(object):
+    """
+    The raw body of ``response``: first ``prefix``, which was already read
+    from it, then the rest from its ``chunks`` stream.
+    """
+
+    def __init__(self, prefix, chunks, response):
+        self._prefix = BytesBody(prefix)
+        self._chunks = chunks
+        self._response = response
+
+    def __aiter__(self):
+        return self
+
+    def next(self):  # Platform-specific: Python 2.7
+        return self.__next__()
+
+    async def __anext__(self):
+        if not self._prefix.complete:
+            return await anext(self._prefix)
+        return await anext(self._chunks)
+
+    def close(self):
+        self._prefix.close()
+        self._response.close()
@@ -14,11 +14,15 @@ construct HTTP requests and responses. It mostly manages the socket itself.
 """
 from __future__ import absolute_import
 
-import collections
 import datetime
 import socket
 import warnings
 
+try:
+    from collections.abc import Iterable
+except ImportError:  # Python 2
+    from collections import Iterable
+
 import h11
 
 from .base import Request, Response
@@ -34,6 +38,8 @@ from .exceptions import (
 )
 from .packages import six
 from .util import ssl_ as ssl_util
+from .util.request import CompressedBody
+from .util.timeout import current_time
 from .util.unasync import await_if_coro, anext, ASYNC_MODE
 from ._backends._common import LoopAbort
 from ._backends._loader import load_backend, normalize_backend
@@ -53,6 +59,9 @@ _SUPPORTED_VERSIONS = frozenset([b"1.0", b"1.1"])
 # A sentinel object returned when some syscalls return EAGAIN.
 _EAGAIN = object()
 
+# How much of a buffer body to hand to the socket at a time.
+_BUFFER_BLOCK_SIZE = 64 * 1024
+
 
 def _headers_to_native_string(headers):
     """
@@ -98,6 +107,41 @@ async def _read_readable(readable):
         yield datablock
 
 
+def _byte_view(data):
+    """
+    A flat view of the bytes in a buffer, so that slicing it and taking its
+    length count bytes whatever the buffer holds.
+    """
+    view = memoryview(data)
+    if not hasattr(view, "cast"):  # Platform-specific: Python 2.7
+        return view
+    try:
+        return view.cast("B")
+    except TypeError:
+        # Not contiguous, so it can't be sent without copying anyway.
+        return memoryview(view.tobytes())
+
+
+def _is_buffer(obj):
+    try:
+        memoryview(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def _body_chunk(chunk):
+    """
+    Check a chunk from an iterable body, and view it as bytes if it's some
+    other kind of buffer.
+    """
+    if isinstance(chunk, bytes):
+        return chunk
+    elif isinstance(chunk, six.text_type):
+        raise InvalidBodyError("Unacceptable body chunk type: %s" % type(chunk))
+    return _byte_view(chunk)
+
+
 def _make_body_iterable(body):
     """
     This function turns all possible body types that Hip supports into an
@@ -106,9 +150,16 @@ def _make_body_iterable(body):
 
     The basic logic here is:
         - byte strings are turned into single-element lists
+        - other objects supporting the buffer protocol, such as ``bytearray``,
+          ``memoryview`` and ``mmap``, are sent in slices of a view of their
+          memory, without copying them (an ``mmap`` is sent whole, whatever
+          its current position)
         - readables are wrapped in an iterable that repeatedly calls read until
           nothing is returned anymore
-        - other iterables are used directly
+        - a :class:`~hip.util.request.CompressedBody` is turned into an
+          iterable of its body, compressed chunk by chunk
+        - other iterables, including async iterables in async mode, are used
+          directly
         - anything else is not acceptable
 
     In particular, note that we do not support *text* data of any kind. This
@@ -121,36 +172,63 @@ def _make_body_iterable(body):
             return
         elif isinstance(body, bytes):
             yield body
+        elif isinstance(body, six.text_type):
+            raise InvalidBodyError("Unacceptable body type: %s" % type(body))
+        elif isinstance(body, CompressedBody):
+            compressor = body.compressor()
+            async for chunk in _make_body_iterable(body.body):
+                chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            chunk = compressor.flush()
+            if chunk:
+                yield chunk
+        elif _is_buffer(body):
+            view = _byte_view(body)
+            for start in range(0, len(view), _BUFFER_BLOCK_SIZE):
+                yield view[start : start + _BUFFER_BLOCK_SIZE]
         elif hasattr(body, "read"):
             async for chunk in _read_readable(body):
                 yield chunk
-        elif isinstance(body, collections.Iterable) and not isinstance(
-            body, six.text_type
-        ):
+        elif hasattr(body, "__aiter__"):
+            async for chunk in body:
+                yield _body_chunk(chunk)
+        elif isinstance(body, Iterable):
             for chunk in body:
-                yield chunk
+                yield _body_chunk(chunk)
         else:
             raise InvalidBodyError("Unacceptable body type: %s" % type(body))
 
     return generator().__aiter__()
 
 
-def _request_bytes_iterable(request, state_machine):
+def _h11_request(request):
+    return h11.Request(
+        method=request.method,
+        target=request.target,
+        headers=_stringify_headers(request.headers.items()),
+    )
+
+
+def _request_bytes_iterable(request, state_machine, include_head=True):
     """
-    An iterable that serialises a set of bytes for the body.
+    An iterable that serialises a set of bytes for the body. If
+    ``include_head`` is False, the request head is assumed to have been sent
+    already, and only the body is serialised.
     """
 
     def all_pieces_iter():
         async def generator():
-            h11_request = h11.Request(
-                method=request.method,
-                target=request.target,
-                headers=_stringify_headers(request.headers.items()),
-            )
-            yield state_machine.send(h11_request)
+            if include_head:
+                yield state_machine.send(_h11_request(request))
 
+            # Pass the chunks themselves through rather than letting h11 join
+            # them to its framing, which would copy them.
             async for chunk in _make_body_iterable(request.body):
-                yield state_machine.send(h11.Data(data=chunk))
+                for piece in state_machine.send_with_data_passthrough(
+                    h11.Data(data=chunk)
+                ):
+                    yield piece
 
             yield state_machine.send(h11.EndOfMessage())
 
@@ -163,9 +241,12 @@ def _request_bytes_iterable(request, state_machine):
         # As long as all_pieces_iter() yields at least two messages, this should
         # never raise StopIteration.
         remaining_pieces = all_pieces_iter()
-        first_packet_bytes = (await anext(remaining_pieces)) + (
-            await anext(remaining_pieces)
-        )
+        if include_head:
+            first_packet_bytes = (await anext(remaining_pieces)) + (
+                await anext(remaining_pieces)
+            )
+        else:
+            first_packet_bytes = b""
 
         async def all_pieces_combined_iter():
             yield first_packet_bytes
@@ -234,7 +315,77 @@ def _build_tunnel_request(host, port, headers):
     return tunnel_request
 
 
-async def _start_http_request(request, state_machine, sock, read_timeout=None):
+async def _send_pieces(pieces, state_machine, sock, read_timeout):
+    """
+    Send ``pieces`` without waiting for a response, keeping anything that
+    arrives meanwhile in the state machine.
+    """
+
+    async def produce_bytes():
+        if not pieces:
+            # Don't wait around for data to arrive once everything is sent.
+            raise LoopAbort
+        return pieces.pop(0)
+
+    await sock.send_and_receive_for_a_while(
+        produce_bytes, state_machine.receive_data, read_timeout
+    )
+
+
+async def _expect_continue(request, state_machine, sock, read_timeout, wait):
+    """
+    Send the head of a request that has ``Expect: 100-continue`` and wait up to
+    ``wait`` seconds for ``100 Continue``, or for the server to reject the
+    request before seeing its body.
+
+    Returns the final response in the second case, or None if the body should
+    be sent: the server said so, or didn't answer in time, which is what
+    servers that don't know about ``100-continue`` do.
+    """
+    h11_request = _h11_request(request)
+    await _send_pieces(
+        [state_machine.send(h11_request)], state_machine, sock, read_timeout
+    )
+
+    give_up_at = current_time() + wait
+    while True:
+        event = state_machine.next_event()
+        if event is h11.NEED_DATA:
+            time_left = give_up_at - current_time()
+            if time_left <= 0 or not await sock.wait_readable(time_left):
+                return None
+            # Something to read doesn't have to be something for h11, such as
+            # a TLS 1.3 session ticket, so don't wait for more of it than
+            # what's left of ``wait`` either.
+            try:
+                data = await sock.receive_some(max(give_up_at - current_time(), 0))
+            except socket.timeout:
+                return None
+            state_machine.receive_data(data)
+        elif isinstance(event, h11.InformationalResponse):
+            if event.status_code == 100:
+                return None
+        elif isinstance(event, h11.Response):
+            break
+        else:
+            # Can't happen
+            raise RuntimeError("Unexpected h11 event {}".format(event))
+
+    # The request has been rejected. A chunked body can be ended right away,
+    # which leaves the connection usable for the next request, but a body
+    # with a Content-Length can't be cut short, so the connection has to go.
+    # (h11 only allows "chunked" as a transfer-encoding.)
+    if any(name == b"transfer-encoding" for name, _ in h11_request.headers):
+        eom = state_machine.send(h11.EndOfMessage())
+        await _send_pieces([eom], state_machine, sock, read_timeout)
+    else:
+        state_machine.send_failed()
+    return event
+
+
+async def _start_http_request(
+    request, state_machine, sock, read_timeout=None, expect_continue=None
+):
     """
     Send the request using the given state machine and connection, wait
     for the response headers, and return them.
@@ -243,6 +394,10 @@ async def _start_http_request(request, state_machine, sock, read_timeout=None):
     immediately, poisoning the state machine along the way so that we know
     it can't be re-used.
 
+    If ``expect_continue`` is a number of seconds and the request has a body,
+    the head is sent on its own first, and the body only once the server asks
+    for it or that time passes (see :func:`_expect_continue`).
+
     This is a standalone function because we use it both to set up both
     CONNECT requests and real requests.
     """
@@ -253,7 +408,18 @@ async def _start_http_request(request, state_machine, sock, read_timeout=None):
     ):
         raise ProtocolError("Invalid internal state transition")
 
-    request_bytes_iterable = _request_bytes_iterable(request, state_machine)
+    include_head = True
+    if expect_continue is not None and request.body is not None:
+        h11_response = await _expect_continue(
+            request, state_machine, sock, read_timeout, expect_continue
+        )
+        if h11_response is not None:
+            return h11_response
+        include_head = False
+
+    request_bytes_iterable = _request_bytes_iterable(
+        request, state_machine, include_head
+    )
 
     # Hack around Python 2 lack of nonlocal
     context = {"send_aborted": True, "h11_response": None}
@@ -413,12 +579,20 @@ class HTTP1Connection(object):
 
         return sock
 
-    async def send_request(self, request, read_timeout):
+    async def send_request(self, request, read_timeout, expect_continue=None):
         """
         Given a Request object, performs the logic required to get a response.
+
+        If ``expect_continue`` is a number of seconds, a request with a body
+        is sent with ``Expect: 100-continue`` semantics: the body is held
+        back until the server asks for it, or for that long.
         """
         h11_response = await _start_http_request(
-            request, self._state_machine, self._sock, read_timeout
+            request,
+            self._state_machine,
+            self._sock,
+            read_timeout,
+            expect_continue=expect_continue,
         )
         return _response_from_h11(h11_response, self)
 
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import errno
+import functools
 import logging
 import sys
 import warnings
@@ -10,9 +11,11 @@ import socket
 import h11
 
 
+from ._collections import HTTPHeaderDict
 from .base import Request, DEFAULT_PORTS
 from .exceptions import (
     ClosedPoolError,
+    DeadlineExceededError,
     ProtocolError,
     EmptyPoolError,
     LocationValueError,
@@ -31,8 +34,10 @@ from .request import RequestMethods
 from .response import HTTPResponse
 from .connection import HTTP1Connection
 
+from ._backends._loader import load_backend, normalize_backend
 from .util.connection import is_connection_dropped
-from .util.request import set_file_position
+from .util.drain import DrainBudget
+from .util.request import body_length, CompressedBody, RequestState
 from .util.retry import Retry
 from .util.ssl_ import (
     create_ssl_context,
@@ -41,7 +46,8 @@ from .util.ssl_ import (
     resolve_cert_reqs,
     BaseSSLError,
 )
-from .util.timeout import Timeout
+from .util.timeout import Deadline, Timeout, current_time
+from .util.unasync import ASYNC_MODE
 from .util.url import (
     parse_url,
     Url,
@@ -63,12 +69,12 @@ log = logging.getLogger("hip.connectionpool")
 _Default = object()
 
 
-def _add_transport_headers(headers):
+async def _add_transport_headers(headers, body):
     """
-    Adds the transport framing headers, if needed. Naturally, this method
-    cannot add a content-length header, so if there is no content-length header
-    then it will add Transfer-Encoding: chunked instead. Should only be called
-    if there is a body to upload.
+    Adds the transport framing headers, if needed: a content-length header if
+    the size of the body can be worked out, or Transfer-Encoding: chunked if
+    it can't. Should only be called if there is a body to upload. Returns a
+    copy of ``headers`` if it had to change them.
 
     This should be a bit smarter: in particular, it should allow for bad or
     unexpected versions of these headers, particularly transfer-encoding.
@@ -76,9 +82,15 @@ def _add_transport_headers(headers):
     transfer_headers = ("content-length", "transfer-encoding")
     for header_name in headers:
         if header_name.lower() in transfer_headers:
-            return
+            return headers
 
-    headers["transfer-encoding"] = "chunked"
+    headers = headers.copy()
+    length = await body_length(body)
+    if length is None:
+        headers["transfer-encoding"] = "chunked"
+    else:
+        headers["content-length"] = str(length)
+    return headers
 
 
 def _build_context(
@@ -204,6 +216,16 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
     :param retries:
         Retry configuration to use by default with requests in this pool.
 
+    :param drain_budget:
+        A :class:`~hip.util.drain.DrainBudget` limiting how much of a
+        discarded response body (e.g. one being retried) is read so that its
+        connection can be reused. Defaults to ``DrainBudget.DEFAULT``.
+
+    :param body_limits:
+        A :class:`~hip.util.limits.BodyLimits` limiting the size of response
+        bodies, unless a request gives its own ``body_limits``. Defaults to
+        no limits.
+
     :param _proxy:
         Parsed proxy URL, should not be used directly, instead, see
         :class:`hip.connectionpool.ProxyManager`"
@@ -232,6 +254,8 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
         retries=None,
         _proxy=None,
         _proxy_headers=None,
+        drain_budget=None,
+        body_limits=None,
         **conn_kw
     ):
         ConnectionPool.__init__(self, host, port)
@@ -243,8 +267,13 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
         if retries is None:
             retries = Retry.DEFAULT
 
+        if drain_budget is None:
+            drain_budget = DrainBudget.DEFAULT
+
         self.timeout = timeout
         self.retries = retries
+        self.drain_budget = drain_budget
+        self.body_limits = body_limits
 
         self.pool = self.QueueCls(maxsize)
         self.block = block
@@ -388,7 +417,14 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
             )
 
     async def _make_request(
-        self, conn, method, url, timeout=_Default, body=None, headers=None
+        self,
+        conn,
+        method,
+        url,
+        timeout=_Default,
+        body=None,
+        headers=None,
+        expect_continue=None,
     ):
         """
         Perform a request on a given urllib connection object taken from our
@@ -403,6 +439,10 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
             the socket connect and the socket read, or an instance of
             :class:`hip.util.Timeout`, which gives you more fine-grained
             control over your timeouts.
+
+        :param expect_continue:
+            Seconds to wait for ``100 Continue`` before sending the body, or
+            None to send it straight away.
         """
         self.num_requests += 1
 
@@ -419,6 +459,8 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
 
         # TODO: We need to encapsulate our proxy logic in here somewhere.
         request = Request(method=method, target=url, headers=headers, body=body)
+        if expect_continue is not None and body is not None:
+            request.headers["Expect"] = "100-continue"
 
         host = self.host
         port = self.port
@@ -449,7 +491,9 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
 
         # Receive the response from the server
         try:
-            response = await conn.send_request(request, read_timeout=read_timeout)
+            response = await conn.send_request(
+                request, read_timeout=read_timeout, expect_continue=expect_continue
+            )
         except (SocketTimeout, BaseSSLError, SocketError) as e:
             self._raise_timeout(err=e, url=url, timeout_value=read_timeout)
             raise
@@ -468,6 +512,52 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
 
         return response
 
+    def _load_backend(self):
+        return load_backend(normalize_backend(self.conn_kw.get("backend"), ASYNC_MODE))
+
+    async def _drain_and_release_conn(self, response):
+        # discard any remaining response body and release the connection back
+        # to the pool, or close it if the body doesn't fit in the drain budget
+        await response.drain_conn(self.drain_budget)
+
+    async def _hedged_urlopen(self, hedge, method, url, preload_content=True, **kw):
+        """
+        Send up to ``hedge.max_hedges + 1`` copies of a request, staggered by
+        the hedge delay, and return whichever gets its response headers
+        first. See :class:`hip.util.hedge.Hedge`.
+        """
+
+        async def attempt():
+            start = current_time()
+            response = await self.urlopen(method, url, preload_content=False, **kw)
+            hedge.record_latency(current_time() - start)
+            return response
+
+        backend = self._load_backend()
+        response = await backend.staggered_race(
+            [attempt] * (hedge.max_hedges + 1),
+            hedge.get_delay(),
+            self._drain_and_release_conn,
+        )
+
+        if preload_content:
+            await response.preload_content()
+
+        return response
+
+    async def _request_rest(self, url, headers, offset, validator, **kw):
+        """
+        Request the body of a ``GET`` response from ``offset`` on, provided
+        the resource still matches ``validator``. See ``resume`` in
+        :meth:`urlopen`.
+        """
+        headers = HTTPHeaderDict(headers)
+        headers["Range"] = "bytes=%d-" % offset
+        headers["If-Range"] = validator
+        return await self.urlopen(
+            "GET", url, headers=headers, preload_content=False, **kw
+        )
+
     def _absolute_url(self, path):
         return Url(scheme=self.scheme, host=self.host, port=self.port, path=path).url
 
@@ -524,6 +614,10 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
         pool_timeout=None,
         body_pos=None,
         preload_content=True,
+        hedge=None,
+        deadline=None,
+        expect_continue=None,
+        resume=None,
         **response_kw
     ):
         """
@@ -583,6 +677,40 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
         :param preload_content:
             If True, the response's body will be preloaded during construction.
 
+        :param hedge:
+            A :class:`~hip.util.hedge.Hedge` describing when to send extra
+            copies of an idempotent request if its response headers are slow
+            to arrive. Disabled by default.
+
+        :param deadline:
+            A :class:`~hip.util.timeout.Deadline`, or a number of seconds from
+            now, by which the whole request must be finished: every retry,
+            the sleeps between them, and reading the response body.
+
+        :param expect_continue:
+            A number of seconds to hold back the request body for, waiting
+            for the server to accept the request. The request is sent with
+            ``Expect: 100-continue``, and the body follows once the server
+            answers ``100 Continue`` or the time passes. If the server
+            rejects the request first (say with a ``401`` or ``413``), its
+            response is returned without the body being sent at all. Only
+            affects requests with a body; disabled by default.
+
+            A chunked body can be ended early, so the connection is reused
+            after a rejection, but a body sent with a ``Content-Length`` can't
+            be, so its connection is closed.
+
+        :param int resume:
+            How many times to resume the body of a ``GET`` response if the
+            connection breaks while it's being read. Instead of raising
+            :class:`~hip.exceptions.ProtocolError`, the rest of the body is
+            requested with a ``Range`` header, and reading carries on from
+            the new response as if nothing happened. ``If-Range`` makes sure
+            the rest comes from the same version of the resource; if it has
+            changed, :class:`~hip.exceptions.ResourceChangedError` is raised.
+            Only responses with a strong ``ETag`` or a ``Last-Modified``
+            header can be resumed. Disabled by default.
+
         :param \\**response_kw:
             Additional parameters are passed to
             :meth:`hip.response.HTTPResponse.from_base`
@@ -590,21 +718,48 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
         if headers is None:
             headers = self.headers
 
+        deadline = Deadline.from_float(deadline)
+
+        if hedge is not None and hedge.is_hedgeable(method, body):
+            return await self._hedged_urlopen(
+                hedge,
+                method,
+                url,
+                body=body,
+                headers=headers,
+                retries=retries,
+                timeout=timeout,
+                pool_timeout=pool_timeout,
+                body_pos=body_pos,
+                preload_content=preload_content,
+                deadline=deadline,
+                expect_continue=expect_continue,
+                resume=resume,
+                **response_kw
+            )
+
         if not isinstance(retries, Retry):
             retries = Retry.from_int(retries, default=self.retries, redirect=False)
 
+        resume_request = None
+        if resume and method == "GET":
+            resume_request = functools.partial(
+                self._request_rest,
+                url,
+                headers,
+                retries=retries,
+                timeout=timeout,
+                pool_timeout=pool_timeout,
+                deadline=deadline,
+                **response_kw
+            )
+
         # Ensure that the URL we're connecting to is properly encoded
         if url.startswith("/"):
             url = six.ensure_str(_encode_target(url))
         else:
             url = six.ensure_str(parse_url(url).url)
 
-        conn = None
-
-        # Track whether `conn` needs to be released before
-        # returning/raising/recursing.
-        release_this_conn = False
-
         # Merge the proxy headers. Only do this in HTTP. We have to copy the
         # headers dict so we can safely change it without those changes being
         # reflected in anyone else's copy.
@@ -612,152 +767,180 @@ class HTTPConnectionPool(ConnectionPool, RequestMethods):
             headers = headers.copy()
             headers.update(self.proxy_headers)
 
-        # Must keep the exception bound to a separate variable or else Python 3
-        # complains about UnboundLocalError.
-        err = None
-
-        # Keep track of whether we cleanly exited the except block. This
-        # ensures we do proper cleanup in finally.
-        clean_exit = False
-
-        # Rewind body position, if needed. Record current position
-        # for future rewinds in the event of a redirect/retry.
-        body_pos = await set_file_position(body, body_pos)
+        if isinstance(body, CompressedBody):
+            headers = body.prepare_headers(headers)
 
         if body is not None:
-            _add_transport_headers(headers)
-
-        try:
-            # Request a connection from the queue.
-            timeout_obj = self._get_timeout(timeout)
-            conn = await self._get_conn(timeout=pool_timeout)
+            headers = await _add_transport_headers(headers, body)
 
-            conn.timeout = timeout_obj.connect_timeout
+        state = RequestState(
+            method,
+            url,
+            body=body,
+            headers=headers,
+            retries=retries,
+            body_pos=body_pos,
+            deadline=deadline,
+        )
 
-            # Make the request on the base connection object.
-            base_response = await self._make_request(
-                conn, method, url, timeout=timeout_obj, body=body, headers=headers
-            )
+        # Each pass through this loop is one attempt at the request. Retries
+        # go round again rather than recursing, so a long run of retries
+        # doesn't grow the stack.
+        while True:
+            retries = state.retries
+            conn = None
 
-            # Pass method to Response for length checking
-            response_kw["request_method"] = method
+            # Track whether `conn` needs to be released before
+            # returning/raising/retrying.
+            release_this_conn = False
 
-            # Import httplib's response into our own wrapper object
-            response = self.ResponseCls.from_base(
-                base_response, pool=self, retries=retries, **response_kw
-            )
-            # If requested, preload the body.
-            if preload_content:
-                await response.preload_content()
+            # Must keep the exception bound to a separate variable or else
+            # Python 3 complains about UnboundLocalError.
+            err = None
 
-            # Everything went great!
-            clean_exit = True
-
-        except queue.Empty:
-            # Timed out by queue.
-            raise EmptyPoolError(self, "No pool connections are available.")
-
-        except (
-            TimeoutError,
-            SocketError,
-            ProtocolError,
-            h11.ProtocolError,
-            BaseSSLError,
-            SSLError,
-            CertificateError,
-        ) as e:
-            # Discard the connection for these exceptions. It will be
-            # replaced during the next _get_conn() call.
+            # Keep track of whether we cleanly exited the except block. This
+            # ensures we do proper cleanup in finally.
             clean_exit = False
 
-            if isinstance(e, (BaseSSLError, CertificateError)):
-                e = SSLError(e)
-            elif isinstance(e, (SocketError, NewConnectionError)) and self.proxy:
-                e = ProxyError("Cannot connect to proxy.", e)
-            elif isinstance(e, (SocketError, h11.ProtocolError)):
-                e = ProtocolError("Connection aborted.", e)
+            # Rewind body position, if needed. Record current position
+            # for future rewinds in the event of a redirect/retry.
+            await state.rewind_body()
 
-            retries = retries.increment(
-                method, url, error=e, _pool=self, _stacktrace=sys.exc_info()[2]
-            )
-            retries.sleep()
-
-            # Keep track of the error for the retry warning.
-            err = e
-
-        finally:
-            if not clean_exit:
-                # We hit some kind of exception, handled or otherwise. We need
-                # to throw the connection away unless explicitly told not to.
-                # Close the connection, set the variable to None, and make sure
-                # we put the None back in the pool to avoid leaking it.
-                conn = conn and conn.close()
-                release_this_conn = True
-
-            if release_this_conn:
-                # Put the connection back to be reused. If the connection is
-                # expired then it will be None, which will get replaced with a
-                # fresh connection during _get_conn.
-                self._put_conn(conn)
-
-        if not conn:
-            # Try again
-            log.warning(
-                "Retrying (%r) after connection broken by '%r': %s", retries, err, url
-            )
-            return await self.urlopen(
-                method,
-                url,
-                body,
-                headers,
-                retries,
-                timeout=timeout,
-                pool_timeout=pool_timeout,
-                body_pos=body_pos,
-                preload_content=preload_content,
-                **response_kw
-            )
+            if deadline is not None:
+                deadline.check(self, url)
 
-        async def drain_and_release_conn(response):
             try:
-                # discard any remaining response body, the connection will be
-                # released back to the pool once the entire response is read
-                await response.read()
-            except (TimeoutError, SocketError, ProtocolError, BaseSSLError, SSLError):
-                pass
-
-        # Check if we should retry the HTTP response.
-        has_retry_after = bool(response.getheader("Retry-After"))
-        if retries.is_retry(method, response.status, has_retry_after):
+                # Request a connection from the queue.
+                timeout_obj = self._get_timeout(timeout)
+                attempt_pool_timeout = pool_timeout
+                if deadline is not None:
+                    timeout_obj = deadline.clamp_timeout(timeout_obj)
+                    attempt_pool_timeout = deadline.clamp(pool_timeout)
+                conn = await self._get_conn(timeout=attempt_pool_timeout)
+
+                conn.timeout = timeout_obj.connect_timeout
+
+                # Make the request on the base connection object.
+                base_response = await self._make_request(
+                    conn,
+                    method,
+                    url,
+                    timeout=timeout_obj,
+                    body=body,
+                    headers=headers,
+                    expect_continue=expect_continue,
+                )
+
+                # Pass method to Response for length checking
+                response_kw["request_method"] = method
+                response_kw.setdefault("body_limits", self.body_limits)
+
+                # Import httplib's response into our own wrapper object
+                response = self.ResponseCls.from_base(
+                    base_response,
+                    pool=self,
+                    retries=retries,
+                    deadline=deadline,
+                    timeout=timeout_obj,
+                    resume=resume,
+                    resume_request=resume_request,
+                    **response_kw
+                )
+                # If requested, preload the body.
+                if preload_content:
+                    await response.preload_content()
+
+                # Everything went great!
+                clean_exit = True
+
+            except queue.Empty:
+                # Timed out by queue.
+                raise EmptyPoolError(self, "No pool connections are available.")
+
+            except DeadlineExceededError:
+                # Not worth retrying.
+                raise
+
+            except (
+                TimeoutError,
+                SocketError,
+                ProtocolError,
+                h11.ProtocolError,
+                BaseSSLError,
+                SSLError,
+                CertificateError,
+            ) as e:
+                # Discard the connection for these exceptions. It will be
+                # replaced during the next _get_conn() call.
+                clean_exit = False
+
+                # A timeout may have been cut short by the deadline.
+                if deadline is not None:
+                    deadline.check(self, url)
+
+                if isinstance(e, (BaseSSLError, CertificateError)):
+                    e = SSLError(e)
+                elif isinstance(e, (SocketError, NewConnectionError)) and self.proxy:
+                    e = ProxyError("Cannot connect to proxy.", e)
+                elif isinstance(e, (SocketError, h11.ProtocolError)):
+                    e = ProtocolError("Connection aborted.", e)
+
+                state.retries = retries.increment(
+                    method, url, error=e, _pool=self, _stacktrace=sys.exc_info()[2]
+                )
+                state.retries.sleep(deadline=deadline)
+
+                # Keep track of the error for the retry warning.
+                err = e
+
+            finally:
+                if not clean_exit:
+                    # We hit some kind of exception, handled or otherwise. We
+                    # need to throw the connection away unless explicitly told
+                    # not to. Close the connection, set the variable to None,
+                    # and make sure we put the None back in the pool to avoid
+                    # leaking it.
+                    conn = conn and conn.close()
+                    release_this_conn = True
+
+                if release_this_conn:
+                    # Put the connection back to be reused. If the connection
+                    # is expired then it will be None, which will get replaced
+                    # with a fresh connection during _get_conn.
+                    self._put_conn(conn)
+
+            if not conn:
+                # Try again
+                log.warning(
+                    "Retrying (%r) after connection broken by '%r': %s",
+                    state.retries,
+                    err,
+                    url,
+                )
+                continue
+
+            # Check if we should retry the HTTP response.
+            has_retry_after = bool(response.getheader("Retry-After"))
+            if not retries.is_retry(method, response.status, has_retry_after):
+                return response
+
             try:
-                retries = retries.increment(method, url, response=response, _pool=self)
+                state.retries = retries.increment(
+                    method, url, response=response, _pool=self
+                )
             except MaxRetryError:
                 if retries.raise_on_status:
                     # Drain and release the connection for this response, since
                     # we're not returning it to be released manually.
-                    await drain_and_release_conn(response)
+                    await self._drain_and_release_conn(response)
                     raise
                 return response
 
-            # drain and return the connection to the pool before recursing
-            await drain_and_release_conn(response)
+            # drain and return the connection to the pool before retrying
+            await self._drain_and_release_conn(response)
 
-            retries.sleep(response)
+            state.retries.sleep(response, deadline=deadline)
             log.debug("Retry: %s", url)
-            return await self.urlopen(
-                method,
-                url,
-                body,
-                headers,
-                retries=retries,
-                timeout=timeout,
-                pool_timeout=pool_timeout,
-                body_pos=body_pos,
-                preload_content=preload_content,
-                **response_kw
-            )
-
-        return response
 
 
 class HTTPSConnectionPool(HTTPConnectionPool):
@@ -802,6 +985,8 @@ class HTTPSConnectionPool(HTTPConnectionPool):
         ca_cert_dir=None,
         ssl_context=None,
         server_hostname=None,
+        drain_budget=None,
+        body_limits=None,
         **conn_kw
     ):
 
@@ -816,6 +1001,8 @@ class HTTPSConnectionPool(HTTPConnectionPool):
             retries,
             _proxy,
             _proxy_headers,
+            drain_budget=drain_budget,
+            body_limits=body_limits,
             **conn_kw
         )
 
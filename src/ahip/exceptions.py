@@ -115,6 +115,11 @@ class NewConnectionError(ConnectTimeoutError, PoolError):
     pass
 
 
+class DeadlineExceededError(TimeoutError, RequestError):
+    "Raised when a request's :class:`~hip.util.timeout.Deadline` passes."
+    pass
+
+
 class EmptyPoolError(PoolError):
     "Raised when a pool runs out of connections and no more are allowed."
     pass
@@ -125,6 +130,11 @@ class ClosedPoolError(PoolError):
     pass
 
 
+class CircuitOpenError(RequestError):
+    "Raised when a request is refused because the origin's circuit breaker is open."
+    pass
+
+
 class LocationValueError(ValueError, HTTPError):
     "Raised when there is something wrong with a given URL input."
     pass
@@ -239,3 +249,26 @@ class InvalidBodyError(HTTPError):
     """
 
     pass
+
+
+class BodyTooLargeError(HTTPError):
+    "Raised when a response body exceeds its :class:`~hip.util.limits.BodyLimits`."
+    pass
+
+
+class ResourceChangedError(HTTPError):
+    """
+    Raised when a resource being fetched in byte ranges changes part way
+    through, so the ranges already fetched can't be combined with the rest.
+    """
+
+    pass
+
+
+class DigestMismatchError(HTTPError):
+    """
+    Raised when a response body doesn't have the digest that a
+    :class:`~hip.util.digest.BodyDigest` expects.
+    """
+
+    pass
@@ -1,16 +1,12 @@
 from __future__ import absolute_import
 import binascii
-import codecs
+import io
 import os
 
-from io import BytesIO
-
 from .packages import six
 from .packages.six import b
 from .fields import RequestField
 
-writer = codecs.lookup("utf-8")[3]
-
 
 def choose_boundary():
     """
@@ -42,9 +38,47 @@ def iter_field_objects(fields):
             yield RequestField.from_tuples(*field)
 
 
-def encode_multipart_formdata(fields, boundary=None):
+def _remaining_length(fileobj):
     """
-    Encode a dictionary of ``fields`` using the multipart/form-data MIME format.
+    Number of bytes left to read from ``fileobj``, or None if it can't be
+    told without reading it.
+    """
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+    try:
+        position = fileobj.tell()
+        fileobj.seek(0, 2)
+        end = fileobj.tell()
+        fileobj.seek(position)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    return end - position
+
+
+class MultipartEncoder(object):
+    """
+    A ``multipart/form-data`` request body that is produced as it is read,
+    rather than all at once like :func:`encode_multipart_formdata`.
+
+    Field values may be file objects opened in binary mode, as well as text
+    or bytes. A file's contents are read from where the file is positioned
+    when the encoder is made, a block at a time as the request is sent, so
+    uploading even very large files takes little memory::
+
+        with open('video.mp4', 'rb') as f:
+            encoder = MultipartEncoder({'title': 'Holiday', 'file': ('video.mp4', f)})
+            http.request('POST', 'http://example.com/upload', body=encoder,
+                         headers={'Content-Type': encoder.content_type,
+                                  'Content-Length': str(encoder.content_length)})
+
+    :meth:`~hip.request.RequestMethods.request_encode_body` does this for
+    you.
+
+    The encoder is a file-like object with ``read``, ``tell`` and ``seek``,
+    so the body can be rewound and sent again on a retry or redirect (as
+    long as the files can be rewound too).
 
     :param fields:
         Dictionary of fields or list of (key, :class:`~hip.fields.RequestField`).
@@ -53,28 +87,119 @@ def encode_multipart_formdata(fields, boundary=None):
         If not specified, then a random boundary will be generated using
         :func:`hip.filepost.choose_boundary`.
     """
-    body = BytesIO()
-    if boundary is None:
-        boundary = choose_boundary()
-
-    for field in iter_field_objects(fields):
-        body.write(b("--%s\r\n" % (boundary)))
 
-        writer(body).write(field.render_headers())
-        data = field.data
+    def __init__(self, fields, boundary=None):
+        if boundary is None:
+            boundary = choose_boundary()
+        self.boundary = boundary
+        self.content_type = str("multipart/form-data; boundary=%s" % boundary)
+
+        # Runs of bytes are joined together; files are kept with the position
+        # to rewind them to.
+        self._parts = []
+        pending = []
+        for field in iter_field_objects(fields):
+            pending.append(b("--%s\r\n" % (boundary)))
+            pending.append(field.render_headers().encode("utf-8"))
+            data = field.data
+
+            if isinstance(data, int):
+                data = str(data)  # Backwards compatibility
+
+            if isinstance(data, six.text_type):
+                data = data.encode("utf-8")
+
+            if hasattr(data, "read"):
+                self._parts.append(b"".join(pending))
+                self._parts.append((data, data.tell()))
+                pending = []
+            else:
+                pending.append(data)
+
+            pending.append(b"\r\n")
+
+        pending.append(b("--%s--\r\n" % (boundary)))
+        self._parts.append(b"".join(pending))
+
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+
+    @property
+    def content_length(self):
+        """
+        The length of the whole body, or None if the size of a file can't be
+        told.
+        """
+        length = 0
+        for part in self._parts[self._index :]:
+            if isinstance(part, bytes):
+                length += len(part)
+            else:
+                remaining = _remaining_length(part[0])
+                if remaining is None:
+                    return None
+                length += remaining
+        return self._position + length - self._offset
+
+    def read(self, amt=-1):
+        """
+        Read up to ``amt`` bytes of the body, or all of the rest of it if
+        ``amt`` is negative or omitted.
+        """
+        chunks = []
+        size = 0
+        while self._index < len(self._parts) and (amt < 0 or size < amt):
+            part = self._parts[self._index]
+            want = -1 if amt < 0 else amt - size
+            if isinstance(part, bytes):
+                end = len(part) if want < 0 else self._offset + want
+                chunk = part[self._offset : end]
+                self._offset += len(chunk)
+                if self._offset >= len(part):
+                    self._index += 1
+                    self._offset = 0
+            else:
+                chunk = part[0].read(want)
+                if not chunk:
+                    self._index += 1
+                    continue
+            chunks.append(chunk)
+            size += len(chunk)
+
+        self._position += size
+        return b"".join(chunks)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        """
+        Rewind to the start of the body. Seeking anywhere else isn't
+        supported.
+        """
+        if offset != 0 or whence != 0:
+            raise io.UnsupportedOperation("can only seek to the start")
+        for part in self._parts:
+            if not isinstance(part, bytes):
+                fileobj, start = part
+                fileobj.seek(start)
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+        return 0
 
-        if isinstance(data, int):
-            data = str(data)  # Backwards compatibility
 
-        if isinstance(data, six.text_type):
-            writer(body).write(data)
-        else:
-            body.write(data)
-
-        body.write(b"\r\n")
-
-    body.write(b("--%s--\r\n" % (boundary)))
+def encode_multipart_formdata(fields, boundary=None):
+    """
+    Encode a dictionary of ``fields`` using the multipart/form-data MIME format.
 
-    content_type = str("multipart/form-data; boundary=%s" % boundary)
+    :param fields:
+        Dictionary of fields or list of (key, :class:`~hip.fields.RequestField`).
 
-    return body.getvalue(), content_type
+    :param boundary:
+        If not specified, then a random boundary will be generated using
+        :func:`hip.filepost.choose_boundary`.
+    """
+    encoder = MultipartEncoder(fields, boundary=boundary)
+    return encoder.read(), encoder.content_type
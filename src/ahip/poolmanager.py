@@ -2,17 +2,40 @@ from __future__ import absolute_import
 import collections
 import functools
 import logging
+import os
+from socket import error as SocketError
 
-from ._collections import RecentlyUsedContainer
+from ._backends._loader import load_backend, normalize_backend
+from ._collections import HTTPHeaderDict, RecentlyUsedContainer
 from .base import DEFAULT_PORTS
 from .connectionpool import HTTPConnectionPool, HTTPSConnectionPool
-from .exceptions import LocationValueError, MaxRetryError, ProxySchemeUnknown
+from .exceptions import (
+    DeadlineExceededError,
+    LocationValueError,
+    MaxRetryError,
+    ProtocolError,
+    ProxySchemeUnknown,
+    ResourceChangedError,
+    TimeoutError,
+)
 from .packages import six
 from .packages.six.moves.urllib.parse import urljoin
 from .request import RequestMethods
+from .response import BytesBody, HTTPResponse
 from .util.url import parse_url
-from .util.request import set_file_position
+from .util.ranges import (
+    check_range,
+    if_range_validator,
+    parse_content_range,
+    preallocate,
+    split_ranges,
+    write_at,
+)
+from .util.digest import digests_from_headers
+from .util.request import RequestState
 from .util.retry import Retry
+from .util.timeout import Deadline
+from .util.unasync import ASYNC_MODE
 
 
 __all__ = ["PoolManager", "ProxyManager", "proxy_from_url"]
@@ -20,6 +43,40 @@ __all__ = ["PoolManager", "ProxyManager", "proxy_from_url"]
 
 log = logging.getLogger("hip.poolmanager")
 
+# Downloads are written as they come, on Windows too.
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+
+def _unlink(path):
+    """
+    Remove the partly written download at ``path``, if it's still there.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _check_file(path, digests):
+    """Check the contents of the file at ``path`` against ``digests``."""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            for digest in digests:
+                digest.update(block)
+    for digest in digests:
+        digest.check()
+
+
+# Options for the response that each caller of a coalesced request gets its
+# own copy of. The digests are only computed on those copies.
+_DIGEST_KW = ("digests", "check_digest_headers")
+_RESPONSE_KW = (
+    "decode_content",
+    "body_limits",
+    "deadline",
+    "thread_decode_threshold",
+) + _DIGEST_KW
+
 SSL_KEYWORDS = (
     "key_file",
     "cert_file",
@@ -40,6 +97,8 @@ _key_fields = (
     "key_timeout",  # int or float or Timeout
     "key_retries",  # int or Retry
     "key_block",  # bool
+    "key_drain_budget",  # DrainBudget
+    "key_body_limits",  # BodyLimits
     "key_source_address",  # str
     "key_key_file",  # str
     "key_key_password",  # str
@@ -139,6 +198,32 @@ class PoolManager(RequestMethods):
         Headers to include with all requests, unless other headers are given
         explicitly.
 
+    :param circuit_breaker:
+        A :class:`~hip.util.circuit_breaker.CircuitBreaker` used as a template
+        for per-origin circuit breakers. When set, requests to an origin that
+        keeps failing raise :class:`~hip.exceptions.CircuitOpenError`
+        immediately instead of going through connect timeouts and retries.
+        See :meth:`circuit_breaker_for` to inspect their state. Like pools,
+        at most ``num_pools`` breakers are kept, and the least recently used
+        one is discarded to make room for another, forgetting its state.
+
+    :param single_flight:
+        A :class:`~hip.util.single_flight.SingleFlight`. When set, identical
+        idempotent requests made concurrently share a single upstream
+        request, and each caller gets its own response reading from the
+        shared, buffered body. Streamed requests (``preload_content=False``)
+        aren't coalesced.
+
+    :param cache:
+        A :class:`~hip.cache.HTTPCache`. When set, responses are stored and
+        reused according to their caching headers (RFC 7234), and stale
+        responses are revalidated with conditional requests.
+
+    :param redirect_memo:
+        A :class:`~hip.util.redirect_memo.RedirectMemo`. When set, permanent
+        redirects (301 and 308) are remembered and later requests go straight
+        to the new URL.
+
     :param \\**connection_pool_kw:
         Additional parameters are used to create fresh
         :class:`hip.connectionpool.ConnectionPool` instances.
@@ -156,11 +241,29 @@ class PoolManager(RequestMethods):
 
     proxy = None
 
-    def __init__(self, num_pools=10, headers=None, backend=None, **connection_pool_kw):
+    def __init__(
+        self,
+        num_pools=10,
+        headers=None,
+        backend=None,
+        circuit_breaker=None,
+        single_flight=None,
+        cache=None,
+        redirect_memo=None,
+        **connection_pool_kw
+    ):
         RequestMethods.__init__(self, headers)
         self.connection_pool_kw = connection_pool_kw
         self.pools = RecentlyUsedContainer(num_pools, dispose_func=lambda p: p.close())
 
+        # One breaker per pool key, created lazily from the template.
+        self.circuit_breaker = circuit_breaker
+        self.circuits = RecentlyUsedContainer(num_pools)
+
+        self.single_flight = single_flight
+        self.cache = cache
+        self.redirect_memo = redirect_memo
+
         # Locally set the pool classes and keys so other PoolManagers can
         # override them.
         self.pool_classes_by_scheme = pool_classes_by_scheme
@@ -222,6 +325,16 @@ class PoolManager(RequestMethods):
         needed.
         """
 
+        request_context = self._request_context_for_host(
+            host, port, scheme, pool_kwargs
+        )
+        return self.connection_from_context(request_context)
+
+    def _request_context_for_host(self, host, port, scheme, pool_kwargs=None):
+        """
+        Build the request context used to look up or create the pool for
+        ``host``, ``port`` and ``scheme``.
+        """
         if not host:
             raise LocationValueError("No host specified.")
 
@@ -231,8 +344,12 @@ class PoolManager(RequestMethods):
             port = DEFAULT_PORTS.get(request_context["scheme"].lower(), 80)
         request_context["port"] = port
         request_context["host"] = host
+        return request_context
 
-        return self.connection_from_context(request_context)
+    def _pool_key_for_context(self, request_context):
+        scheme = request_context["scheme"].lower()
+        pool_key_constructor = self.key_fn_by_scheme[scheme]
+        return pool_key_constructor(request_context)
 
     def connection_from_context(self, request_context):
         """
@@ -241,10 +358,7 @@ class PoolManager(RequestMethods):
         ``request_context`` must at least contain the ``scheme`` key and its
         value must be a key in ``key_fn_by_scheme`` instance variable.
         """
-        scheme = request_context["scheme"].lower()
-        pool_key_constructor = self.key_fn_by_scheme[scheme]
-        pool_key = pool_key_constructor(request_context)
-
+        pool_key = self._pool_key_for_context(request_context)
         return self.connection_from_pool_key(pool_key, request_context=request_context)
 
     def connection_from_pool_key(self, pool_key, request_context=None):
@@ -287,6 +401,30 @@ class PoolManager(RequestMethods):
             u.host, port=u.port, scheme=u.scheme, pool_kwargs=pool_kwargs
         )
 
+    def circuit_breaker_for(self, url):
+        """
+        Return the :class:`~hip.util.circuit_breaker.CircuitBreaker` tracking
+        the origin of ``url``, creating it if needed.
+
+        Breakers are keyed by pool key, so every URL that would be served by
+        the same :class:`hip.connectionpool.ConnectionPool` shares a breaker.
+        Returns ``None`` if this manager has no ``circuit_breaker`` configured.
+        """
+        if self.circuit_breaker is None:
+            return None
+
+        u = parse_url(url)
+        request_context = self._request_context_for_host(u.host, u.port, u.scheme)
+        pool_key = self._pool_key_for_context(request_context)
+
+        with self.circuits.lock:
+            breaker = self.circuits.get(pool_key)
+            if breaker is None:
+                breaker = self.circuit_breaker.new()
+                self.circuits[pool_key] = breaker
+
+        return breaker
+
     def _merge_pool_kwargs(self, override):
         """
         Merge a dictionary of override values for self.connection_pool_kw.
@@ -316,62 +454,405 @@ class PoolManager(RequestMethods):
         The given ``url`` parameter must be absolute, such that an appropriate
         :class:`hip.connectionpool.ConnectionPool` can be chosen for it.
         """
-        u = parse_url(url)
-        conn = self.connection_from_host(u.host, port=u.port, scheme=u.scheme)
+        if self.single_flight is not None:
+            request_kw = dict(kw)
+            key = self.single_flight.key_for(
+                method,
+                url,
+                request_kw.pop("headers", self.headers),
+                request_kw.pop("body", None),
+                redirect=redirect,
+                **request_kw
+            )
+            if key is not None:
+                return await self._coalesced_urlopen(key, method, url, redirect, **kw)
 
-        # Rewind body position, if needed. Record current position
-        # for future rewinds in the event of a redirect/retry.
-        body = kw.get("body")
-        body_pos = kw.get("body_pos")
-        kw["body_pos"] = await set_file_position(body, body_pos)
+        return await self._urlopen(method, url, redirect=redirect, **kw)
 
-        if "headers" not in kw:
-            kw["headers"] = self.headers.copy()
+    async def _coalesced_urlopen(
+        self, key, method, url, redirect, preload_content=True, **kw
+    ):
+        """
+        Send a request through ``self.single_flight``, so that concurrent
+        identical requests only reach the server once.
+        """
 
-        if self.proxy is not None and u.scheme == "http":
-            response = await conn.urlopen(method, url, **kw)
-        else:
-            response = await conn.urlopen(method, u.request_uri, **kw)
+        # Each caller's response is decoded, limited and hashed on its own.
+        response_kw = dict((name, kw[name]) for name in _RESPONSE_KW if name in kw)
+        fetch_kw = dict(
+            (name, value) for name, value in kw.items() if name not in _DIGEST_KW
+        )
+
+        async def fetch():
+            response = await self._urlopen(
+                method, url, redirect=redirect, preload_content=False, **fetch_kw
+            )
+            # Keep the body as it came over the wire, so each caller can
+            # decode (or not) its own copy.
+            return response, await response.read(decode_content=False)
+
+        backend = load_backend(normalize_backend(self.backend, ASYNC_MODE))
+        shared, body = await self.single_flight.do(key, fetch, backend)
+
+        response = HTTPResponse(
+            body=BytesBody(body),
+            headers=shared.headers.copy(),
+            status=shared.status,
+            version=shared.version,
+            reason=shared.reason,
+            retries=shared.retries,
+            request_method=method,
+            request_url=shared._request_url,
+            **response_kw
+        )
+        if preload_content:
+            await response.preload_content()
+        return response
 
-        redirect_location = redirect and response.get_redirect_location()
-        if not redirect_location:
-            return response
+    async def _send(self, method, url, **kw):
+        """
+        Send a single request for the absolute ``url`` through the pool for
+        its origin, keeping the origin's circuit breaker up to date. The
+        breaker is consulted first, so a refused request creates no pool.
+        """
+        breaker = self.circuit_breaker_for(url)
+        if breaker is not None:
+            breaker.before_request(url)
 
-        # Support relative URLs for redirecting.
-        redirect_location = urljoin(url, redirect_location)
+        u = parse_url(url)
+        conn = self.connection_from_host(u.host, port=u.port, scheme=u.scheme)
+        recorded = False
+        try:
+            try:
+                if self.proxy is not None and u.scheme == "http":
+                    response = await conn.urlopen(method, url, **kw)
+                else:
+                    response = await conn.urlopen(method, u.request_uri, **kw)
+            except Exception as e:
+                if breaker is not None:
+                    recorded = True
+                    breaker.record(error=e)
+                raise
 
-        # RFC 7231, Section 6.4.4
-        if response.status == 303:
-            method = "GET"
+            if breaker is not None:
+                recorded = True
+                breaker.record(response=response)
+        finally:
+            # Cancelled or interrupted: give back the probe slot, if it took
+            # one, so that the breaker doesn't stay half-open for good.
+            if breaker is not None and not recorded:
+                breaker.record_neutral()
 
-        retries = kw.get("retries")
-        if not isinstance(retries, Retry):
-            retries = Retry.from_int(retries, redirect=redirect)
+        return response
 
+    def _remove_headers_on_redirect(self, is_same_host, retries, location, headers):
         # Strip headers marked as unsafe to forward to the redirected location.
         # Check remove_headers_on_redirect to avoid a potential network call within
         # conn.is_same_host() which may use socket.gethostbyname() in the future.
-        if retries.remove_headers_on_redirect and not conn.is_same_host(
-            redirect_location
-        ):
-            headers = list(six.iterkeys(kw["headers"]))
-            for header in headers:
+        if retries.remove_headers_on_redirect and not is_same_host(location):
+            for header in list(six.iterkeys(headers)):
                 if header.lower() in retries.remove_headers_on_redirect:
-                    kw["headers"].pop(header, None)
+                    headers.pop(header, None)
+
+    def _is_same_pool(self, url, location):
+        """Do requests for ``url`` and ``location`` go to the same pool?"""
+        keys = []
+        for u in (parse_url(url), parse_url(location)):
+            request_context = self._request_context_for_host(u.host, u.port, u.scheme)
+            keys.append(self._pool_key_for_context(request_context))
+        return keys[0] == keys[1]
 
+    def _remembered_redirect(self, state, redirect, followed):
+        """
+        Follow the redirect ``self.redirect_memo`` remembers for
+        ``state.url``, as if the server had just sent it, and return its
+        location. Returns ``None`` if there is none, or if the request
+        wouldn't follow it. ``followed`` are the URLs whose remembered
+        redirects were followed since the last request was sent.
+        """
+        remembered = self.redirect_memo.redirect_for(state.url)
+        if remembered is None:
+            return None
+        location, status = remembered
+        if location in followed or len(followed) >= self.redirect_memo.MAX_CHAIN:
+            return None
+
+        retries = state.retries
+        if not isinstance(retries, Retry):
+            retries = Retry.from_int(retries, redirect=redirect)
+        response = HTTPResponse(status=status, headers={"Location": location})
         try:
-            retries = retries.increment(method, url, response=response, _pool=conn)
+            retries = retries.increment(state.method, state.url, response=response)
         except MaxRetryError:
-            if retries.raise_on_redirect:
+            # Let the server send the redirect, which is then handled as usual.
+            return None
+
+        state.headers = state.headers.copy()
+        self._remove_headers_on_redirect(
+            functools.partial(self._is_same_pool, state.url),
+            retries,
+            location,
+            state.headers,
+        )
+        state.retries = retries
+
+        log.debug("Using remembered redirect %s -> %s", state.url, location)
+        return location
+
+    def _forget_redirects(self, urls):
+        # The remembered redirects led somewhere that doesn't work.
+        for url in urls:
+            self.redirect_memo.forget(url)
+
+    async def _urlopen(self, method, url, redirect=True, **kw):
+        if "headers" not in kw:
+            kw["headers"] = self.headers.copy()
+
+        # Start the clock once for the whole redirect chain.
+        deadline = Deadline.from_float(kw.get("deadline"))
+        if deadline is not None:
+            kw["deadline"] = deadline
+
+        state = RequestState(
+            method,
+            url,
+            body=kw.get("body"),
+            headers=kw["headers"],
+            retries=kw.get("retries"),
+            body_pos=kw.get("body_pos"),
+            deadline=deadline,
+        )
+
+        # Each pass through this loop is one hop of the redirect chain.
+        followed = []
+        while True:
+            url = state.url
+            if self.redirect_memo is not None and redirect:
+                location = self._remembered_redirect(state, redirect, followed)
+                if location is not None:
+                    followed.append(url)
+                    state.url = location
+                    continue
+
+            # Rewind body position, if needed. Record current position
+            # for future rewinds in the event of a redirect/retry.
+            await state.rewind_body()
+
+            kw["headers"] = state.headers
+            kw["body_pos"] = state.body_pos
+            if state.retries is not None:
+                kw["retries"] = state.retries
+
+            try:
+                if self.cache is not None:
+                    response = await self.cache.urlopen(
+                        self._send, state.method, url, **kw
+                    )
+                else:
+                    response = await self._send(state.method, url, **kw)
+            except Exception:
+                self._forget_redirects(followed)
                 raise
-            return response
 
-        kw["retries"] = retries
-        kw["redirect"] = redirect
+            if response.status >= 400:
+                self._forget_redirects(followed)
+            followed = []
+
+            redirect_location = redirect and response.get_redirect_location()
+            if not redirect_location:
+                return response
+
+            # Support relative URLs for redirecting.
+            redirect_location = urljoin(url, redirect_location)
+
+            if self.redirect_memo is not None:
+                self.redirect_memo.remember(url, redirect_location, response.status)
+
+            # RFC 7231, Section 6.4.4
+            if response.status == 303:
+                state.method = "GET"
+
+            retries = state.retries
+            if not isinstance(retries, Retry):
+                retries = Retry.from_int(retries, redirect=redirect)
+
+            self._remove_headers_on_redirect(
+                functools.partial(self._is_same_pool, url),
+                retries,
+                redirect_location,
+                state.headers,
+            )
+
+            try:
+                retries = retries.increment(
+                    state.method, url, response=response, _pool=response._pool
+                )
+            except MaxRetryError:
+                if retries.raise_on_redirect:
+                    await response.drain_conn()
+                    raise
+                return response
+
+            # Give the connection back before following the redirect, so a
+            # chain of redirects doesn't hold one connection per hop.
+            await response.drain_conn()
+
+            state.retries = retries
 
-        retries.sleep_for_retry(response)
-        log.info("Redirecting %s -> %s", url, redirect_location)
-        return await self.urlopen(method, redirect_location, **kw)
+            retries.sleep_for_retry(response, deadline=state.deadline)
+            log.info("Redirecting %s -> %s", url, redirect_location)
+            state.url = redirect_location
+
+    async def download(self, url, dest, parts=4, retries=3, **kw):
+        """
+        Download ``url`` into the file at the path ``dest``, fetching ``parts``
+        byte ranges of it at once over separate connections (as concurrent
+        tasks in async mode, or threads otherwise), so that a large download
+        isn't limited by the throughput of a single connection. Returns the
+        number of bytes written.
+
+        A one byte range is requested first to learn the resource's length
+        and whether the server supports ranges. The file is then allocated at
+        its full size, and each range is written into place as it arrives.
+        A range that fails part way is requested again from where it left
+        off, up to ``retries`` times. ``If-Range`` makes sure every range
+        comes from the same version of the resource, and
+        :class:`~hip.exceptions.ResourceChangedError` is raised if it changes.
+        If the download fails, the partly written file is removed.
+
+        If the server doesn't support ranges, the resource is downloaded in
+        one piece. The body is saved as it was sent, without being decoded.
+
+        ``digests`` and ``check_digest_headers`` apply to the whole resource
+        rather than to each request: the file is checked against them once
+        it's complete, and removed if it doesn't match. As ranges aren't
+        bodies of their own, only the ``Repr-Digest`` and ``Digest`` headers
+        are checked when the resource is downloaded in ranges.
+
+        Additional parameters, such as ``headers`` and ``timeout``, are
+        passed to :meth:`urlopen` for every request.
+        """
+        headers = HTTPHeaderDict(kw.pop("headers", None) or self.headers)
+        digests = kw.pop("digests", None)
+        check_digest_headers = kw.pop("check_digest_headers", False)
+        # Ranges are of the encoded body, so make sure it isn't encoded.
+        headers["Accept-Encoding"] = "identity"
+        kw["preload_content"] = False
+
+        async def get(first=None, last=None, validator=None):
+            request_headers = headers.copy()
+            if first is not None:
+                request_headers["Range"] = "bytes=%d-%d" % (first, last)
+            if validator is not None:
+                request_headers["If-Range"] = validator
+            return await self.urlopen("GET", url, headers=request_headers, **kw)
+
+        response = await get(0, 0)
+        content_range = None
+        if response.status == 206:
+            content_range = parse_content_range(response.headers.get("content-range"))
+        if content_range is None or content_range[2] is None:
+            # Ranges aren't supported, so download it in one piece.
+            if response.status != 200:
+                await response.drain_conn()
+                response = await get()
+            response._add_digests(digests, check_digest_headers)
+            return await self._save_whole(response, dest)
+
+        length = content_range[2]
+        validator = if_range_validator(response.headers)
+        digests = [digest.new() for digest in digests or ()]
+        if check_digest_headers:
+            # Content-MD5 is the digest of the one byte range that was sent.
+            representation = response.headers.copy()
+            representation.discard("content-md5")
+            digests.extend(digests_from_headers(representation))
+        await response.drain_conn()
+
+        backend = load_backend(normalize_backend(self.backend, ASYNC_MODE))
+        retry_on = (
+            MaxRetryError,
+            ProtocolError,
+            TimeoutError,
+            SocketError,
+        ) + backend.connection_errors
+
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0o666)
+        try:
+            preallocate(fd, length)
+            # The number of bytes each range wrote.
+            written = []
+
+            async def fetch(first, last):
+                offset = first
+                failures = 0
+                while offset <= last:
+                    try:
+                        response = await get(offset, last, validator)
+                        try:
+                            check_range(response, offset, length, last)
+                            async for chunk in response.stream(decode_content=False):
+                                if offset + len(chunk) > last + 1:
+                                    raise ProtocolError(
+                                        "Got more than the %d bytes of range %d-%d."
+                                        % (last - first + 1, first, last)
+                                    )
+                                write_at(fd, chunk, offset)
+                                offset += len(chunk)
+                            if offset <= last:
+                                raise ProtocolError(
+                                    "Range %d-%d ended at %d." % (first, last, offset)
+                                )
+                        finally:
+                            await response.drain_conn()
+                    except (DeadlineExceededError, ResourceChangedError):
+                        raise
+                    except retry_on:
+                        failures += 1
+                        if failures > retries:
+                            raise
+                        log.info("Retrying range %d-%d of %s", offset, last, url)
+                written.append(offset - first)
+
+            await backend.gather(
+                [
+                    functools.partial(fetch, first, last)
+                    for first, last in split_ranges(length, parts)
+                ]
+            )
+
+            if sum(written) != length:
+                raise ProtocolError(
+                    "Downloaded %d bytes, expected %d." % (sum(written), length)
+                )
+            if digests:
+                await backend.run_sync_in_worker_thread(_check_file, dest, digests)
+        except BaseException:
+            os.close(fd)
+            _unlink(dest)
+            raise
+        os.close(fd)
+        return length
+
+    async def _save_whole(self, response, dest):
+        """
+        Write the body of ``response`` to the file at ``dest``, checking its
+        status first.
+        """
+        if response.status != 200:
+            await response.drain_conn()
+            raise ProtocolError("Unexpected status %d." % response.status)
+
+        written = 0
+        try:
+            with open(dest, "wb") as f:
+                async for chunk in response.stream(decode_content=False):
+                    f.write(chunk)
+                    written += len(chunk)
+        except BaseException:
+            _unlink(dest)
+            raise
+        return written
 
 
 class ProxyManager(PoolManager):
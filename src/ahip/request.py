@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 
-from .filepost import encode_multipart_formdata
+from .filepost import MultipartEncoder
 from .packages import six
 from .packages.six.moves.urllib.parse import urlencode
 
@@ -113,9 +113,9 @@ class RequestMethods(object):
         Make a request using :meth:`urlopen` with the ``fields`` encoded in
         the body. This is useful for request methods like POST, PUT, PATCH, etc.
 
-        When ``encode_multipart=True`` (default), then
-        :meth:`hip.filepost.encode_multipart_formdata` is used to encode
-        the payload with the appropriate content type. Otherwise
+        When ``encode_multipart=True`` (default), then a
+        :class:`hip.filepost.MultipartEncoder` is used to encode the payload
+        with the appropriate content type and length. Otherwise
         :meth:`urllib.urlencode` is used with the
         'application/x-www-form-urlencoded' content type.
 
@@ -136,6 +136,11 @@ class RequestMethods(object):
                 'nonamefile': 'contents of nonamefile field',
             }
 
+        File objects opened in binary mode can be given in place of their
+        contents, as in ``('barfile.txt', open('realfile', 'rb'))``. They
+        are then read a block at a time as the request is sent, rather than
+        all being held in memory.
+
         When uploading a file, providing a filename (the first parameter of the
         tuple) is optional but recommended to best mimic behavior of browsers.
 
@@ -156,9 +161,10 @@ class RequestMethods(object):
                 )
 
             if encode_multipart:
-                body, content_type = encode_multipart_formdata(
-                    fields, boundary=multipart_boundary
-                )
+                body = MultipartEncoder(fields, boundary=multipart_boundary)
+                content_type = body.content_type
+                if body.content_length is not None:
+                    extra_kw["headers"]["Content-Length"] = str(body.content_length)
             else:
                 body, content_type = (
                     urlencode(fields),
@@ -169,7 +175,7 @@ class RequestMethods(object):
                 body = body.encode("utf-8")
 
             extra_kw["body"] = body
-            extra_kw["headers"] = {"Content-Type": content_type}
+            extra_kw["headers"]["Content-Type"] = content_type
 
         extra_kw["headers"].update(headers)
         extra_kw.update(urlopen_kw)
@@ -3,6 +3,7 @@ from contextlib import contextmanager
 import zlib
 import io
 import logging
+import os
 from socket import timeout as SocketTimeout
 from socket import error as SocketError
 
@@ -11,15 +12,47 @@ try:
 except ImportError:
     brotli = None
 
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
 import h11
 
 from ._collections import HTTPHeaderDict
-from .exceptions import ProtocolError, DecodeError, ReadTimeoutError
+from .exceptions import (
+    HTTPError,
+    ProtocolError,
+    DecodeError,
+    ReadTimeoutError,
+    ResourceChangedError,
+)
 from .packages.six import string_types as basestring
+from .util.digest import BodyDigest, digests_from_headers
+from .util.drain import DrainBudget
+from .util.ranges import check_range, if_range_validator, preallocate
 from .util.ssl_ import BaseSSLError
+from .util.timeout import current_time
+from .util.unasync import anext
 
 log = logging.getLogger("hip.response")
 
+# Files are written as they come, on Windows too.
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+# The decoders take a ``max_length`` argument as zlib does: if it is not
+# zero, at most about that many bytes are returned, and the input that
+# wasn't needed is kept until ``decompress`` is called again. While
+# ``has_unconsumed_tail`` is true, more output can be had without any new
+# input by calling ``decompress(b"", max_length)``.
+
 
 class DeflateDecoder(object):
     def __init__(self):
@@ -30,16 +63,21 @@ class DeflateDecoder(object):
     def __getattr__(self, name):
         return getattr(self._obj, name)
 
-    def decompress(self, data):
+    @property
+    def has_unconsumed_tail(self):
+        return bool(self._obj.unconsumed_tail)
+
+    def decompress(self, data, max_length=0):
+        data = self._obj.unconsumed_tail + data
         if not data:
             return data
 
         if not self._first_try:
-            return self._obj.decompress(data)
+            return self._obj.decompress(data, max_length)
 
         self._data += data
         try:
-            decompressed = self._obj.decompress(data)
+            decompressed = self._obj.decompress(data, max_length)
             if decompressed:
                 self._first_try = False
                 self._data = None
@@ -48,7 +86,7 @@ class DeflateDecoder(object):
             self._first_try = False
             self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
             try:
-                return self.decompress(self._data)
+                return self.decompress(self._data, max_length)
             finally:
                 self._data = None
 
@@ -64,17 +102,28 @@ class GzipDecoder(object):
     def __init__(self):
         self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
         self._state = GzipDecoderState.FIRST_MEMBER
+        # Input left over when max_length was reached, possibly including
+        # the start of the next member.
+        self._tail = b""
 
     def __getattr__(self, name):
         return getattr(self._obj, name)
 
-    def decompress(self, data):
+    @property
+    def has_unconsumed_tail(self):
+        return bool(self._tail)
+
+    def decompress(self, data, max_length=0):
         ret = bytearray()
+        data = self._tail + data
+        self._tail = b""
         if self._state == GzipDecoderState.SWALLOW_DATA or not data:
             return bytes(ret)
         while True:
             try:
-                ret += self._obj.decompress(data)
+                ret += self._obj.decompress(
+                    data, max_length - len(ret) if max_length else 0
+                )
             except zlib.error:
                 previous_state = self._state
                 # Ignore data after the first error
@@ -83,11 +132,17 @@ class GzipDecoder(object):
                     # Allow trailing garbage acceptable in other gzip clients
                     return bytes(ret)
                 raise
+            if self._obj.unconsumed_tail:
+                self._tail = self._obj.unconsumed_tail
+                return bytes(ret)
             data = self._obj.unused_data
             if not data:
                 return bytes(ret)
             self._state = GzipDecoderState.OTHER_MEMBERS
             self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if max_length and len(ret) >= max_length:
+                self._tail = data
+                return bytes(ret)
 
 
 if brotli is not None:
@@ -95,13 +150,22 @@ if brotli is not None:
     class BrotliDecoder(object):
         # Supports both 'brotlipy' and 'Brotli' packages
         # since they share an import name. The top branches
-        # are for 'brotlipy' and bottom branches for 'Brotli'
+        # are for 'brotlipy' and bottom branches for 'Brotli'.
+        # Only Brotli 1.1 and later can limit their output.
         def __init__(self):
             self._obj = brotli.Decompressor()
 
-        def decompress(self, data):
+        @property
+        def has_unconsumed_tail(self):
+            if hasattr(self._obj, "can_accept_more_data"):
+                return not self._obj.can_accept_more_data()
+            return False
+
+        def decompress(self, data, max_length=0):
             if hasattr(self._obj, "decompress"):
                 return self._obj.decompress(data)
+            if max_length and hasattr(self._obj, "can_accept_more_data"):
+                return self._obj.process(data, output_buffer_limit=max_length)
             return self._obj.process(data)
 
         def flush(self):
@@ -110,6 +174,67 @@ if brotli is not None:
             return b""
 
 
+if zstd is not None:
+
+    class _ZstdNeedsInput(Exception):
+        pass
+
+    class _ZstdInput(object):
+        # The source of a zstandard stream reader, fed with the body as it
+        # arrives. A reader treats an empty read as the end of its input for
+        # good, so running out raises instead.
+        def __init__(self):
+            self._data = b""
+
+        def feed(self, data):
+            self._data += data
+
+        def read(self, size=-1):
+            if not self._data:
+                raise _ZstdNeedsInput()
+            if size < 0:
+                size = len(self._data)
+            data, self._data = self._data[:size], self._data[size:]
+            return data
+
+        def close(self):
+            pass
+
+    class ZstdDecoder(object):
+        # zstandard's decompressobj can't limit its output, but a stream
+        # reader's read1() can. A body may be made of several frames.
+        # Truncated bodies aren't noticed here, as with gzip.
+        CHUNK_SIZE = 64 * 1024
+
+        def __init__(self):
+            self._input = _ZstdInput()
+            self._reader = zstd.ZstdDecompressor().stream_reader(
+                self._input, read_across_frames=True
+            )
+            self.has_unconsumed_tail = False
+
+        def decompress(self, data, max_length=0):
+            self._input.feed(data)
+            parts = []
+            size = 0
+            while not max_length or size < max_length:
+                want = max_length - size if max_length else self.CHUNK_SIZE
+                try:
+                    chunk = self._reader.read1(want)
+                except _ZstdNeedsInput:
+                    break
+                if not chunk:
+                    break
+                parts.append(chunk)
+                size += len(chunk)
+            # There may be more to come out of what was already fed.
+            self.has_unconsumed_tail = bool(max_length) and size >= max_length
+            return b"".join(parts)
+
+        def flush(self):
+            return b""
+
+
 class MultiDecoder(object):
     """
     From RFC7231:
@@ -122,12 +247,25 @@ class MultiDecoder(object):
     def __init__(self, modes):
         self._decoders = [_get_decoder(m.strip()) for m in modes.split(",")]
 
+    @property
+    def has_unconsumed_tail(self):
+        return any(d.has_unconsumed_tail for d in self._decoders)
+
     def flush(self):
         return self._decoders[0].flush()
 
-    def decompress(self, data):
-        for d in reversed(self._decoders):
-            data = d.decompress(data)
+    def decompress(self, data, max_length=0):
+        decoders = list(reversed(self._decoders))
+        start = 0
+        if not data:
+            # Carry on from the last decoder with input left over, so that
+            # a decoder isn't handed more input before it has used up what
+            # it already has.
+            for i, d in enumerate(decoders):
+                if d.has_unconsumed_tail:
+                    start = i
+        for d in decoders[start:]:
+            data = d.decompress(data, max_length)
         return data
 
 
@@ -141,9 +279,69 @@ def _get_decoder(mode):
     if brotli is not None and mode == "br":
         return BrotliDecoder()
 
+    if zstd is not None and mode == "zstd":
+        return ZstdDecoder()
+
     return DeflateDecoder()
 
 
+class BytesBody(object):
+    """
+    A response body that is already in memory, for building an
+    :class:`HTTPResponse` that doesn't need a connection. The raw (possibly
+    still content-encoded) body is yielded as a single chunk if it is a byte
+    string. Other buffer objects, such as an :class:`mmap.mmap`, are yielded
+    as ``memoryview`` slices of at most ``chunk_size`` bytes, without copying,
+    and closed along with the body.
+    """
+
+    def __init__(self, data, chunk_size=65536):
+        self._data = data
+        self._chunk_size = chunk_size
+        self._offset = 0
+
+    @property
+    def complete(self):
+        return self._offset >= len(self._data)
+
+    def __aiter__(self):
+        return self
+
+    def next(self):  # Platform-specific: Python 2.7
+        return self.__next__()
+
+    async def __anext__(self):
+        if self.complete:
+            raise StopAsyncIteration
+        if isinstance(self._data, bytes):
+            chunk = self._data
+        else:
+            end = self._offset + self._chunk_size
+            chunk = memoryview(self._data)[self._offset : end]
+        self._offset += len(chunk)
+        return chunk
+
+    def close(self):
+        close_buffer(self._data)
+        self._data = b""
+        self._offset = 0
+
+
+def close_buffer(data):
+    """
+    Close ``data`` if it has to be closed, as a :class:`mmap.mmap` does. If
+    ``memoryview`` slices of it are still in use, it is closed when they are
+    released instead.
+    """
+    close = getattr(data, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except BufferError:
+        pass
+
+
 class HTTPResponse(io.IOBase):
     """
     HTTP Response container.
@@ -163,13 +361,61 @@ class HTTPResponse(io.IOBase):
     :param retries:
         The retries contains the last :class:`~hip.util.retry.Retry` that
         was used during the request.
+
+    :param deadline:
+        The request's :class:`~hip.util.timeout.Deadline`, if any. Reading
+        the body raises :exc:`~hip.exceptions.DeadlineExceededError` once it
+        has passed.
+
+    :param timeout:
+        The request's :class:`~hip.util.timeout.Timeout`, if any. Reading the
+        body raises :exc:`~hip.exceptions.ReadTimeoutError` if the server is
+        slower than its low-speed limit.
+
+    :param body_limits:
+        A :class:`~hip.util.limits.BodyLimits`. Reading a body larger than it
+        allows raises :exc:`~hip.exceptions.BodyTooLargeError`.
+
+    :param thread_decode_threshold:
+        In async mode, decompress chunks of the body of at least this many
+        bytes in a worker thread, so that large compressed bodies don't hold
+        up other tasks. Decompressed chunks are still returned in order.
+        ``None``, the default, decompresses everything in the event loop's
+        thread. Has no effect in sync mode.
+
+    :param resume:
+        How many times to resume the body with ``resume_request`` if the
+        connection breaks while it's being read. See ``resume`` in
+        :meth:`hip.HTTPConnectionPool.urlopen`.
+
+    :param resume_request:
+        An async function of ``(offset, validator)`` which requests the body
+        from ``offset`` on with ``If-Range: validator``, and returns the new
+        response.
+
+    :param digests:
+        :class:`~hip.util.digest.BodyDigest` values to compute as the body is
+        read. The response computes its own copies of them, which are kept
+        in :attr:`digests`.
+
+    :param check_digest_headers:
+        If True, also check the body against the digests given by the
+        ``Repr-Digest``, ``Digest`` and ``Content-MD5`` response headers. Only
+        a ``200 OK`` body is checked, as the headers describe the whole
+        resource rather than a part of it.
     """
 
     CONTENT_DECODERS = ["gzip", "deflate"]
     if brotli is not None:
         CONTENT_DECODERS += ["br"]
+    if zstd is not None:
+        CONTENT_DECODERS += ["zstd"]
     REDIRECT_STATUSES = [301, 302, 303, 307, 308]
 
+    #: Most bytes of decoded content produced from the body at a time, so that
+    #: a highly compressed body doesn't have to be decompressed all at once.
+    DECODED_CHUNK_SIZE = 64 * 1024
+
     def __init__(
         self,
         body="",
@@ -187,6 +433,14 @@ class HTTPResponse(io.IOBase):
         enforce_content_length=False,
         request_method=None,
         request_url=None,
+        deadline=None,
+        timeout=None,
+        body_limits=None,
+        thread_decode_threshold=None,
+        resume=None,
+        resume_request=None,
+        digests=None,
+        check_digest_headers=False,
     ):
 
         if isinstance(headers, HTTPHeaderDict):
@@ -201,14 +455,30 @@ class HTTPResponse(io.IOBase):
         self.retries = retries
 
         self._decoder = None
+        # Decodes the body only for the digests of its content, while it's
+        # being returned undecoded.
+        self._digest_decoder = None
         self._body = None
         self._fp = None
         self._original_response = original_response
         self._fp_bytes_read = 0
         self.msg = msg
         self._request_url = request_url
+        self._deadline = deadline
+        self._timeout = timeout
+        self._low_speed_window = None
+        self._body_limits = body_limits
+        self._decoded_bytes_read = 0
+        self._thread_decode_threshold = thread_decode_threshold
+        self._resumes_left = resume or 0
+        self._resume_request = resume_request
         self._buffer = b""
 
+        #: The :class:`~hip.util.digest.BodyDigest` values being computed of
+        #: the body.
+        self.digests = []
+        self._add_digests(digests, check_digest_headers)
+
         if body and isinstance(body, (basestring, bytes)):
             self._body = body
         else:
@@ -241,6 +511,104 @@ class HTTPResponse(io.IOBase):
         self._pool._put_conn(self._connection)
         self._connection = None
 
+    async def drain_conn(self, budget=None):
+        """
+        Read and discard the rest of the body, then give the connection back
+        to the pool so that it can be reused.
+
+        Reading a large or slow body just to reuse the connection costs more
+        than opening a new one, so if the rest of the body doesn't fit in the
+        :class:`~hip.util.drain.DrainBudget` ``budget``, or reading it fails,
+        the connection is closed instead. ``budget`` defaults to the pool's
+        ``drain_budget``.
+        """
+        if budget is None:
+            budget = getattr(self._pool, "drain_budget", None) or DrainBudget.DEFAULT
+
+        try:
+            if self._fp is not None and not isinstance(self._fp, (basestring, bytes)):
+                remaining = self._length_remaining()
+                if remaining is not None and not (
+                    budget.allows(remaining)
+                    and self._allows_encoded(self._fp_bytes_read + remaining)
+                ):
+                    self.close()
+                else:
+                    await self._drain(budget)
+        except (HTTPError, SocketError, BaseSSLError):
+            # Who knows what state the connection is in now.
+            self.close()
+
+        self.release_conn()
+
+    async def _drain(self, budget):
+        start = current_time()
+        drained = 0
+        with self._error_catcher():
+            if budget.max_time is not None:
+                self._limit_read_timeout(budget.max_time)
+            async for chunk in self._fp:
+                self._fp_bytes_read += len(chunk)
+                drained += len(chunk)
+                elapsed = current_time() - start
+                if not (
+                    budget.allows(drained, elapsed)
+                    and self._allows_encoded(self._fp_bytes_read)
+                ):
+                    self.close()
+                    return
+                if budget.max_time is not None:
+                    self._limit_read_timeout(budget.max_time - elapsed)
+
+            self._fp = None
+            self._buffer = b""
+
+    def _allows_encoded(self, num_bytes):
+        return self._body_limits is None or self._body_limits.allows_encoded(num_bytes)
+
+    def _check_body_limits(self, decode_content):
+        if self._body_limits is None:
+            return
+        decoded = self._decoded_bytes_read if decode_content else None
+        self._body_limits.check(self._fp_bytes_read, decoded)
+
+    def _limit_read_timeout(self, time_left):
+        # Don't let a single read from a slow server go on for more than
+        # time_left seconds. The connection's read timeout is set again for
+        # its next request.
+        if not hasattr(self._fp, "read_timeout"):
+            return
+        if self._fp.read_timeout is None or self._fp.read_timeout > time_left:
+            self._fp.read_timeout = time_left
+
+    def _check_deadline(self):
+        if self._deadline is None:
+            return
+        self._deadline.check(self._pool, self._request_url)
+        self._limit_read_timeout(self._deadline.remaining())
+
+    def _start_low_speed_window(self):
+        # Started on the first read of the body, and kept across reads so
+        # that the window slides over the whole body.
+        if self._low_speed_window is None and self._timeout is not None:
+            self._low_speed_window = self._timeout.low_speed_window()
+        if self._low_speed_window is not None:
+            self._limit_read_timeout(self._low_speed_window.period)
+        return self._low_speed_window
+
+    def _length_remaining(self):
+        """
+        Number of body bytes still to come according to Content-Length, or
+        ``None`` if that isn't known.
+        """
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            return None
+        try:
+            length = int(self.headers["content-length"])
+        except (KeyError, ValueError):
+            return None
+        return max(length - self._fp_bytes_read, 0)
+
     @property
     def data(self):
         # For backwords-compat with urllib3 0.4 and earlier.
@@ -284,17 +652,22 @@ class HTTPResponse(io.IOBase):
     DECODER_ERROR_CLASSES = (IOError, zlib.error)
     if brotli is not None:
         DECODER_ERROR_CLASSES += (brotli.error,)
+    if zstd is not None:
+        DECODER_ERROR_CLASSES += (zstd.ZstdError,)
 
-    def _decode(self, data, decode_content, flush_decoder):
+    def _decode(self, data, decode_content, flush_decoder, max_length=0):
         """
         Decode the data passed in and potentially flush the decoder.
+
+        If ``max_length`` is not zero, about that many bytes at most are
+        decoded, and the rest is kept by the decoder for later.
         """
         if not decode_content:
             return data
 
         try:
             if self._decoder:
-                data = self._decoder.decompress(data)
+                data = self._decoder.decompress(data, max_length)
         except self.DECODER_ERROR_CLASSES as e:
             content_encoding = self.headers.get("content-encoding", "").lower()
             raise DecodeError(
@@ -307,6 +680,99 @@ class HTTPResponse(io.IOBase):
 
         return data
 
+    def _decode_in_thread(self, data, decode_content):
+        # Connections know which backend, and so which thread pool, to use.
+        return (
+            decode_content
+            and self._decoder is not None
+            and self._thread_decode_threshold is not None
+            and len(data) >= self._thread_decode_threshold
+            and getattr(self._fp, "_backend", None) is not None
+        )
+
+    async def _decode_chunks(self, data, decode_content):
+        """
+        Decode the data passed in, and anything the decoder kept from before,
+        in chunks of at most about :attr:`DECODED_CHUNK_SIZE` bytes.
+        """
+        in_thread = self._decode_in_thread(data, decode_content)
+        while True:
+            if in_thread:
+                chunk = await self._fp._backend.run_sync_in_worker_thread(
+                    self._decode, data, decode_content, False, self.DECODED_CHUNK_SIZE
+                )
+            else:
+                chunk = self._decode(
+                    data, decode_content, False, max_length=self.DECODED_CHUNK_SIZE
+                )
+            self._decoded_bytes_read += len(chunk)
+            self._check_body_limits(decode_content)
+            if chunk:
+                if decode_content or self._decoder is None:
+                    self._update_digests(chunk, raw=False)
+                else:
+                    self._update_content_digests(chunk)
+                yield chunk
+            if not (decode_content and self._decoder):
+                return
+            if not self._decoder.has_unconsumed_tail:
+                return
+            data = b""
+
+    def add_digest(self, algorithm, expected=None, raw=False):
+        """
+        Compute a digest of the body as it is read, and return it as a
+        :class:`~hip.util.digest.BodyDigest`. It must be added before any of
+        the body is read. If ``expected`` is given, reading the end of the
+        body raises :exc:`~hip.exceptions.DigestMismatchError` if the digest
+        doesn't match.
+        """
+        digest = BodyDigest(algorithm, expected=expected, raw=raw)
+        self.digests.append(digest)
+        return digest
+
+    def _add_digests(self, digests, check_digest_headers):
+        """
+        Compute copies of ``digests``, and the digests given by the headers if
+        ``check_digest_headers``, see the parameters of the same names.
+        """
+        self.digests.extend(digest.new() for digest in digests or ())
+        if check_digest_headers and self.status == 200:
+            self.digests.extend(digests_from_headers(self.headers))
+
+    def _update_digests(self, data, raw):
+        for digest in self.digests:
+            if digest.raw == raw:
+                digest.update(data)
+
+    def _update_content_digests(self, data, flush=False):
+        """
+        Update the digests of the content with ``data``, a part of the body
+        that is being returned without being decoded, by decoding it
+        separately.
+        """
+        if all(digest.raw for digest in self.digests):
+            return
+        if self._digest_decoder is None:
+            content_encoding = self.headers.get("content-encoding", "").lower()
+            self._digest_decoder = _get_decoder(content_encoding)
+        try:
+            while True:
+                chunk = self._digest_decoder.decompress(data, self.DECODED_CHUNK_SIZE)
+                self._update_digests(chunk, raw=False)
+                if not self._digest_decoder.has_unconsumed_tail:
+                    break
+                data = b""
+            if flush:
+                self._update_digests(self._digest_decoder.flush(), raw=False)
+        except self.DECODER_ERROR_CLASSES as e:
+            content_encoding = self.headers.get("content-encoding", "").lower()
+            raise DecodeError(
+                "Received response with content-encoding: %s, but "
+                "failed to decode it." % content_encoding,
+                e,
+            )
+
     def _flush_decoder(self):
         """
         Flushes the decoder. Should only be called if the decoder is actually
@@ -334,6 +800,9 @@ class HTTPResponse(io.IOBase):
                 yield
 
             except SocketTimeout:
+                # The read timeout may have been cut short by the deadline.
+                if self._deadline is not None:
+                    self._deadline.check(self._pool, self._request_url)
                 # FIXME: Ideally we'd like to include the url in the ReadTimeoutError but
                 # there is yet no clean way to get at it from this context.
                 raise ReadTimeoutError(self._pool, None, "Read timed out.")
@@ -423,8 +892,8 @@ class HTTPResponse(io.IOBase):
 
                 while data_len < amt:
                     try:
-                        chunk = next(streamer)
-                    except StopIteration:
+                        chunk = await anext(streamer)
+                    except StopAsyncIteration:
                         break
                     else:
                         chunks.append(chunk)
@@ -452,14 +921,38 @@ class HTTPResponse(io.IOBase):
         if decode_content is None:
             decode_content = self.decode_content
 
+        finished = False
         with self._error_catcher():
-            async for raw_chunk in self._fp:
+            # A read(amt) may have left content in the decoder.
+            async for decoded_chunk in self._decode_chunks(b"", decode_content):
+                yield decoded_chunk
+            self._check_deadline()
+
+            # Don't start reading a body that is already known to be too big.
+            remaining = self._length_remaining()
+            if remaining is not None and self._body_limits is not None:
+                self._body_limits.check(self._fp_bytes_read + remaining)
+
+            window = self._start_low_speed_window()
+            started = current_time()
+            async for raw_chunk in self._raw_chunks():
                 self._fp_bytes_read += len(raw_chunk)
-                decoded_chunk = self._decode(
-                    raw_chunk, decode_content, flush_decoder=False
-                )
-                if decoded_chunk:
+                self._update_digests(raw_chunk, raw=True)
+                self._check_body_limits(False)
+                if window is not None and not window.update(
+                    len(raw_chunk), current_time() - started
+                ):
+                    raise ReadTimeoutError(
+                        self._pool,
+                        self._request_url,
+                        "Read timed out: fewer than %r bytes in %r seconds."
+                        % (window.min_bytes, window.period),
+                    )
+                decoded_chunks = self._decode_chunks(raw_chunk, decode_content)
+                async for decoded_chunk in decoded_chunks:
                     yield decoded_chunk
+                self._check_deadline()
+                started = current_time()
 
             # This branch is speculative: most decoders do not need to flush,
             # and so this produces no output. However, it's here because
@@ -469,10 +962,188 @@ class HTTPResponse(io.IOBase):
             # branch we don't enter is basically entirely unnecessary (it's
             # just a yield statement).
             final_chunk = self._decode(b"", decode_content, flush_decoder=True)
+            self._decoded_bytes_read += len(final_chunk)
+            self._check_body_limits(decode_content)
             if final_chunk:  # Platform-specific: Jython
+                self._update_digests(final_chunk, raw=False)
                 yield final_chunk
+            if not decode_content and self._decoder is not None:
+                self._update_content_digests(b"", flush=True)
 
             self._fp = None
+            finished = True
+
+        # Checked outside the error catcher, as a mismatch is no reason to
+        # close the connection.
+        if finished:
+            for digest in self.digests:
+                digest.check()
+
+    #: Bytes of the body gathered by :meth:`save_to` before each write.
+    SAVE_BUFFER_SIZE = 1024 * 1024
+
+    async def save_to(self, path_or_fd, decode_content=None, fsync=False):
+        """
+        Write the rest of the body to a file, and return the number of bytes
+        written.
+
+        The body is gathered in a buffer of :attr:`SAVE_BUFFER_SIZE` bytes
+        that is reused between writes, so a large body takes few system calls
+        to write. In async mode, the writes happen in a worker thread.
+
+        :param path_or_fd:
+            The path of a file to create or overwrite, or the descriptor of
+            an open file to write to at its current position. A file created
+            from a path is allocated at its full size up front if the size of
+            the body is known from ``Content-Length``, and is removed if
+            the body can't be read in full.
+
+        :param decode_content:
+            If True, will attempt to decode the body based on the
+            'content-encoding' header.
+
+        :param fsync:
+            If True, flush the file to disk with ``os.fsync`` before
+            returning.
+        """
+        if decode_content is None:
+            decode_content = self.decode_content
+        self._init_decoder()
+
+        # Keep hold of the backend, as the connection is released at the end
+        # of the body.
+        backend = getattr(self._fp, "_backend", None)
+
+        async def run(fn, *args):
+            if backend is None:
+                return fn(*args)
+            return await backend.run_sync_in_worker_thread(fn, *args)
+
+        pending = self._buffer
+        self._buffer = b""
+        if self._fp is None and not pending and self._body:
+            pending = self._body
+
+        opened = not isinstance(path_or_fd, int)
+        size = None
+        if opened:
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY
+            fd = os.open(path_or_fd, flags, 0o666)
+        else:
+            fd = path_or_fd
+
+        try:
+            if opened:
+                remaining = self._length_remaining() if self._fp is not None else 0
+                if remaining is not None and not (decode_content and self._decoder):
+                    size = len(pending) + remaining
+                    preallocate(fd, size)
+
+            buf = bytearray(self.SAVE_BUFFER_SIZE)
+            view = memoryview(buf)
+            filled = 0
+            written = 0
+
+            async def chunks():
+                if pending:
+                    yield pending
+                async for chunk in self.stream(decode_content):
+                    yield chunk
+
+            async for chunk in chunks():
+                if filled + len(chunk) > len(buf) and filled:
+                    await run(_write_all, fd, view[:filled])
+                    written += filled
+                    filled = 0
+                if len(chunk) >= len(buf):
+                    await run(_write_all, fd, chunk)
+                    written += len(chunk)
+                else:
+                    buf[filled : filled + len(chunk)] = chunk
+                    filled += len(chunk)
+            if filled:
+                await run(_write_all, fd, view[:filled])
+                written += filled
+
+            if size is not None and size != written:
+                os.ftruncate(fd, written)
+            if fsync:
+                await run(os.fsync, fd)
+        except BaseException:
+            if opened:
+                # Don't leave a partial file behind, padded out to the full
+                # size if it was preallocated.
+                os.close(fd)
+                opened = False
+                try:
+                    os.remove(path_or_fd)
+                except OSError:
+                    pass
+            raise
+        finally:
+            if opened:
+                os.close(fd)
+        return written
+
+    # Errors from a broken connection, after which the body can be resumed.
+    RESUMABLE_ERROR_CLASSES = (SocketTimeout, SocketError, h11.ProtocolError)
+
+    async def _raw_chunks(self):
+        """
+        The rest of the body as it comes off the wire, resuming it from a new
+        response if the connection breaks and resuming is enabled.
+        """
+        while True:
+            try:
+                async for raw_chunk in self._fp:
+                    yield raw_chunk
+                return
+            except self.RESUMABLE_ERROR_CLASSES as e:
+                if not await self._resume_body(e):
+                    raise
+
+    async def _resume_body(self, error):
+        """
+        Request the rest of the body from where it broke off, and carry on
+        from the new response. Returns False if the body can't be resumed.
+        """
+        validator = if_range_validator(self.headers)
+        if (
+            not self._resumes_left
+            or self._resume_request is None
+            or self.status != 200
+            or validator is None
+        ):
+            return False
+        self._check_deadline()
+
+        self._resumes_left -= 1
+        offset = self._fp_bytes_read
+        remaining = self._length_remaining()
+        length = None if remaining is None else offset + remaining
+        log.info(
+            "Resuming body of %s at byte %d after %r", self._request_url, offset, error
+        )
+
+        # Give the broken connection's slot back to the pool, which the
+        # request for the rest of the body may need.
+        if self._connection:
+            self._connection.close()
+        self.release_conn()
+        response = await self._resume_request(offset, validator)
+        try:
+            check_range(response, offset, length)
+        except (ProtocolError, ResourceChangedError):
+            await response.drain_conn()
+            raise
+
+        self._fp = response._fp
+        self._connection = response._connection
+        self._original_response = response._original_response
+        self._pool = response._pool
+        response._fp = response._connection = None
+        self._start_low_speed_window()
+        return True
 
     @classmethod
     def from_base(ResponseCls, r, **response_kw):
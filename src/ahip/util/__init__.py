@@ -2,7 +2,7 @@ from __future__ import absolute_import
 
 # For backwards compatibility, provide imports that used to be here.
 from .connection import is_connection_dropped
-from .request import make_headers
+from .request import make_headers, CompressedBody
 from .ssl_ import (
     SSLContext,
     HAS_SNI,
@@ -16,9 +16,16 @@ from .ssl_ import (
     SSLWantWriteError,
     PROTOCOL_TLS,
 )
-from .timeout import current_time, Timeout
+from .timeout import current_time, Deadline, Timeout
 
+from .circuit_breaker import CircuitBreaker
+from .digest import BodyDigest
+from .drain import DrainBudget
+from .hedge import Hedge
+from .limits import BodyLimits
+from .redirect_memo import RedirectMemo
 from .retry import Retry
+from .single_flight import SingleFlight
 from .url import parse_url, Url
 from .wait import wait_for_read, wait_for_write, wait_for_socket
 
@@ -27,8 +34,17 @@ __all__ = (
     "IS_PYOPENSSL",
     "IS_SECURETRANSPORT",
     "SSLContext",
+    "BodyDigest",
+    "BodyLimits",
+    "CircuitBreaker",
+    "CompressedBody",
+    "Deadline",
+    "DrainBudget",
+    "Hedge",
     "PROTOCOL_TLS",
+    "RedirectMemo",
     "Retry",
+    "SingleFlight",
     "Timeout",
     "Url",
     "assert_fingerprint",
@@ -0,0 +1,293 @@
+from __future__ import absolute_import
+import collections
+import logging
+
+from .._collections import RLock
+from ..exceptions import (
+    CircuitOpenError,
+    MaxRetryError,
+    NewConnectionError,
+    ProtocolError,
+    TimeoutError,
+)
+from .timeout import current_time
+
+
+log = logging.getLogger("hip.util.circuit_breaker")
+
+
+class CircuitBreaker(object):
+    """Circuit breaker configuration and state for a single origin.
+
+    When an origin is hard down, every request to it would otherwise pay for
+    a full connect attempt (and connect timeout, and retries) before failing.
+    A circuit breaker remembers recent failures and, once it has seen enough
+    of them, fails subsequent requests immediately with a
+    :class:`~hip.exceptions.CircuitOpenError` instead.
+
+    A breaker is in one of three states:
+
+    * ``closed``: requests flow normally, and failures are counted.
+    * ``open``: requests fail fast without touching the network. After
+      ``recovery_timeout`` seconds the breaker moves to ``half-open``.
+    * ``half-open``: up to ``half_open_max_calls`` probe requests are let
+      through at a time. ``success_threshold`` consecutive successful probes
+      close the breaker again, while any failed probe re-opens it.
+
+    Breakers are passed to :class:`~hip.poolmanager.PoolManager` as a
+    template; the manager calls :meth:`new` to create an independent breaker
+    for every pool key it sees::
+
+        breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=10)
+        http = PoolManager(circuit_breaker=breaker)
+        response = http.request('GET', 'http://example.com/')
+        http.circuit_breaker_for('http://example.com/').state
+
+    :param int failure_threshold:
+        Number of consecutive failures that trips the breaker. Set to
+        ``None`` to only trip on the error rate.
+
+    :param float error_rate_threshold:
+        Fraction (between 0 and 1) of failed requests within the last
+        ``window_size`` requests that trips the breaker. Disabled by default.
+
+    :param int window_size:
+        Number of recent requests used to compute the error rate.
+
+    :param int min_calls:
+        Minimum number of requests in the window before the error rate is
+        taken into account.
+
+    :param float recovery_timeout:
+        Number of seconds the breaker stays open before letting probe
+        requests through.
+
+    :param int half_open_max_calls:
+        Maximum number of concurrent probe requests while half-open.
+
+    :param int success_threshold:
+        Number of consecutive successful probes needed to close the breaker.
+
+    :param iterable failure_statuses:
+        Response status codes that should be counted as failures, such as
+        ``[502, 503, 504]``. By default only errors raised while connecting or
+        reading count as failures.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold=5,
+        error_rate_threshold=None,
+        window_size=20,
+        min_calls=10,
+        recovery_timeout=30,
+        half_open_max_calls=1,
+        success_threshold=1,
+        failure_statuses=None,
+    ):
+        if error_rate_threshold is not None and not 0 < error_rate_threshold <= 1:
+            raise ValueError(
+                "error_rate_threshold must be between 0 and 1, got %r"
+                % (error_rate_threshold,)
+            )
+
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+        self.failure_statuses = frozenset(failure_statuses or ())
+
+        self.lock = RLock()
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._consecutive_failures = 0
+        self._consecutive_successes = 0
+        self._half_open_calls = 0
+        self._outcomes = collections.deque(maxlen=window_size)
+
+    def new(self):
+        """Return a fresh, closed breaker with the same configuration."""
+        return type(self)(
+            failure_threshold=self.failure_threshold,
+            error_rate_threshold=self.error_rate_threshold,
+            window_size=self.window_size,
+            min_calls=self.min_calls,
+            recovery_timeout=self.recovery_timeout,
+            half_open_max_calls=self.half_open_max_calls,
+            success_threshold=self.success_threshold,
+            failure_statuses=self.failure_statuses,
+        )
+
+    @property
+    def state(self):
+        """The current state: ``closed``, ``open`` or ``half-open``."""
+        with self.lock:
+            if (
+                self._state == self.OPEN
+                and current_time() - self._opened_at >= self.recovery_timeout
+            ):
+                self._state = self.HALF_OPEN
+                self._half_open_calls = 0
+                self._consecutive_successes = 0
+            return self._state
+
+    @property
+    def failure_count(self):
+        """Number of consecutive failures seen while closed."""
+        return self._consecutive_failures
+
+    @property
+    def error_rate(self):
+        """Fraction of failed requests in the current window."""
+        with self.lock:
+            if not self._outcomes:
+                return 0.0
+            return sum(self._outcomes) / float(len(self._outcomes))
+
+    def get_retry_after(self):
+        """Seconds left until an open breaker lets probe requests through."""
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, self.recovery_timeout - (current_time() - self._opened_at))
+
+    def before_request(self, url=None, _pool=None):
+        """Check whether a request may be sent.
+
+        :raises hip.exceptions.CircuitOpenError: if the breaker is open, or
+            it is half-open and all probe slots are taken.
+        """
+        with self.lock:
+            state = self.state
+            if state == self.CLOSED:
+                return
+            if (
+                state == self.HALF_OPEN
+                and self._half_open_calls < self.half_open_max_calls
+            ):
+                self._half_open_calls += 1
+                return
+
+        raise CircuitOpenError(
+            _pool,
+            url,
+            "Circuit breaker is %s, failing fast (retry after %.2fs)"
+            % (state, self.get_retry_after()),
+        )
+
+    def is_failure(self, error=None, response=None):
+        """Should this error or response count against the origin?"""
+        if error is not None:
+            if isinstance(error, MaxRetryError):
+                error = error.reason
+            return isinstance(error, (TimeoutError, NewConnectionError, ProtocolError))
+        if response is not None:
+            return response.status in self.failure_statuses
+        return False
+
+    def record_success(self):
+        """Record a request that completed successfully."""
+        with self.lock:
+            self._outcomes.append(False)
+            if self._state == self.HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+                self._consecutive_successes += 1
+                if self._consecutive_successes >= self.success_threshold:
+                    self._close()
+            else:
+                self._consecutive_failures = 0
+
+    def record_failure(self):
+        """Record a failed request, possibly tripping the breaker."""
+        with self.lock:
+            self._outcomes.append(True)
+            if self._state == self.HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+                self._open()
+                return
+
+            self._consecutive_failures += 1
+            if self._should_trip():
+                self._open()
+
+    def record_neutral(self):
+        """
+        Record a request whose outcome says nothing about the origin, such as
+        one that was cancelled, giving back its probe slot if half-open.
+        """
+        with self.lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+
+    def record(self, error=None, response=None):
+        """Record the outcome of a request given its error or response.
+
+        Errors that aren't failures (see :meth:`is_failure`), such as an
+        invalid certificate, are recorded as neutral rather than as successes.
+        """
+        if self.is_failure(error=error, response=response):
+            self.record_failure()
+        elif error is not None:
+            self.record_neutral()
+        else:
+            self.record_success()
+
+    def reset(self):
+        """Force the breaker back into the closed state."""
+        with self.lock:
+            self._close()
+
+    def _should_trip(self):
+        if (
+            self.failure_threshold is not None
+            and self._consecutive_failures >= self.failure_threshold
+        ):
+            return True
+
+        if (
+            self.error_rate_threshold is not None
+            and len(self._outcomes) >= self.min_calls
+            and self.error_rate >= self.error_rate_threshold
+        ):
+            return True
+
+        return False
+
+    def _open(self):
+        # Failures of requests that were already in flight when the breaker
+        # opened mustn't push back the end of the open period.
+        if self._state == self.OPEN:
+            return
+        log.warning(
+            "Circuit breaker opened after %d consecutive failures " "(error rate %.2f)",
+            self._consecutive_failures,
+            self.error_rate,
+        )
+        self._state = self.OPEN
+        self._opened_at = current_time()
+        self._consecutive_successes = 0
+
+    def _close(self):
+        if self._state != self.CLOSED:
+            log.info("Circuit breaker closed")
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._consecutive_failures = 0
+        self._consecutive_successes = 0
+        self._half_open_calls = 0
+        self._outcomes.clear()
+
+    def __repr__(self):
+        return (
+            "{cls.__name__}(state={state!r}, failures={self._consecutive_failures}, "
+            "error_rate={error_rate:.2f})"
+        ).format(
+            cls=type(self), self=self, state=self.state, error_rate=self.error_rate
+        )
@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import base64
+import binascii
+import hashlib
+import re
+
+from ..exceptions import DigestMismatchError
+from ..packages import six
+
+
+class BodyDigest(object):
+    """A hash of a response body, computed as the body is read.
+
+    Verifying a download against a published checksum usually means reading
+    it a second time once it has been saved. Instead, give the digests to
+    compute as the request's ``digests``; the body is hashed as it is read,
+    and if an ``expected`` value is given, checked once it has all been read::
+
+        r = http.request('GET', 'https://example.com/dataset.tar',
+                         preload_content=False,
+                         digests=[BodyDigest('sha256', expected=published)])
+        r.save_to('dataset.tar')
+
+    :exc:`~hip.exceptions.DigestMismatchError` is raised at the end of the
+    body if it doesn't match. The response computes its own copies, which
+    are in its :attr:`~hip.response.HTTPResponse.digests` once the body has
+    been read. Digests can also be added to a response with
+    :meth:`~hip.response.HTTPResponse.add_digest` before reading it.
+
+    :param str algorithm:
+        Name of a :mod:`hashlib` algorithm, such as ``'sha256'`` or
+        ``'md5'``.
+
+    :param expected:
+        The digest the body should have, either as a hex string or as raw
+        bytes. ``None`` to only compute it.
+
+    :param bool raw:
+        If True, hash the body as it came off the connection, before any
+        ``Content-Encoding`` was decoded. Otherwise, hash the decoded
+        content, even if the body is read with ``decode_content=False``.
+    """
+
+    def __init__(self, algorithm, expected=None, raw=False):
+        self.algorithm = algorithm
+        self.expected = expected
+        self.raw = raw
+        self._hash = hashlib.new(algorithm)
+
+    def __repr__(self):
+        return (
+            "{cls.__name__}({self.algorithm!r}, expected={self.expected!r}, "
+            "raw={self.raw})"
+        ).format(cls=type(self), self=self)
+
+    def new(self):
+        """A new digest like this one, of no data yet."""
+        return type(self)(self.algorithm, self.expected, self.raw)
+
+    def update(self, data):
+        self._hash.update(data)
+
+    def digest(self):
+        """The digest of the data so far, as bytes."""
+        return self._hash.digest()
+
+    def hexdigest(self):
+        """The digest of the data so far, as a hex string."""
+        return self._hash.hexdigest()
+
+    def check(self):
+        """
+        :raises hip.exceptions.DigestMismatchError: if the data so far
+            doesn't have the ``expected`` digest.
+        """
+        if self.expected is None:
+            return
+        if isinstance(self.expected, bytes) and len(self.expected) == len(
+            self.digest()
+        ):
+            matches = self.expected == self.digest()
+        else:
+            matches = six.ensure_str(self.expected).lower() == self.hexdigest()
+        if not matches:
+            raise DigestMismatchError(
+                "Response body has %s digest %s, expected %r."
+                % (self.algorithm, self.hexdigest(), self.expected)
+            )
+
+
+# Algorithm names used in Digest and Repr-Digest headers, for the ones that
+# hashlib has.
+_HEADER_ALGORITHMS = {
+    "md5": "md5",
+    "sha": "sha1",
+    "sha-256": "sha256",
+    "sha-512": "sha512",
+}
+
+_REPR_DIGEST_RE = re.compile(r"^\s*([\w-]+)\s*=\s*:([A-Za-z0-9+/=]*):\s*$")
+
+
+def digests_from_headers(headers):
+    """
+    The :class:`BodyDigest` values that a response's ``Repr-Digest``,
+    ``Digest`` and ``Content-MD5`` headers say its raw body should have.
+    Algorithms that aren't known, and values that can't be parsed, are left
+    out.
+    """
+    found = []
+    for value in headers.get_all("repr-digest"):
+        for item in value.split(","):
+            match = _REPR_DIGEST_RE.match(item)
+            if match is not None:
+                found.append(match.groups())
+    for value in headers.get_all("digest"):
+        for item in value.split(","):
+            algorithm, sep, encoded = item.partition("=")
+            if sep:
+                found.append((algorithm.strip(), encoded.strip()))
+    for value in headers.get_all("content-md5"):
+        found.append(("md5", value.strip()))
+
+    digests = []
+    for algorithm, encoded in found:
+        algorithm = _HEADER_ALGORITHMS.get(algorithm.lower())
+        if algorithm is None:
+            continue
+        try:
+            expected = base64.b64decode(encoded)
+        except (binascii.Error, TypeError):
+            continue
+        digest = BodyDigest(algorithm, expected=expected, raw=True)
+        if len(expected) == len(digest.digest()):
+            digests.append(digest)
+    return digests
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+
+class DrainBudget(object):
+    """How much of an unwanted response body to read to reuse its connection.
+
+    A response that is thrown away, because the request is being retried or
+    redirected or lost a hedging race, still holds its connection until the
+    rest of the body has been read. Reading a short body is cheaper than
+    opening a new connection, but reading a long one (say, a 500 MB error
+    page on a ``503``) is not. Up to the budget the body is read and the
+    connection goes back to the pool; past it the connection is closed and a
+    new one is opened when needed::
+
+        pool = HTTPConnectionPool('example.com', drain_budget=DrainBudget(
+            max_bytes=16 * 1024, max_time=0.5))
+
+    A budget can also be given to :meth:`HTTPResponse.drain_conn
+    <hip.response.HTTPResponse.drain_conn>` directly.
+
+    :param int max_bytes:
+        Most body bytes to read. If the response's ``Content-Length`` says
+        more than this remain, the connection is closed without reading.
+        ``None`` for no limit.
+
+    :param float max_time:
+        Most seconds to spend reading. ``None`` for no limit.
+    """
+
+    def __init__(self, max_bytes=64 * 1024, max_time=1.0):
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+
+    def __repr__(self):
+        return (
+            "{cls.__name__}(max_bytes={self.max_bytes}, max_time={self.max_time})"
+        ).format(cls=type(self), self=self)
+
+    def allows(self, num_bytes, elapsed=0):
+        """
+        Whether reading ``num_bytes`` in ``elapsed`` seconds is within the
+        budget.
+        """
+        if self.max_bytes is not None and num_bytes > self.max_bytes:
+            return False
+        if self.max_time is not None and elapsed >= self.max_time:
+            return False
+        return True
+
+
+# Budget for pools that don't set one.
+DrainBudget.DEFAULT = DrainBudget()
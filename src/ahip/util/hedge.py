@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+import collections
+import math
+
+from .._collections import RLock
+
+
+class Hedge(object):
+    """Hedged request configuration.
+
+    A hedged request is sent once and, if no response headers have arrived
+    after a short delay, sent again on another connection. Whichever copy
+    answers first is returned; the others are cancelled (or, in sync mode,
+    drained once they finish) so their connections go back to the pool. This
+    trades a little extra load for a much shorter tail latency when a few
+    servers or connections are slow.
+
+    Only requests that are safe to send twice are hedged: the method must be
+    in ``method_whitelist`` and the body, if any, must be a byte string.
+
+    Hedging is enabled per request::
+
+        hedge = Hedge(delay=0.05)
+        response = http.request('GET', 'http://example.com/', hedge=hedge)
+
+    The delay can also follow the observed latency, e.g. hedge whatever is
+    slower than the 95th percentile of recent requests::
+
+        hedge = Hedge(delay=0.1, percentile=95)
+
+    :param float delay:
+        Seconds to wait for response headers before sending another copy of
+        the request. When ``percentile`` is set, this is used until enough
+        latency samples have been collected.
+
+    :param float percentile:
+        If set, the delay is the given percentile (0-100) of the latencies
+        recorded over the last ``window_size`` requests.
+
+    :param int max_hedges:
+        Maximum number of extra copies of a request to send.
+
+    :param int window_size:
+        Number of latency samples kept when ``percentile`` is set.
+
+    :param int min_samples:
+        Number of latency samples needed before ``percentile`` is used.
+
+    :param iterable method_whitelist:
+        Set of uppercased HTTP method verbs that may be hedged.
+    """
+
+    DEFAULT_METHOD_WHITELIST = frozenset(["GET", "HEAD", "OPTIONS", "TRACE"])
+
+    def __init__(
+        self,
+        delay=0.1,
+        percentile=None,
+        max_hedges=1,
+        window_size=100,
+        min_samples=20,
+        method_whitelist=DEFAULT_METHOD_WHITELIST,
+    ):
+        if percentile is not None and not 0 < percentile <= 100:
+            raise ValueError(
+                "percentile must be between 0 and 100, got %r" % (percentile,)
+            )
+
+        self.delay = delay
+        self.percentile = percentile
+        self.max_hedges = max_hedges
+        self.min_samples = min_samples
+        self.method_whitelist = method_whitelist
+
+        self._lock = RLock()
+        self._latencies = collections.deque(maxlen=window_size)
+
+    def is_hedgeable(self, method, body=None):
+        """Can a request with this method and body be sent more than once?"""
+        if self.max_hedges < 1:
+            return False
+        if body is not None and not isinstance(body, bytes):
+            return False
+        return method.upper() in self.method_whitelist
+
+    def record_latency(self, seconds):
+        """Record how long a request took to receive its response headers."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def get_delay(self):
+        """The number of seconds to wait before sending another copy."""
+        if self.percentile is None:
+            return self.delay
+
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.delay
+            latencies = sorted(self._latencies)
+
+        index = int(math.ceil(self.percentile / 100.0 * len(latencies))) - 1
+        return latencies[max(0, index)]
+
+    def __repr__(self):
+        return (
+            "{cls.__name__}(delay={self.delay}, percentile={self.percentile}, "
+            "max_hedges={self.max_hedges})"
+        ).format(cls=type(self), self=self)
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+from ..exceptions import BodyTooLargeError
+
+
+class BodyLimits(object):
+    """Limits on the size of a response body.
+
+    Without limits, a single broken or hostile server can send a body large
+    enough to exhaust memory, either directly or as a small compressed body
+    that decompresses to gigabytes (a "decompression bomb"). Limits are
+    checked as the body is read, and
+    :exc:`~hip.exceptions.BodyTooLargeError` is raised, and the connection
+    closed, as soon as one is exceeded::
+
+        http = PoolManager(body_limits=BodyLimits(
+            max_encoded_bytes=10 * 1024 * 1024, max_ratio=100))
+
+    Limits can also be given per request, as ``body_limits``.
+
+    :param int max_encoded_bytes:
+        Most bytes of body to read from the connection, before any
+        ``Content-Encoding`` is decoded. A body whose ``Content-Length`` is
+        larger is rejected before it is read.
+
+    :param int max_decoded_bytes:
+        Most bytes of decoded body to produce.
+
+    :param float max_ratio:
+        Most bytes of decoded body to produce per byte read from the
+        connection.
+
+    Each of them is ``None`` for no limit. The decoded limits only apply when
+    the body is being decoded.
+    """
+
+    def __init__(self, max_encoded_bytes=None, max_decoded_bytes=None, max_ratio=None):
+        self.max_encoded_bytes = max_encoded_bytes
+        self.max_decoded_bytes = max_decoded_bytes
+        self.max_ratio = max_ratio
+
+    def __repr__(self):
+        return (
+            "{cls.__name__}(max_encoded_bytes={self.max_encoded_bytes}, "
+            "max_decoded_bytes={self.max_decoded_bytes}, "
+            "max_ratio={self.max_ratio})"
+        ).format(cls=type(self), self=self)
+
+    def allows_encoded(self, num_bytes):
+        """Whether ``num_bytes`` of encoded body are within the limits."""
+        return self.max_encoded_bytes is None or num_bytes <= self.max_encoded_bytes
+
+    def check(self, encoded, decoded=None):
+        """
+        :param int encoded: Bytes of body read from the connection so far.
+        :param int decoded: Bytes of decoded body so far, or None if the body
+            isn't being decoded.
+        :raises hip.exceptions.BodyTooLargeError: if a limit is exceeded.
+        """
+        if not self.allows_encoded(encoded):
+            raise BodyTooLargeError(
+                "Response body is larger than %d bytes." % self.max_encoded_bytes
+            )
+        if decoded is None:
+            return
+        if self.max_decoded_bytes is not None and decoded > self.max_decoded_bytes:
+            raise BodyTooLargeError(
+                "Decoded response body is larger than %d bytes."
+                % self.max_decoded_bytes
+            )
+        if self.max_ratio is not None and decoded > encoded * self.max_ratio:
+            raise BodyTooLargeError(
+                "Response body decodes to more than %r times its size." % self.max_ratio
+            )
@@ -0,0 +1,139 @@
+"""
+Helpers for fetching a resource in byte ranges and writing them into a file.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+import re
+import threading
+
+from ..exceptions import ProtocolError, ResourceChangedError
+
+_CONTENT_RANGE_RE = re.compile(r"^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$", re.IGNORECASE)
+
+
+def parse_content_range(value):
+    """
+    Parse a ``Content-Range`` header of the form ``bytes first-last/complete``
+    into a tuple ``(first, last, complete)``, where ``complete`` is None if
+    the server gave ``*``. Returns None if ``value`` can't be parsed.
+    """
+    match = _CONTENT_RANGE_RE.match(value or "")
+    if match is None:
+        return None
+    first, last, complete = match.groups()
+    complete = None if complete == "*" else int(complete)
+    return int(first), int(last), complete
+
+
+def if_range_validator(headers):
+    """
+    The value to send in ``If-Range`` so that a range request for the same
+    resource only succeeds if the resource hasn't changed: its ``ETag`` if
+    it's strong, or else its ``Last-Modified`` date. None if it has neither.
+    """
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified")
+
+
+def check_range(response, first, length=None, last=None):
+    """
+    Check that ``response`` is the range of the resource asked for, starting
+    at ``first`` (and, if ``length`` is given, of a resource that long, and if
+    ``last`` is given, ending no later than ``last``), and return the
+    ``(first, last, complete)`` range it holds.
+
+    Raises :class:`~hip.exceptions.ResourceChangedError` if the server sent
+    the whole resource instead, which it does when ``If-Range`` no longer
+    matches, and :class:`~hip.exceptions.ProtocolError` for any other
+    unexpected response.
+    """
+    if response.status == 200:
+        raise ResourceChangedError(
+            "The server sent the whole resource instead of a range of it; "
+            "the resource has changed or ranges aren't supported."
+        )
+    if response.status != 206:
+        raise ProtocolError(
+            "Unexpected status %d for a range request." % response.status
+        )
+
+    content_range = parse_content_range(response.headers.get("content-range"))
+    if (
+        content_range is None
+        or content_range[0] != first
+        or (length is not None and content_range[2] != length)
+        or (last is not None and content_range[1] > last)
+    ):
+        raise ProtocolError(
+            "Unexpected Content-Range %r for a range starting at %d."
+            % (response.headers.get("content-range"), first)
+        )
+    return content_range
+
+
+def split_ranges(length, parts):
+    """
+    Split ``length`` bytes into at most ``parts`` contiguous, inclusive
+    ``(first, last)`` ranges of nearly equal size.
+    """
+    parts = max(min(parts, length), 1)
+    size, extra = divmod(length, parts)
+    ranges = []
+    first = 0
+    for i in range(parts):
+        last = first + size + (1 if i < extra else 0) - 1
+        if last >= first:
+            ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+# The errors of posix_fallocate() that mean the file system can't reserve
+# space, rather than that there isn't any.
+_FALLOCATE_UNSUPPORTED = frozenset(
+    getattr(errno, name)
+    for name in ("EINVAL", "ENOSYS", "EOPNOTSUPP", "ENOTSUP")
+    if hasattr(errno, name)
+)
+
+
+def preallocate(fd, length):
+    """
+    Make the file ``fd`` ``length`` bytes long, reserving the disk space for
+    it up front where the platform and file system allow, so that writing it
+    neither fragments it nor fails half way for lack of space.
+    """
+    fallocate = getattr(os, "posix_fallocate", None)
+    if fallocate is not None and length > 0:
+        try:
+            fallocate(fd, 0, length)
+        except OSError as e:
+            # Not supported by this file system.
+            if e.errno not in _FALLOCATE_UNSUPPORTED:
+                raise
+    os.ftruncate(fd, length)
+
+
+_seek_lock = threading.Lock()
+
+
+def write_at(fd, data, offset):
+    """
+    Write all of ``data`` to the file ``fd`` at ``offset``, without moving
+    its position where ``os.pwrite`` is available, so that several ranges can
+    be written into one file at once.
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            with _seek_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
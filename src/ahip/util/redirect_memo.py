@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+
+from .._collections import RecentlyUsedContainer
+from .timeout import current_time
+
+
+class RedirectMemo(object):
+    """Memo of permanent redirects.
+
+    A ``301 Moved Permanently`` or ``308 Permanent Redirect`` response means
+    that the resource will keep redirecting to the same place, so there is no
+    need to ask again. A :class:`~hip.poolmanager.PoolManager` with a memo
+    remembers these redirects and sends later requests for the old URL
+    straight to the new one, saving a round trip per request::
+
+        http = PoolManager(redirect_memo=RedirectMemo(maxsize=1000, ttl=3600))
+
+    Remembered redirects are followed one at a time, exactly as if the server
+    had sent them: each one counts against the request's
+    :class:`~hip.util.retry.Retry` redirects, and headers that must not be
+    forwarded to another host (see :attr:`Retry.remove_headers_on_redirect
+    <hip.util.retry.Retry.remove_headers_on_redirect>`) are stripped at the
+    hop that leaves the host. Requests that wouldn't follow a redirect ask the
+    server instead. If the request to the new URL fails, or the response is an
+    error, the redirects that led to it are forgotten so that the next request
+    asks the original URL again.
+
+    :param int maxsize:
+        Maximum number of redirects to remember. The least recently used
+        ones are forgotten first.
+
+    :param float ttl:
+        Number of seconds to remember a redirect for, or ``None`` to
+        remember it until it's evicted or fails.
+    """
+
+    PERMANENT_REDIRECT_STATUSES = frozenset([301, 308])
+
+    #: Maximum number of remembered redirects followed in a row, which also
+    #: protects against loops.
+    MAX_CHAIN = 10
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._redirects = RecentlyUsedContainer(maxsize)
+
+    def __len__(self):
+        return len(self._redirects)
+
+    def remember(self, url, location, status):
+        """
+        Remember that ``url`` redirects to the absolute URL ``location``, if
+        ``status`` is a permanent redirect.
+        """
+        if status not in self.PERMANENT_REDIRECT_STATUSES or url == location:
+            return
+        expires = None if self.ttl is None else current_time() + self.ttl
+        self._redirects[url] = (location, status, expires)
+
+    def redirect_for(self, url):
+        """
+        Return the remembered redirect from ``url`` as a ``(location,
+        status)`` tuple, or ``None``.
+        """
+        try:
+            location, status, expires = self._redirects[url]
+        except KeyError:
+            return None
+        if expires is not None and current_time() >= expires:
+            self.forget(url)
+            return None
+        return location, status
+
+    def forget(self, url):
+        """Forget the redirect from ``url``, if there is one."""
+        with self._redirects.lock:
+            if url in self._redirects:
+                del self._redirects[url]
+
+    def clear(self):
+        """Forget every redirect."""
+        self._redirects.clear()
@@ -1,17 +1,28 @@
 from __future__ import absolute_import
 from base64 import b64encode
+import os
+import stat
+import zlib
 
 from .unasync import await_if_coro
 from ..packages.six import b, integer_types
 from ..exceptions import UnrewindableBodyError
 
-ACCEPT_ENCODING = "gzip,deflate"
 try:
-    import brotli as _unused_module_brotli  # noqa: F401
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard as zstd
 except ImportError:
-    pass
-else:
+    zstd = None
+
+ACCEPT_ENCODING = "gzip,deflate"
+if brotli is not None:
     ACCEPT_ENCODING += ",br"
+if zstd is not None:
+    ACCEPT_ENCODING += ",zstd"
 
 _FAILEDTELL = object()
 
@@ -134,3 +145,181 @@ async def rewind_body(body, body_pos):
         raise ValueError(
             "body_pos must be of type integer, instead it was %s." % type(body_pos)
         )
+
+
+async def body_length(body):
+    """
+    Work out how many bytes ``body`` will send, so that it can be framed with
+    ``Content-Length`` rather than ``Transfer-Encoding: chunked``.
+
+    Byte strings and anything else supporting the buffer protocol, and
+    regular files (from their current position) can be sized. Returns None
+    for anything else: iterables of chunks, which are how callers ask for
+    chunked framing, file-like objects that aren't regular files, such as
+    pipes and sockets, and a :class:`CompressedBody`, whose size isn't known
+    until it's compressed.
+    """
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    try:
+        view = memoryview(body)
+    except TypeError:
+        pass
+    else:
+        try:
+            return view.nbytes
+        except AttributeError:  # Platform-specific: Python 2.7
+            return len(view.tobytes())
+
+    if isinstance(body, CompressedBody):
+        return None
+    elif hasattr(body, "read"):
+        try:
+            st = os.fstat(body.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            position = await await_if_coro(body.tell())
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+        return max(st.st_size - position, 0)
+    return None
+
+
+class RequestState(object):
+    """
+    What needs to be remembered about a request while it is retried or
+    redirected, so that :meth:`hip.connectionpool.HTTPConnectionPool.urlopen`
+    and :meth:`hip.poolmanager.PoolManager.urlopen` can loop over attempts
+    instead of recursing.
+
+    :param int body_pos:
+        Where a file-like ``body`` starts, recorded by :meth:`rewind_body`
+        the first time it is called if not given.
+
+    :param deadline:
+        The :class:`~hip.util.timeout.Deadline` for the whole request, if any.
+    """
+
+    def __init__(
+        self,
+        method,
+        url,
+        body=None,
+        headers=None,
+        retries=None,
+        body_pos=None,
+        deadline=None,
+    ):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.retries = retries
+        self.body_pos = body_pos
+        self.deadline = deadline
+
+    async def rewind_body(self):
+        """Move the body back to its start before (re)sending the request."""
+        self.body_pos = await set_file_position(self.body, self.body_pos)
+
+
+class _BrotliCompressor(object):
+    # Supports both 'brotlipy' and 'Brotli' packages, like the decoder in
+    # hip.response.
+    def __init__(self, level):
+        if level is None:
+            self._obj = brotli.Compressor()
+        else:
+            self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        if hasattr(self._obj, "compress"):
+            return self._obj.compress(data)
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.finish()
+
+
+class CompressedBody(object):
+    """A request body to be compressed as it is sent.
+
+    Wrap any body that Hip can send (bytes, a file-like object or an iterable
+    of bytes) to upload it with a ``Content-Encoding``::
+
+        with open('events.ndjson', 'rb') as f:
+            http.request('POST', 'http://example.com/ingest',
+                         body=CompressedBody(f, 'gzip', level=6))
+
+    The body is compressed a chunk at a time while it is sent, so it is never
+    held in memory compressed. As its compressed length isn't known up front
+    it is sent with ``Transfer-Encoding: chunked``, and any
+    ``Content-Length`` header is dropped. The server must accept the
+    encoding: most don't decode request bodies unless configured to.
+
+    If the request is retried or redirected, a file-like body is rewound, as
+    it would be without compression, and compressed again from the start.
+
+    :param body:
+        The uncompressed body.
+
+    :param str encoding:
+        ``"gzip"``, ``"deflate"``, ``"br"`` (if a brotli package is
+        installed) or ``"zstd"`` (if ``zstandard`` is installed).
+
+    :param int level:
+        Compression level, in the range the encoding's library accepts.
+        Higher compresses better but is slower. None for the library's
+        default.
+    """
+
+    ENCODINGS = ["gzip", "deflate"]
+    if brotli is not None:
+        ENCODINGS += ["br"]
+    if zstd is not None:
+        ENCODINGS += ["zstd"]
+
+    def __init__(self, body, encoding="gzip", level=None):
+        if encoding not in self.ENCODINGS:
+            raise ValueError(
+                "Can't compress request bodies with %r, only with %s."
+                % (encoding, ", ".join(self.ENCODINGS))
+            )
+        self.body = body
+        self.encoding = encoding
+        self.level = level
+
+    def __getattr__(self, name):
+        # Rewinding for retries and redirects uses the wrapped body's
+        # position; a fresh compressor is made for each attempt.
+        if name in ("tell", "seek"):
+            return getattr(self.body, name)
+        raise AttributeError(name)
+
+    def compressor(self):
+        """
+        Return a new compressor for this body, with ``compress(data)`` and
+        ``flush()`` methods like :func:`zlib.compressobj`.
+        """
+        level = -1 if self.level is None else self.level
+        if self.encoding == "gzip":
+            return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        if self.encoding == "deflate":
+            return zlib.compressobj(level)
+        if self.encoding == "br":
+            return _BrotliCompressor(self.level)
+        if self.level is None:
+            return zstd.ZstdCompressor().compressobj()
+        return zstd.ZstdCompressor(level=self.level).compressobj()
+
+    def prepare_headers(self, headers):
+        """
+        Return a copy of ``headers`` describing the compressed body rather
+        than the original one.
+        """
+        headers = headers.copy()
+        for name in list(headers):
+            if name.lower() in ("content-length", "content-encoding"):
+                del headers[name]
+        headers["Content-Encoding"] = self.encoding
+        return headers
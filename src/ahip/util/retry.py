@@ -272,35 +272,38 @@ class Retry(object):
 
         return self.parse_retry_after(retry_after)
 
-    def sleep_for_retry(self, response=None):
+    def sleep_for_retry(self, response=None, deadline=None):
         retry_after = self.get_retry_after(response)
         if retry_after:
-            time.sleep(retry_after)
+            _sleep(retry_after, deadline)
             return True
 
         return False
 
-    def _sleep_backoff(self):
+    def _sleep_backoff(self, deadline=None):
         backoff = self.get_backoff_time()
         if backoff <= 0:
             return
-        time.sleep(backoff)
+        _sleep(backoff, deadline)
 
-    def sleep(self, response=None):
+    def sleep(self, response=None, deadline=None):
         """Sleep between retry attempts.
 
         This method will respect a server's ``Retry-After`` response header
         and sleep the duration of the time requested. If that is not present, it
         will use an exponential backoff. By default, the backoff factor is 0 and
         this method will return immediately.
+
+        If a :class:`~hip.util.timeout.Deadline` is given, it won't sleep past
+        it.
         """
 
         if self.respect_retry_after_header and response:
-            slept = self.sleep_for_retry(response)
+            slept = self.sleep_for_retry(response, deadline)
             if slept:
                 return
 
-        self._sleep_backoff()
+        self._sleep_backoff(deadline)
 
     def _is_connection_error(self, err):
         """Errors when we're fairly sure that the server did not receive the
@@ -446,5 +449,11 @@ class Retry(object):
         ).format(cls=type(self), self=self)
 
 
+def _sleep(seconds, deadline=None):
+    if deadline is not None:
+        seconds = deadline.clamp(seconds)
+    time.sleep(seconds)
+
+
 # For backwards compatibility (equivalent to pre-v1.9):
 Retry.DEFAULT = Retry(3)
@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+
+from .._collections import RLock
+
+
+def _hashable(value):
+    # Request options are compared by equality where they can be hashed, and
+    # by their repr otherwise.
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class _Call(object):
+    def __init__(self, event):
+        self.event = event
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Request coalescing ("single-flight") configuration and state.
+
+    When many callers issue the same idempotent request at once, only the
+    first one (the leader) goes to the network. Callers that arrive while it
+    is in flight wait for it instead and share its outcome: the leader's body
+    is buffered once and every caller gets an independent
+    :class:`~hip.response.HTTPResponse` reading from that buffer, or the
+    leader's exception is raised to all of them.
+
+    Requests are considered identical if they have the same method and URL,
+    the same values for every header except those in ``ignore_headers``, and
+    the same values for every other request option, such as ``retries``,
+    ``redirect`` or ``body_limits``. Requests with a body, and requests made
+    with ``preload_content=False`` (which are streamed, not buffered), are
+    never coalesced.
+
+    Coalescing is enabled on a :class:`~hip.poolmanager.PoolManager`::
+
+        http = PoolManager(single_flight=SingleFlight())
+        response = http.request('GET', 'http://example.com/config')
+
+    Because the whole body is buffered in memory, only use this for
+    endpoints with reasonably small responses.
+
+    :param iterable ignore_headers:
+        Names of the request headers (case-insensitive) whose values aren't
+        part of the key, because they don't change what the server sends
+        back. Only list headers that are safe to share responses across: any
+        header carrying credentials, such as an API key, must not be listed,
+        otherwise callers could be handed each other's responses.
+
+    :param iterable method_whitelist:
+        Set of uppercased HTTP method verbs that may be coalesced.
+    """
+
+    DEFAULT_METHOD_WHITELIST = frozenset(["GET", "HEAD"])
+
+    DEFAULT_IGNORE_HEADERS = frozenset(
+        ["user-agent", "x-request-id", "traceparent", "tracestate"]
+    )
+
+    def __init__(
+        self,
+        ignore_headers=DEFAULT_IGNORE_HEADERS,
+        method_whitelist=DEFAULT_METHOD_WHITELIST,
+    ):
+        self.ignore_headers = frozenset(h.lower() for h in ignore_headers)
+        self.method_whitelist = method_whitelist
+
+        #: Number of requests that were served by another caller's request.
+        self.coalesced = 0
+
+        self.lock = RLock()
+        self._calls = {}
+
+    @property
+    def in_flight(self):
+        """Number of distinct requests currently in flight."""
+        return len(self._calls)
+
+    def key_for(self, method, url, headers=None, body=None, **request_kw):
+        """
+        Return the key identifying this request, or ``None`` if it must not
+        be coalesced. ``request_kw`` are the request's other options, which
+        must all match for requests to be coalesced.
+        """
+        method = method.upper()
+        if body is not None or method not in self.method_whitelist:
+            return None
+        if not request_kw.get("preload_content", True):
+            return None
+
+        selected = sorted(
+            (name.lower(), value)
+            for name, value in (headers or {}).items()
+            if name.lower() not in self.ignore_headers
+        )
+        options = sorted((name, _hashable(value)) for name, value in request_kw.items())
+        return (method, url, tuple(selected), tuple(options))
+
+    async def do(self, key, fn, backend):
+        """
+        Await ``fn()`` unless a call with the same ``key`` is already in
+        flight, in which case wait for that call to finish instead.
+
+        Every caller gets the same result object, so it should be treated as
+        read-only.
+        """
+        with self.lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call(backend.create_event())
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            await call.event.wait()
+            if call.error is None:
+                return call.result
+            if isinstance(call.error, Exception):
+                raise call.error
+            # The leader was cancelled (or interrupted), which says nothing
+            # about the request itself: try again, possibly as the leader.
+            return await self.do(key, fn, backend)
+
+        try:
+            call.result = await fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self._calls[key]
+            await call.event.set()
+
+        return call.result
@@ -3,9 +3,10 @@ from __future__ import absolute_import
 # The default socket timeout, used by httplib to indicate that no timeout was
 # specified by the user
 from socket import _GLOBAL_DEFAULT_TIMEOUT
+import collections
 import time
 
-from ..exceptions import TimeoutStateError
+from ..exceptions import DeadlineExceededError, TimeoutStateError
 
 # A sentinel value to indicate that no timeout was specified by the user in Hip
 _Default = object()
@@ -64,6 +65,23 @@ class Timeout(object):
 
     :type read: integer, float, or None
 
+    :param low_speed_limit:
+        Together with ``low_speed_time``, the slowest acceptable transfer of
+        the response body. If the server sends fewer than
+        ``low_speed_limit`` bytes per second, averaged over any
+        ``low_speed_time`` seconds spent waiting for it, reading the body
+        raises :exc:`~hip.exceptions.ReadTimeoutError` and the connection is
+        discarded. Time the caller spends between reads is not counted.
+        Defaults to None, meaning no limit.
+
+    :type low_speed_limit: integer, float, or None
+
+    :param low_speed_time:
+        The window, in seconds, over which ``low_speed_limit`` is measured.
+        No single read waits longer than this.
+
+    :type low_speed_time: integer, float, or None
+
     .. note::
 
         Many factors can affect the total amount of time for Hip to return
@@ -81,20 +99,33 @@ class Timeout(object):
         has not sent the first byte in the specified time. This is not always
         the case; if a server streams one byte every fifteen seconds, a timeout
         of 20 seconds will not trigger, even though the request will take
-        several minutes to complete.
+        several minutes to complete. Use ``low_speed_limit`` to abort such
+        slow transfers.
 
         If your goal is to cut off any request after a set amount of wall clock
-        time, consider having a second "watcher" thread to cut off a slow
-        request.
+        time, use a :class:`Deadline` instead.
     """
 
     #: A sentinel object representing the default timeout value
     DEFAULT_TIMEOUT = _GLOBAL_DEFAULT_TIMEOUT
 
-    def __init__(self, total=None, connect=_Default, read=_Default):
+    def __init__(
+        self,
+        total=None,
+        connect=_Default,
+        read=_Default,
+        low_speed_limit=None,
+        low_speed_time=None,
+    ):
         self._connect = self._validate_timeout(connect, "connect")
         self._read = self._validate_timeout(read, "read")
         self.total = self._validate_timeout(total, "total")
+        self.low_speed_limit = self._validate_timeout(
+            low_speed_limit, "low_speed_limit"
+        )
+        self.low_speed_time = self._validate_timeout(low_speed_time, "low_speed_time")
+        if (self.low_speed_limit is None) != (self.low_speed_time is None):
+            raise ValueError("low_speed_limit and low_speed_time must be set together.")
         self._start_connect = None
 
     def __str__(self):
@@ -179,7 +210,13 @@ class Timeout(object):
         # We can't use copy.deepcopy because that will also create a new object
         # for _GLOBAL_DEFAULT_TIMEOUT, which socket.py uses as a sentinel to
         # detect the user default.
-        return Timeout(connect=self._connect, read=self._read, total=self.total)
+        return Timeout(
+            connect=self._connect,
+            read=self._read,
+            total=self.total,
+            low_speed_limit=self.low_speed_limit,
+            low_speed_time=self.low_speed_time,
+        )
 
     def start_connect(self):
         """Start the timeout clock, used during a connect() attempt
@@ -255,3 +292,137 @@ class Timeout(object):
             return max(0, self.total - self.get_connect_duration())
         else:
             return self._read
+
+    def low_speed_window(self):
+        """Start measuring a response body against the low-speed limit.
+
+        :return: A fresh :class:`LowSpeedWindow`, or None if there is no
+            low-speed limit.
+        """
+        if self.low_speed_limit is None:
+            return None
+        return LowSpeedWindow(
+            self.low_speed_limit * self.low_speed_time, self.low_speed_time
+        )
+
+
+class LowSpeedWindow(object):
+    """Bytes received over the last ``period`` seconds spent waiting for them.
+
+    Only the time spent waiting on the server is counted, so a caller that
+    reads slowly doesn't make the server look slow.
+
+    :param min_bytes:
+        Fewest bytes that must arrive in any ``period`` seconds of waiting.
+    :param period:
+        Length of the window in seconds.
+    """
+
+    def __init__(self, min_bytes, period):
+        self.min_bytes = min_bytes
+        self.period = period
+        self._waited = 0
+        self._received = 0
+        # (seconds waited so far, bytes) for every chunk still in the window.
+        self._chunks = collections.deque()
+
+    def update(self, num_bytes, waited):
+        """Record that ``num_bytes`` arrived after waiting ``waited`` seconds.
+
+        :return: False if fewer than ``min_bytes`` arrived over the last
+            ``period`` seconds of waiting, otherwise True.
+        """
+        self._waited += waited
+        self._received += num_bytes
+        self._chunks.append((self._waited, num_bytes))
+        while self._chunks[0][0] <= self._waited - self.period:
+            self._received -= self._chunks.popleft()[1]
+        return self._waited < self.period or self._received >= self.min_bytes
+
+
+class Deadline(object):
+    """A point in time by which a whole request must be finished.
+
+    A :class:`Timeout` bounds each attempt at a request separately, so retries
+    and redirects each start a new clock, and reading the body is only bounded
+    between packets. A deadline covers everything the request does: every
+    attempt, retry and redirect, the sleeps between them and reading the
+    response body. Each of these waits for no longer than the time left::
+
+        response = http.request('GET', 'http://example.com/', deadline=5.0)
+
+    A number of seconds is turned into a deadline when the request is made.
+    Passing the same :class:`Deadline` to several requests bounds them
+    together::
+
+        deadline = Deadline(10.0)
+        a = http.request('GET', 'http://example.com/a', deadline=deadline)
+        b = http.request('GET', 'http://example.com/b', deadline=deadline)
+
+    Once the deadline has passed, :exc:`~hip.exceptions.DeadlineExceededError`
+    is raised.
+
+    :param seconds:
+        How long from now the deadline is.
+    :type seconds: integer or float
+    """
+
+    def __init__(self, seconds):
+        self.expires = current_time() + seconds
+
+    def __repr__(self):
+        return "%s(remaining=%r)" % (type(self).__name__, self.remaining())
+
+    @classmethod
+    def from_float(cls, deadline):
+        """Turn a number of seconds into a :class:`Deadline` starting now.
+
+        :param deadline: Number of seconds, a :class:`Deadline` or None.
+        :rtype: :class:`Deadline` or None
+        """
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline)
+
+    def remaining(self):
+        """Seconds left before the deadline, or 0 if it has passed."""
+        return max(0, self.expires - current_time())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, pool=None, url=None):
+        """
+        :raises hip.exceptions.DeadlineExceededError: if the deadline has
+            passed.
+        """
+        if self.expired:
+            raise DeadlineExceededError(pool, url, "Request deadline exceeded.")
+
+    def clamp(self, timeout):
+        """Return ``timeout`` or the time left, whichever is shorter.
+
+        :param timeout: Seconds, None or :attr:`Timeout.DEFAULT_TIMEOUT`, all
+            of which are limited to the time left.
+        """
+        remaining = self.remaining()
+        if timeout is None or timeout is Timeout.DEFAULT_TIMEOUT:
+            return remaining
+        return min(timeout, remaining)
+
+    def clamp_timeout(self, timeout):
+        """Return a copy of the :class:`Timeout` ``timeout`` that ends no later
+        than the deadline.
+
+        :raises hip.exceptions.DeadlineExceededError: if the deadline has
+            passed.
+        """
+        self.check()
+        return Timeout(
+            connect=timeout._connect,
+            read=timeout._read,
+            total=self.clamp(timeout.total),
+            low_speed_limit=timeout.low_speed_limit,
+            low_speed_time=timeout.low_speed_time,
+        )
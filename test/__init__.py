@@ -13,6 +13,11 @@ try:
 except ImportError:
     brotli = None
 
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
 from hip.exceptions import HTTPWarning
 from hip.packages import six
 from hip.util import ssl_
@@ -128,6 +133,16 @@ def notBrotlipy():
     )
 
 
+def onlyZstd():
+    return pytest.mark.skipif(zstd is None, reason="only run if zstandard is present")
+
+
+def notZstd():
+    return pytest.mark.skipif(
+        zstd is not None, reason="only run if zstandard is absent"
+    )
+
+
 def notSecureTransport(test):
     """Skips this test when SecureTransport is in use."""
 
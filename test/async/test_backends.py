@@ -14,3 +14,29 @@ def test_sniff_backends():
     curio.run(_test_sniff_async, "anyio")
     loop = asyncio.get_event_loop()
     loop.run_until_complete(_test_sniff_async("anyio"))
+
+
+def test_trio_staggered_race_discards_losers_after_cancel():
+    from ahip._backends.trio_backend import TrioBackend
+
+    discarded = []
+
+    async def winner():
+        await trio.sleep(0.01)
+        return 1
+
+    async def loser():
+        # Finishes even though the race is cancelled when the winner wins.
+        with trio.CancelScope(shield=True):
+            await trio.sleep(0.05)
+        return 2
+
+    async def discard(value):
+        await trio.sleep(0)
+        discarded.append(value)
+
+    async def race():
+        return await TrioBackend().staggered_race([winner, loser], 0, discard)
+
+    assert trio.run(race) == 1
+    assert discarded == [2]
@@ -52,3 +52,13 @@ class TestLoadBackend(object):
 
     def test_sync(self):
         load_backend(normalize_backend("sync", async_mode=False))
+
+
+class TestSyncBackend(object):
+    def test_staggered_race_raises_base_exceptions(self):
+        def interrupted():
+            raise KeyboardInterrupt()
+
+        backend = load_backend(normalize_backend("sync", async_mode=False))
+        with pytest.raises(KeyboardInterrupt):
+            backend.staggered_race([interrupted, interrupted], 0.01, None)
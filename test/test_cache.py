@@ -0,0 +1,564 @@
+import hashlib
+import json
+import mmap
+import os
+import zlib
+
+import mock
+import pytest
+
+from hip.cache import (
+    CacheEntry,
+    DiskCacheStore,
+    HTTPCache,
+    MemoryCacheStore,
+    parse_cache_control,
+)
+from hip.exceptions import BodyTooLargeError
+from hip.poolmanager import PoolManager
+from hip.response import BytesBody, HTTPResponse
+from hip.util.digest import BodyDigest
+from hip.util.limits import BodyLimits
+
+URL = "http://example.com/resource"
+DATE = "Mon, 01 Jan 2018 00:00:00 GMT"
+# DATE as seconds since the epoch.
+NOW = 1514764800
+
+
+class FakeServer(object):
+    """Stands in for a pool's urlopen, returning canned responses."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, method, url, headers=None, preload_content=True, **kw):
+        self.requests.append((method, url, dict(headers or {})))
+        status, headers, body = self.responses.pop(0)
+        if isinstance(body, list):
+            body = (chunk for chunk in body)
+        else:
+            body = BytesBody(body)
+        response = HTTPResponse(body=body, headers=headers, status=status)
+        if preload_content:
+            response.preload_content()
+        return response
+
+
+@pytest.fixture
+def now():
+    with mock.patch("hip.cache._now") as _now:
+        _now.return_value = NOW
+        yield _now
+
+
+class TestParseCacheControl(object):
+    def test_directives(self):
+        assert parse_cache_control('max-age=60, No-Cache, private="x"') == {
+            "max-age": "60",
+            "no-cache": None,
+            "private": "x",
+        }
+
+    def test_empty(self):
+        assert parse_cache_control(None) == {}
+        assert parse_cache_control(" , ") == {}
+
+
+class TestCacheEntry(object):
+    def entry(self, headers, status=200):
+        headers.setdefault("Date", DATE)
+        return CacheEntry(status, headers, b"body", response_time=NOW)
+
+    def test_max_age(self):
+        entry = self.entry({"Cache-Control": "max-age=60"})
+        assert entry.freshness_lifetime() == 60
+        assert entry.is_fresh(now=NOW + 59)
+        assert not entry.is_fresh(now=NOW + 60)
+
+    def test_s_maxage_only_for_shared(self):
+        entry = self.entry({"Cache-Control": "max-age=60, s-maxage=10"})
+        assert entry.freshness_lifetime(shared=False) == 60
+        assert entry.freshness_lifetime(shared=True) == 10
+
+    def test_expires(self):
+        entry = self.entry({"Expires": "Mon, 01 Jan 2018 00:01:00 GMT"})
+        assert entry.freshness_lifetime() == 60
+
+    def test_invalid_expires_is_stale(self):
+        entry = self.entry({"Expires": "0"})
+        assert entry.freshness_lifetime() == 0
+
+    def test_heuristic_freshness(self):
+        entry = self.entry({"Last-Modified": "Sun, 31 Dec 2017 23:00:00 GMT"})
+        assert entry.freshness_lifetime() == 360
+        entry = self.entry(
+            {"Last-Modified": "Sun, 31 Dec 2017 23:00:00 GMT"}, status=302
+        )
+        assert entry.freshness_lifetime() == 0
+
+    def test_age_header(self):
+        entry = self.entry({"Cache-Control": "max-age=60", "Age": "50"})
+        assert entry.age(now=NOW + 5) == 55
+        assert not entry.is_fresh(now=NOW + 10)
+
+    def test_request_directives(self):
+        entry = self.entry({"Cache-Control": "max-age=60"})
+        assert not entry.is_fresh({"no-cache": None}, now=NOW)
+        assert not entry.is_fresh({"max-age": "10"}, now=NOW + 20)
+        assert not entry.is_fresh({"min-fresh": "50"}, now=NOW + 20)
+
+    def test_max_stale(self):
+        entry = self.entry({"Cache-Control": "max-age=60"})
+        assert entry.is_fresh({"max-stale": "30"}, now=NOW + 80)
+        assert not entry.is_fresh({"max-stale": "30"}, now=NOW + 90)
+        assert entry.is_fresh({"max-stale": None}, now=NOW + 10000)
+        assert not entry.is_fresh({"max-stale": None, "max-age": "100"}, now=NOW + 200)
+
+        entry = self.entry({"Cache-Control": "max-age=60, must-revalidate"})
+        assert not entry.is_fresh({"max-stale": None}, now=NOW + 80)
+
+    def test_vary(self):
+        entry = CacheEntry(200, {}, vary={"accept-encoding": "gzip"})
+        assert entry.matches({"Accept-Encoding": "gzip"})
+        assert not entry.matches({"Accept-Encoding": "br"})
+        assert not entry.matches({})
+
+
+class TestMemoryCacheStore(object):
+    def test_evicts_least_recently_used_by_size(self):
+        store = MemoryCacheStore(max_size=250)
+        for key in "abc":
+            store.set(key, CacheEntry(200, {}, b"x" * 100))
+        assert len(store) == 2
+        assert store.get("a") is None
+
+        # Touching "b" makes "c" the next one to go.
+        store.get("b")
+        store.set("d", CacheEntry(200, {}, b"x" * 100))
+        assert store.get("b") is not None
+        assert store.get("c") is None
+        assert store.size == 200
+
+    def test_oversized_entry_is_not_stored(self):
+        store = MemoryCacheStore(max_size=10)
+        store.set("a", CacheEntry(200, {}, b"x" * 11))
+        assert len(store) == 0
+        assert store.size == 0
+
+    def test_replace_and_delete(self):
+        store = MemoryCacheStore()
+        store.set("a", CacheEntry(200, {}, b"x" * 10))
+        store.set("a", CacheEntry(200, {}, b"x" * 5))
+        assert store.size == 5
+        store.delete("a")
+        store.delete("a")
+        assert store.size == 0
+
+
+class TestDiskCacheStore(object):
+    def entry(self, body=b"hello"):
+        return CacheEntry(
+            200,
+            [("ETag", '"v1"'), ("Set-Cookie", "a=1"), ("Set-Cookie", "b=2")],
+            body,
+            reason="OK",
+            version=b"HTTP/1.1",
+            vary={"accept": None},
+            response_time=NOW,
+        )
+
+    def test_round_trip(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        store.set(URL, self.entry())
+        entry = store.get(URL)
+
+        assert isinstance(entry.body, mmap.mmap)
+        assert entry.body[:] == b"hello"
+        assert entry.status == 200
+        assert entry.reason == "OK"
+        assert entry.version == b"HTTP/1.1"
+        assert entry.headers.getlist("set-cookie") == ["a=1", "b=2"]
+        assert entry.vary == {"accept": None}
+        assert entry.response_time == NOW
+
+    def test_empty_body(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        store.set(URL, self.entry(b""))
+        assert store.get(URL).body == b""
+
+    def test_survives_restart(self, tmpdir):
+        DiskCacheStore(str(tmpdir)).set(URL, self.entry())
+        store = DiskCacheStore(str(tmpdir))
+        assert len(store) == 1
+        assert store.get(URL).body[:] == b"hello"
+        assert store.size == self.entry().size
+
+    def test_missing_body_file_is_dropped(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        store.set(URL, self.entry())
+        for name in os.listdir(str(tmpdir)):
+            if name not in (DiskCacheStore.INDEX_NAME, DiskCacheStore.JOURNAL_NAME):
+                os.remove(os.path.join(str(tmpdir), name))
+        assert len(DiskCacheStore(str(tmpdir))) == 0
+
+    def test_corrupt_index(self, tmpdir):
+        tmpdir.join(DiskCacheStore.INDEX_NAME).write("{not json")
+        assert len(DiskCacheStore(str(tmpdir))) == 0
+
+    def test_evicts_least_recently_used_by_size(self, tmpdir):
+        size = self.entry(b"x" * 100).size
+        store = DiskCacheStore(str(tmpdir), max_size=size * 2)
+        for key in "abc":
+            store.set(key, self.entry(b"x" * 100))
+        assert store.get("a") is None
+        assert len(store) == 2
+        assert store.size == size * 2
+        # Two bodies, the index and its journal.
+        assert len(os.listdir(str(tmpdir))) == 4
+
+    def test_least_recently_used_survives_restart(self, tmpdir):
+        size = self.entry(b"x" * 100).size
+        store = DiskCacheStore(str(tmpdir), max_size=size * 2)
+        store.set("a", self.entry(b"x" * 100))
+        store.set("b", self.entry(b"x" * 100))
+        store.get("a")
+
+        store = DiskCacheStore(str(tmpdir), max_size=size * 2)
+        store.set("c", self.entry(b"x" * 100))
+        assert store.get("b") is None
+        assert store.get("a") is not None
+
+    def test_changes_are_journaled(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        store.MIN_JOURNAL_LENGTH = 3
+        index = tmpdir.join(DiskCacheStore.INDEX_NAME)
+        for key in "abc":
+            store.set(key, self.entry())
+        assert index.read() == "[]"
+        assert len(tmpdir.join(DiskCacheStore.JOURNAL_NAME).readlines()) == 3
+
+        # The journal is folded into the index once it's long enough.
+        store.delete("a")
+        assert tmpdir.join(DiskCacheStore.JOURNAL_NAME).read() == ""
+        assert [key for key, _ in json.loads(index.read())] == ["b", "c"]
+        assert len(DiskCacheStore(str(tmpdir))) == 2
+
+    def test_torn_journal(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        store.set("a", self.entry())
+        tmpdir.join(DiskCacheStore.JOURNAL_NAME).write('["set","b",{', mode="a")
+        assert len(DiskCacheStore(str(tmpdir))) == 1
+
+    def test_stray_files_are_removed(self, tmpdir):
+        tmpdir.join("body-unfinished").write("x")
+        DiskCacheStore(str(tmpdir))
+        assert not tmpdir.join("body-unfinished").exists()
+
+    def test_body_is_written_as_it_arrives(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        writer = store.writer(URL)
+        writer.write(b"hel")
+        writer.write(b"lo")
+        assert len(store) == 0
+        entry = writer.commit(self.entry(b""))
+        assert entry.body[:] == b"hello"
+        assert store.get(URL).body[:] == b"hello"
+
+        writer = store.writer("other")
+        writer.write(b"abc")
+        writer.discard()
+        assert len(os.listdir(str(tmpdir))) == 3
+
+    def test_delete_and_clear(self, tmpdir):
+        store = DiskCacheStore(str(tmpdir))
+        store.set("a", self.entry())
+        store.set("b", self.entry())
+        store.delete("a")
+        assert store.get("a") is None
+        store.clear()
+        assert len(store) == 0
+        assert store.size == 0
+        assert sorted(os.listdir(str(tmpdir))) == [
+            DiskCacheStore.INDEX_NAME,
+            DiskCacheStore.JOURNAL_NAME,
+        ]
+
+    def test_mapping_is_closed_with_response(self, tmpdir, now):
+        cache = HTTPCache(DiskCacheStore(str(tmpdir)))
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, b"hello"))
+        cache.urlopen(send, "GET", URL)
+
+        r = cache.urlopen(send, "GET", URL, preload_content=False)
+        body = r._fp._data
+        assert not body.closed
+        r.close()
+        assert body.closed
+
+        entry = cache.store.get(URL)
+        entry.close()
+        assert entry.body.closed
+
+    def test_revalidation_keeps_body_file(self, tmpdir, now):
+        cache = HTTPCache(DiskCacheStore(str(tmpdir)))
+        send = FakeServer(
+            (200, {"Cache-Control": "max-age=10", "ETag": '"v1"'}, b"hello"),
+            (304, {"Cache-Control": "max-age=100"}, b""),
+        )
+        cache.urlopen(send, "GET", URL)
+        files = sorted(os.listdir(str(tmpdir)))
+
+        now.return_value = NOW + 20
+        with mock.patch.object(DiskCacheStore, "writer") as writer:
+            assert cache.urlopen(send, "GET", URL).data == b"hello"
+        assert not writer.called
+        assert sorted(os.listdir(str(tmpdir))) == files
+
+        store = DiskCacheStore(str(tmpdir))
+        entry = store.get(URL)
+        assert entry.headers["Cache-Control"] == "max-age=100"
+        assert entry.body[:] == b"hello"
+
+    def test_streams_memoryviews(self, tmpdir, now):
+        cache = HTTPCache(DiskCacheStore(str(tmpdir)))
+        body = b"x" * 150000
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, body))
+        cache.urlopen(send, "GET", URL)
+
+        r = cache.urlopen(send, "GET", URL, preload_content=False)
+        chunks = list(r.stream())
+        assert all(isinstance(chunk, memoryview) for chunk in chunks)
+        assert [len(chunk) for chunk in chunks] == [65536, 65536, 18928]
+        assert b"".join(chunks) == body
+        assert cache.stats.hits == 1
+
+
+class TestHTTPCache(object):
+    def test_fresh_hit(self, now):
+        cache = HTTPCache()
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, b"hello"))
+
+        assert cache.urlopen(send, "GET", URL).data == b"hello"
+        now.return_value = NOW + 30
+        r = cache.urlopen(send, "GET", URL)
+
+        assert r.data == b"hello"
+        assert r.headers["Age"] == "30"
+        assert len(send.requests) == 1
+        assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (1, 1, 1)
+
+    def test_stale_entry_is_revalidated(self, now):
+        cache = HTTPCache()
+        send = FakeServer(
+            (200, {"Cache-Control": "max-age=10", "ETag": '"v1"'}, b"hello"),
+            (304, {"Cache-Control": "max-age=100", "Content-Length": "0"}, b""),
+        )
+        cache.urlopen(send, "GET", URL)
+
+        now.return_value = NOW + 20
+        r = cache.urlopen(send, "GET", URL)
+        assert r.status == 200
+        assert r.data == b"hello"
+        assert r.headers["Cache-Control"] == "max-age=100"
+        assert send.requests[1][2]["If-None-Match"] == '"v1"'
+        assert cache.stats.revalidations == 1
+
+        # The 304 made the entry fresh again.
+        now.return_value = NOW + 50
+        assert cache.urlopen(send, "GET", URL).data == b"hello"
+        assert len(send.requests) == 2
+
+    def test_changed_resource_replaces_entry(self, now):
+        cache = HTTPCache()
+        send = FakeServer(
+            (200, {"ETag": '"v1"', "Cache-Control": "no-cache"}, b"old"),
+            (200, {"ETag": '"v2"', "Cache-Control": "no-cache"}, b"new"),
+        )
+        cache.urlopen(send, "GET", URL)
+        assert cache.urlopen(send, "GET", URL).data == b"new"
+        assert cache.store.get(URL).headers["ETag"] == '"v2"'
+        assert cache.stats.misses == 2
+
+    def test_vary(self, now):
+        cache = HTTPCache()
+        send = FakeServer(
+            (200, {"Cache-Control": "max-age=60", "Vary": "Accept"}, b"json"),
+            (200, {"Cache-Control": "max-age=60", "Vary": "Accept"}, b"xml"),
+        )
+        json_headers = {"Accept": "application/json"}
+        cache.urlopen(send, "GET", URL, headers=json_headers)
+        r = cache.urlopen(send, "GET", URL, headers={"Accept": "text/xml"})
+        assert r.data == b"xml"
+        assert len(send.requests) == 2
+
+        # Both variants are kept.
+        assert cache.urlopen(send, "GET", URL, headers=json_headers).data == b"json"
+        assert (
+            cache.urlopen(send, "GET", URL, headers={"Accept": "text/xml"}).data
+            == b"xml"
+        )
+        assert cache.stats.hits == 2
+
+    def test_unsafe_method_invalidates_variants(self, now):
+        cache = HTTPCache()
+        send = FakeServer(
+            (200, {"Cache-Control": "max-age=60", "Vary": "Accept"}, b"json"),
+            (204, {}, b""),
+            (200, {"Cache-Control": "max-age=60", "Vary": "Accept"}, b"xml"),
+        )
+        cache.urlopen(send, "GET", URL, headers={"Accept": "application/json"})
+        cache.urlopen(send, "POST", URL, body=b"x")
+        cache.urlopen(send, "GET", URL, headers={"Accept": "text/xml"})
+        assert len(cache.store) == 2
+
+    def test_revalidation_leaves_stored_entry_alone(self, now):
+        cache = HTTPCache()
+        send = FakeServer(
+            (200, {"Cache-Control": "max-age=10", "ETag": '"v1"'}, b"hello"),
+            (304, {"Cache-Control": "max-age=100"}, b""),
+        )
+        cache.urlopen(send, "GET", URL)
+        old = cache.store.get(URL)
+
+        now.return_value = NOW + 20
+        cache.urlopen(send, "GET", URL)
+        assert old.headers["Cache-Control"] == "max-age=10"
+        assert cache.store.get(URL).headers["Cache-Control"] == "max-age=100"
+
+    @pytest.mark.parametrize(
+        "request_headers, response_headers",
+        [
+            ({}, {"Cache-Control": "no-store"}),
+            ({"Cache-Control": "no-store"}, {"Cache-Control": "max-age=60"}),
+            ({}, {"Cache-Control": "max-age=60", "Vary": "*"}),
+            ({}, {}),
+        ],
+    )
+    def test_not_stored(self, now, request_headers, response_headers):
+        cache = HTTPCache()
+        send = FakeServer((200, response_headers, b"a"), (200, {}, b"b"))
+        cache.urlopen(send, "GET", URL, headers=request_headers)
+        assert cache.urlopen(send, "GET", URL).data == b"b"
+        assert cache.store.get(URL) is None
+
+    def test_shared_cache_skips_private(self, now):
+        send = FakeServer(
+            (200, {"Cache-Control": "private, max-age=60"}, b"a"),
+            (200, {"Cache-Control": "private, max-age=60"}, b"a"),
+        )
+        shared = HTTPCache(shared=True)
+        shared.urlopen(send, "GET", URL)
+        assert shared.store.get(URL) is None
+
+        private = HTTPCache()
+        private.urlopen(send, "GET", URL)
+        assert private.store.get(URL) is not None
+
+    def test_unsafe_method_invalidates(self, now):
+        cache = HTTPCache()
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, b"a"), (204, {}, b""))
+        cache.urlopen(send, "GET", URL)
+        cache.urlopen(send, "POST", URL, body=b"x")
+        assert cache.store.get(URL) is None
+
+    def test_conditional_requests_bypass_cache(self, now):
+        cache = HTTPCache()
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, b"a"), (304, {}, b""))
+        cache.urlopen(send, "GET", URL)
+        r = cache.urlopen(send, "GET", URL, headers={"If-None-Match": '"x"'})
+        assert r.status == 304
+
+    @pytest.mark.parametrize(
+        "request_headers", [{"Range": "bytes=0-1"}, {"If-Range": '"v1"'}]
+    )
+    def test_range_requests_bypass_cache(self, now, request_headers):
+        cache = HTTPCache()
+        send = FakeServer(
+            (200, {"Cache-Control": "max-age=60"}, b"hello"),
+            (206, {"Content-Range": "bytes 0-1/5"}, b"he"),
+        )
+        cache.urlopen(send, "GET", URL)
+        r = cache.urlopen(send, "GET", URL, headers=request_headers)
+        assert r.status == 206
+        assert r.data == b"he"
+
+    def test_partial_content_is_not_stored(self, now):
+        cache = HTTPCache()
+        headers = {"Cache-Control": "max-age=60", "Content-Range": "bytes 0-1/5"}
+        send = FakeServer((206, headers, b"he"))
+        cache.urlopen(send, "GET", URL)
+        assert len(cache.store) == 0
+
+    def test_body_too_large_for_store_is_not_read(self, now):
+        cache = HTTPCache(MemoryCacheStore(max_size=100))
+        headers = {"Cache-Control": "max-age=60", "Content-Length": "1000"}
+        send = FakeServer((200, headers, b"x" * 1000))
+        r = cache.urlopen(send, "GET", URL, preload_content=False)
+        assert r._fp_bytes_read == 0
+        assert r.data == b"x" * 1000
+        assert len(cache.store) == 0
+        assert cache.stats.stores == 0
+
+    def test_body_of_unknown_length_too_large_for_store(self, now):
+        cache = HTTPCache(MemoryCacheStore(max_size=100))
+        # Without a Content-Length, in chunks of 30 bytes.
+        body = [b"x" * 30] * 33 + [b"x" * 10]
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, body))
+        r = cache.urlopen(send, "GET", URL)
+        assert r.data == b"x" * 1000
+        assert len(cache.store) == 0
+        assert cache.stats.stores == 0
+
+    def test_response_arguments_apply_to_cached_responses(self, now):
+        cache = HTTPCache()
+        send = FakeServer((200, {"Cache-Control": "max-age=60"}, b"x" * 100))
+        cache.urlopen(send, "GET", URL)
+        with pytest.raises(BodyTooLargeError):
+            limits = BodyLimits(max_encoded_bytes=10)
+            cache.urlopen(send, "GET", URL, body_limits=limits)
+
+    @pytest.mark.parametrize("stored", [True, False])
+    def test_digests_computed_only_for_caller(self, now, stored):
+        cache = HTTPCache()
+        headers = {"Cache-Control": "max-age=60"} if stored else {}
+        send = mock.Mock(wraps=FakeServer((200, headers, b"hello")))
+        expected = hashlib.sha256(b"hello").hexdigest()
+        r = cache.urlopen(
+            send, "GET", URL, digests=[BodyDigest("sha256", expected=expected)]
+        )
+        assert r.data == b"hello"
+        assert r.digests[0].hexdigest() == expected
+        assert "digests" not in send.call_args[1]
+        assert len(cache.store) == int(stored)
+
+    def test_only_if_cached(self, now):
+        cache = HTTPCache()
+        r = cache.urlopen(None, "GET", URL, headers={"Cache-Control": "only-if-cached"})
+        assert r.status == 504
+
+    def test_body_is_stored_encoded(self, now):
+        cache = HTTPCache()
+        body = zlib.compress(b"hello")
+        headers = {"Cache-Control": "max-age=60", "Content-Encoding": "deflate"}
+        send = FakeServer((200, headers, body))
+        assert cache.urlopen(send, "GET", URL).data == b"hello"
+        assert cache.store.get(URL).body == body
+        assert cache.urlopen(send, "GET", URL).data == b"hello"
+        r = cache.urlopen(send, "GET", URL, decode_content=False)
+        assert r.data == body
+
+
+class TestPoolManagerCache(object):
+    def test_hit_skips_pool(self, now):
+        p = PoolManager(cache=HTTPCache())
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.side_effect = FakeServer(
+                (200, {"Cache-Control": "max-age=60"}, b"hello")
+            )
+            assert p.request("GET", URL).data == b"hello"
+            assert p.request("GET", URL).data == b"hello"
+
+        assert pool.urlopen.call_count == 1
+        assert p.cache.stats.hits == 1
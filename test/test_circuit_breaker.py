@@ -0,0 +1,214 @@
+import mock
+import pytest
+
+from hip.exceptions import (
+    CircuitOpenError,
+    ConnectTimeoutError,
+    MaxRetryError,
+    NewConnectionError,
+    ProtocolError,
+    SSLError,
+)
+from hip.poolmanager import PoolManager
+from hip.response import HTTPResponse
+from hip.util.circuit_breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(object):
+    def test_starts_closed(self):
+        breaker = CircuitBreaker()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.before_request()
+
+    def test_trips_on_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3)
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request("http://example.com/")
+
+    def test_success_resets_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.failure_count == 1
+
+    def test_trips_on_error_rate(self):
+        breaker = CircuitBreaker(
+            failure_threshold=None, error_rate_threshold=0.5, window_size=4, min_calls=4
+        )
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        breaker.record_success()
+        breaker.record_failure()
+        # The window now holds [success, failure, success, failure].
+        assert breaker.error_rate == 0.5
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_invalid_error_rate(self):
+        with pytest.raises(ValueError):
+            CircuitBreaker(error_rate_threshold=1.5)
+
+    def test_half_open_probes(self):
+        with mock.patch("hip.util.circuit_breaker.current_time") as current_time:
+            current_time.return_value = 100
+            breaker = CircuitBreaker(
+                failure_threshold=1, recovery_timeout=10, half_open_max_calls=1
+            )
+            breaker.record_failure()
+            assert breaker.state == CircuitBreaker.OPEN
+            assert breaker.get_retry_after() == 10
+
+            current_time.return_value = 110
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+
+            # One probe is allowed, the next caller fails fast.
+            breaker.before_request()
+            with pytest.raises(CircuitOpenError):
+                breaker.before_request()
+
+            breaker.record_success()
+            assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_failure_reopens(self):
+        with mock.patch("hip.util.circuit_breaker.current_time") as current_time:
+            current_time.return_value = 100
+            breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+            breaker.record_failure()
+
+            current_time.return_value = 115
+            breaker.before_request()
+            breaker.record_failure()
+            assert breaker.state == CircuitBreaker.OPEN
+            assert breaker.get_retry_after() == 10
+
+    def test_in_flight_failures_dont_extend_open_period(self):
+        with mock.patch("hip.util.circuit_breaker.current_time") as current_time:
+            current_time.return_value = 100
+            breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+            breaker.record_failure()
+
+            current_time.return_value = 105
+            breaker.record_failure()
+            assert breaker.get_retry_after() == 5
+
+    def test_neutral_errors_dont_close_half_open(self):
+        with mock.patch("hip.util.circuit_breaker.current_time") as current_time:
+            current_time.return_value = 100
+            breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+            breaker.record_failure()
+
+            current_time.return_value = 110
+            breaker.before_request()
+            breaker.record(error=SSLError("bad cert"))
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+
+            # The probe slot was given back.
+            breaker.before_request()
+            breaker.record(response=HTTPResponse(status=200))
+            assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_new_is_independent(self):
+        template = CircuitBreaker(failure_threshold=1, failure_statuses=[503])
+        breaker = template.new()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert template.state == CircuitBreaker.CLOSED
+        assert breaker.failure_statuses == frozenset([503])
+
+    def test_reset(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure()
+        breaker.reset()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.parametrize(
+        "error, is_failure",
+        [
+            (ConnectTimeoutError(), True),
+            (NewConnectionError(None, "refused"), True),
+            (ProtocolError("reset"), True),
+            (MaxRetryError(None, "/", ConnectTimeoutError()), True),
+            (SSLError("bad cert"), False),
+            (ValueError(), False),
+        ],
+    )
+    def test_is_failure_error(self, error, is_failure):
+        assert CircuitBreaker().is_failure(error=error) is is_failure
+
+    def test_is_failure_status(self):
+        breaker = CircuitBreaker(failure_statuses=[503])
+        assert breaker.is_failure(response=HTTPResponse(status=503))
+        assert not breaker.is_failure(response=HTTPResponse(status=500))
+
+
+class TestPoolManagerCircuitBreaker(object):
+    def test_disabled_by_default(self):
+        p = PoolManager()
+        assert p.circuit_breaker_for("http://example.com/") is None
+
+    def test_keyed_by_pool_key(self):
+        p = PoolManager(circuit_breaker=CircuitBreaker())
+        a = p.circuit_breaker_for("http://example.com/foo")
+        b = p.circuit_breaker_for("http://EXAMPLE.com:80/bar")
+        c = p.circuit_breaker_for("https://example.com/")
+        assert a is b
+        assert a is not c
+
+    def test_fails_fast_when_open(self):
+        p = PoolManager(circuit_breaker=CircuitBreaker(failure_threshold=1))
+        p.circuit_breaker_for("http://example.com/").record_failure()
+
+        with pytest.raises(CircuitOpenError) as e:
+            p.urlopen("GET", "http://example.com/")
+
+        assert e.value.url == "http://example.com/"
+        assert len(p.pools) == 0
+
+    def test_records_failures(self):
+        p = PoolManager(circuit_breaker=CircuitBreaker(failure_threshold=2))
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.side_effect = NewConnectionError(pool, "refused")
+
+            for _ in range(2):
+                with pytest.raises(NewConnectionError):
+                    p.urlopen("GET", "http://example.com/")
+
+            with pytest.raises(CircuitOpenError):
+                p.urlopen("GET", "http://example.com/")
+
+        assert pool.urlopen.call_count == 2
+        breaker = p.circuit_breaker_for("http://example.com/")
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_cancelled_probe_gives_back_its_slot(self):
+        p = PoolManager(
+            circuit_breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+        )
+        breaker = p.circuit_breaker_for("http://example.com/")
+        with mock.patch("hip.util.circuit_breaker.current_time") as current_time:
+            current_time.return_value = 100
+            breaker.record_failure()
+            current_time.return_value = 110
+
+            with mock.patch.object(p, "connection_from_host") as connection_from_host:
+                pool = connection_from_host.return_value
+                pool.urlopen.side_effect = KeyboardInterrupt()
+                with pytest.raises(KeyboardInterrupt):
+                    p.urlopen("GET", "http://example.com/")
+
+                pool.urlopen.side_effect = None
+                pool.urlopen.return_value = HTTPResponse(status=200)
+                p.urlopen("GET", "http://example.com/")
+
+            assert breaker.state == CircuitBreaker.CLOSED
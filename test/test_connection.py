@@ -1,11 +1,18 @@
 import datetime
+import socket
+
 import mock
 
 import h11
 import pytest
 
 from hip.base import Request
-from hip.connection import _request_bytes_iterable, RECENT_DATE
+from hip.connection import (
+    _byte_view,
+    _expect_continue,
+    _request_bytes_iterable,
+    RECENT_DATE,
+)
 from hip.util.ssl_ import CertificateError, match_hostname
 
 
@@ -74,6 +81,50 @@ class TestConnection(object):
         with pytest.raises(StopIteration):
             next(iterable)
 
+    def test_request_bytes_iterable_buffer(self):
+        # Buffer bodies are sent as views of their memory, not copies.
+        body = bytearray(b"x" * 100000)
+        request = Request(
+            method=b"POST",
+            target="post",
+            body=body,
+            headers={"Content-Length": len(body)},
+        )
+        request.add_host("httpbin.org", port=80, scheme="http")
+        state_machine = h11.Connection(our_role=h11.CLIENT)
+        pieces = list(_request_bytes_iterable(request, state_machine))
+        assert pieces[0].endswith(b"x" * 65536)
+        assert len(pieces) == 2
+        assert isinstance(pieces[1], memoryview)
+        assert pieces[1].obj is body
+        assert pieces[1] == b"x" * (100000 - 65536)
+
+    def test_byte_view_without_cast(self):
+        # Python 2's memoryview can't be cast, so the view is used as it is.
+        class View(object):
+            def __init__(self, obj):
+                self.obj = obj
+
+        body = bytearray(b"foo")
+        with mock.patch("hip.connection.memoryview", View, create=True):
+            assert _byte_view(body).obj is body
+
+    def test_expect_continue_bounds_reads_by_wait(self):
+        # Readable, but with nothing for h11 (like a TLS 1.3 session ticket):
+        # reading must not outlast the wait.
+        request = Request(method=b"PUT", target="/", body=b"hello")
+        request.add_host("httpbin.org", port=80, scheme="http")
+        request.headers["Expect"] = "100-continue"
+        request.headers["Content-Length"] = "5"
+        sock = mock.Mock()
+        sock.wait_readable.return_value = True
+        sock.receive_some.side_effect = socket.timeout()
+
+        state_machine = h11.Connection(our_role=h11.CLIENT)
+        assert _expect_continue(request, state_machine, sock, 30, 1) is None
+        timeout = sock.receive_some.call_args[0][0]
+        assert 0 <= timeout <= 1
+
     def test_request_default_port_handling(self):
         # Verify that the port is only included in the Host header when it
         # is necessary.  In other words, when the specified port does not
@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 
+import inspect
 import ssl
+import mock
 import pytest
 
 from hip.base import Response
@@ -11,10 +13,14 @@ from hip.connectionpool import (
 )
 from hip.connection import HTTP1Connection
 from hip.response import HTTPResponse
+from hip.util.drain import DrainBudget
+from hip.util.limits import BodyLimits
+from hip.util.retry import Retry
 from hip.util.timeout import Timeout
 from hip.packages.six.moves.queue import Empty
 from hip.packages.ssl_match_hostname import CertificateError
 from hip.exceptions import (
+    BodyTooLargeError,
     ClosedPoolError,
     EmptyPoolError,
     LocationValueError,
@@ -470,6 +476,65 @@ class TestConnectionPool(object):
         _test(SocketError)
         _test(ProtocolError)
 
+    def test_retries_do_not_recurse(self):
+        depths = []
+
+        def fail(*args, **kwargs):
+            depths.append(len(inspect.stack(0)))
+            raise SocketError()
+
+        with HTTPConnectionPool(host="localhost", maxsize=1) as pool:
+            pool._make_request = fail
+            with pytest.raises(MaxRetryError):
+                pool.urlopen("GET", "/", retries=50)
+
+        assert len(depths) == 51
+        assert len(set(depths)) == 1
+
+    def test_status_retry_uses_drain_budget(self):
+        budget = DrainBudget(max_bytes=10)
+
+        def make_request(conn, *args, **kwargs):
+            return Response(
+                status_code=503,
+                headers={"content-length": "100"},
+                body=BytesIO(b"x" * 100),
+                version=b"HTTP/1.1",
+            )
+
+        retries = Retry(total=1, status_forcelist=[503], raise_on_status=False)
+        with HTTPConnectionPool(host="localhost", drain_budget=budget) as pool:
+            pool._make_request = make_request
+            with mock.patch.object(
+                HTTPResponse, "drain_conn", autospec=True
+            ) as drain_conn:
+                response = pool.urlopen(
+                    "GET", "/", retries=retries, preload_content=False
+                )
+
+        assert response.status == 503
+        drain_conn.assert_called_once_with(mock.ANY, budget)
+
+    def test_body_limits(self):
+        def make_request(conn, *args, **kwargs):
+            body = BytesIO(b"x" * 100)
+            body.complete = False
+            return Response(
+                status_code=200,
+                headers={"content-length": "100"},
+                body=body,
+                version=b"HTTP/1.1",
+            )
+
+        limits = BodyLimits(max_encoded_bytes=10)
+        with HTTPConnectionPool(host="localhost", body_limits=limits) as pool:
+            pool._make_request = make_request
+            with pytest.raises(BodyTooLargeError):
+                pool.request("GET", "/")
+
+            response = pool.request("GET", "/", body_limits=BodyLimits())
+            assert response.data == b"x" * 100
+
     def test_custom_http_response_class(self):
         class CustomHTTPResponse(HTTPResponse):
             pass
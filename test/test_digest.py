@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import zlib
+from io import BytesIO
+
+import pytest
+
+from hip._collections import HTTPHeaderDict
+from hip.exceptions import DigestMismatchError
+from hip.response import HTTPResponse
+from hip.util.digest import BodyDigest, digests_from_headers
+
+DATA = b"foo" * 1000
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def b64(algorithm, data=DATA):
+    return base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+
+
+class TestBodyDigest(object):
+    @pytest.mark.parametrize(
+        "expected", [None, SHA256, SHA256.upper(), hashlib.sha256(DATA).digest()],
+    )
+    def test_check(self, expected):
+        digest = BodyDigest("sha256", expected=expected)
+        digest.update(DATA)
+        assert digest.hexdigest() == SHA256
+        digest.check()
+
+    def test_mismatch(self):
+        digest = BodyDigest("md5", expected=SHA256)
+        digest.update(DATA)
+        with pytest.raises(DigestMismatchError):
+            digest.check()
+
+    def test_new(self):
+        digest = BodyDigest("sha256", expected=SHA256, raw=True)
+        digest.update(DATA)
+        new = digest.new()
+        assert (new.algorithm, new.expected, new.raw) == ("sha256", SHA256, True)
+        assert new.hexdigest() == hashlib.sha256().hexdigest()
+
+    def test_from_headers(self):
+        headers = HTTPHeaderDict(
+            [
+                ("Repr-Digest", "sha-256=:%s:, unknown=:AAAA:" % b64("sha256")),
+                ("Digest", "SHA-512=%s,MD5=%s" % (b64("sha512"), b64("md5"))),
+                ("Digest", "UNIXsum=30637"),
+                ("Content-MD5", b64("md5")),
+                ("Content-MD5", "not a digest"),
+            ]
+        )
+        digests = digests_from_headers(headers)
+        assert [d.algorithm for d in digests] == ["sha256", "sha512", "md5", "md5"]
+        for digest in digests:
+            assert digest.raw
+            digest.update(DATA)
+            digest.check()
+
+
+class TestResponseDigests(object):
+    def test_digests_of_decoded_and_raw_body(self):
+        body = zlib.compress(DATA)
+        r = HTTPResponse(
+            BytesIO(body),
+            headers={"content-encoding": "deflate"},
+            digests=[BodyDigest("sha256", expected=SHA256)],
+        )
+        raw = r.add_digest("md5", raw=True)
+        assert r.read() == DATA
+        assert r.digests[0].hexdigest() == SHA256
+        assert raw.hexdigest() == hashlib.md5(body).hexdigest()
+
+    def test_content_digest_of_undecoded_body(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(DATA) + compressor.flush()
+        r = HTTPResponse(
+            BytesIO(body),
+            headers={"content-encoding": "gzip"},
+            digests=[BodyDigest("sha256", expected=SHA256)],
+        )
+        assert r.read(decode_content=False) == body
+        assert r.digests[0].hexdigest() == SHA256
+
+    def test_digests_are_copied(self):
+        digest = BodyDigest("sha256")
+        r = HTTPResponse(BytesIO(DATA), digests=[digest])
+        r.read()
+        assert r.digests[0] is not digest
+        assert digest.hexdigest() == hashlib.sha256().hexdigest()
+
+    def test_mismatch_at_end_of_body(self):
+        r = HTTPResponse(BytesIO(DATA))
+        r.add_digest("sha256", expected=hashlib.sha256(b"bar").hexdigest())
+        chunks = r.stream()
+        next(chunks)
+        with pytest.raises(DigestMismatchError):
+            list(chunks)
+
+    def test_digest_headers_not_checked_for_ranges(self):
+        r = HTTPResponse(
+            BytesIO(DATA[:3]),
+            status=206,
+            headers={"Repr-Digest": "sha-256=:%s:" % b64("sha256")},
+            check_digest_headers=True,
+        )
+        assert r.read() == DATA[:3]
+        assert r.digests == []
+
+    @pytest.mark.parametrize("body, ok", [(DATA, True), (b"bar", False)])
+    def test_check_digest_headers(self, body, ok):
+        r = HTTPResponse(
+            BytesIO(body),
+            status=200,
+            headers={"Content-MD5": b64("md5")},
+            check_digest_headers=True,
+        )
+        if ok:
+            assert r.read() == body
+        else:
+            with pytest.raises(DigestMismatchError):
+                r.read()
@@ -1,6 +1,8 @@
+import io
+
 import pytest
 
-from hip.filepost import encode_multipart_formdata
+from hip.filepost import encode_multipart_formdata, MultipartEncoder
 from hip.fields import RequestField
 from hip.packages.six import b, u
 
@@ -113,3 +115,62 @@ class TestMultipartEncoding(object):
         )
 
         assert encoded == expected
+
+
+class TestMultipartEncoder(object):
+    def test_matches_encode_multipart_formdata(self):
+        fields = [("k", "v"), ("file", ("somefile.txt", b"contents", "text/plain"))]
+        encoded, content_type = encode_multipart_formdata(fields, boundary=BOUNDARY)
+        encoder = MultipartEncoder(fields, boundary=BOUNDARY)
+
+        assert encoder.content_type == content_type
+        assert encoder.content_length == len(encoded)
+        assert b"".join(iter(lambda: encoder.read(7), b"")) == encoded
+        assert encoder.tell() == len(encoded)
+
+    def test_streams_files(self, tmpdir):
+        path = tmpdir.join("upload.bin")
+        path.write_binary(b"x" * 100000)
+        with open(str(path), "rb") as fp:
+            fields = [("k", "v"), ("file", ("upload.bin", fp, "image/jpeg"))]
+            encoder = MultipartEncoder(fields, boundary=BOUNDARY)
+            expected = encode_multipart_formdata(
+                [("k", "v"), ("file", ("upload.bin", b"x" * 100000, "image/jpeg"))],
+                boundary=BOUNDARY,
+            )[0]
+
+            assert encoder.content_length == len(expected)
+            assert fp.tell() == 0
+            assert len(encoder.read(1000)) == 1000
+            assert fp.tell() < 1000
+            assert encoder.read(1000) == expected[1000:2000]
+            assert encoder.content_length == len(expected)
+            assert encoder.read() == expected[2000:]
+
+    def test_rewind(self):
+        fp = io.BytesIO(b"ignored" + b"contents")
+        fp.seek(7)
+        encoder = MultipartEncoder([("file", ("f.txt", fp))], boundary=BOUNDARY)
+        body = encoder.read()
+        assert body.count(b"contents") == 1
+        assert b"ignored" not in body
+
+        assert encoder.seek(0) == 0
+        assert encoder.tell() == 0
+        assert encoder.read() == body
+
+        with pytest.raises(io.UnsupportedOperation):
+            encoder.seek(5)
+
+    def test_unknown_length(self):
+        class Unsized(object):
+            def __init__(self):
+                self.fp = io.BytesIO(b"contents")
+                self.read = self.fp.read
+
+            def tell(self):
+                return self.fp.tell()
+
+        encoder = MultipartEncoder([("file", ("f.txt", Unsized()))])
+        assert encoder.content_length is None
+        assert b"contents" in encoder.read()
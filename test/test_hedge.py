@@ -0,0 +1,48 @@
+import pytest
+
+from hip.util.hedge import Hedge
+
+
+class TestHedge(object):
+    def test_fixed_delay(self):
+        hedge = Hedge(delay=0.25)
+        hedge.record_latency(5)
+        assert hedge.get_delay() == 0.25
+
+    def test_percentile_delay(self):
+        hedge = Hedge(delay=1, percentile=90, min_samples=10)
+        for latency in range(1, 10):
+            hedge.record_latency(latency / 100.0)
+        # Not enough samples yet, use the fixed delay.
+        assert hedge.get_delay() == 1
+
+        hedge.record_latency(0.1)
+        assert hedge.get_delay() == 0.09
+
+    def test_percentile_window(self):
+        hedge = Hedge(percentile=50, window_size=4, min_samples=1)
+        for latency in (10, 10, 10, 10, 1, 1, 1, 1):
+            hedge.record_latency(latency)
+        assert hedge.get_delay() == 1
+
+    @pytest.mark.parametrize("percentile", [0, 101, -5])
+    def test_invalid_percentile(self, percentile):
+        with pytest.raises(ValueError):
+            Hedge(percentile=percentile)
+
+    @pytest.mark.parametrize(
+        "method, body, hedgeable",
+        [
+            ("GET", None, True),
+            ("get", None, True),
+            ("HEAD", None, True),
+            ("POST", None, False),
+            ("GET", b"payload", True),
+            ("GET", iter([b"payload"]), False),
+        ],
+    )
+    def test_is_hedgeable(self, method, body, hedgeable):
+        assert Hedge().is_hedgeable(method, body) is hedgeable
+
+    def test_max_hedges_zero_disables(self):
+        assert not Hedge(max_hedges=0).is_hedgeable("GET")
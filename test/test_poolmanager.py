@@ -1,11 +1,14 @@
+import inspect
 import socket
 
+import mock
 import pytest
 
 from hip.poolmanager import PoolManager
 from hip.poolmanager import key_fn_by_scheme, PoolKey
 from hip import connection_from_url
 from hip.exceptions import ClosedPoolError, LocationValueError
+from hip.response import HTTPResponse
 from hip.util import retry, timeout, ssl_
 
 from dummyserver.server import CERTS_PATH, DEFAULT_CA, DEFAULT_CERTS
@@ -365,3 +368,21 @@ class TestPoolManager(object):
         p = PoolManager(strict=True)
         merged = p._merge_pool_kwargs({"invalid_key": None})
         assert p.connection_pool_kw == merged
+
+    def test_redirects_do_not_recurse(self):
+        depths = []
+
+        def urlopen(method, url, **kw):
+            depths.append(len(inspect.stack(0)))
+            if len(depths) > 30:
+                return HTTPResponse(status=200)
+            return HTTPResponse(status=302, headers={"Location": "/%d" % len(depths)})
+
+        p = PoolManager()
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            connection_from_host.return_value.urlopen.side_effect = urlopen
+            r = p.request("GET", "http://example.com/", retries=retry.Retry(31))
+
+        assert r.status == 200
+        assert len(depths) == 31
+        assert len(set(depths)) == 1
@@ -0,0 +1,103 @@
+import errno
+import os
+
+import mock
+import pytest
+
+from hip._collections import HTTPHeaderDict
+from hip.exceptions import ProtocolError, ResourceChangedError
+from hip.response import HTTPResponse
+from hip.util.ranges import (
+    check_range,
+    if_range_validator,
+    parse_content_range,
+    preallocate,
+    split_ranges,
+    write_at,
+)
+
+
+class TestRanges(object):
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("bytes 0-0/100", (0, 0, 100)),
+            ("Bytes 10-19/*", (10, 19, None)),
+            ("bytes */100", None),
+            ("items 0-1/2", None),
+            (None, None),
+        ],
+    )
+    def test_parse_content_range(self, value, expected):
+        assert parse_content_range(value) == expected
+
+    @pytest.mark.parametrize(
+        "headers, expected",
+        [
+            ({"ETag": '"a"', "Last-Modified": "then"}, '"a"'),
+            ({"ETag": 'W/"a"', "Last-Modified": "then"}, "then"),
+            ({"ETag": 'W/"a"'}, None),
+            ({}, None),
+        ],
+    )
+    def test_if_range_validator(self, headers, expected):
+        assert if_range_validator(HTTPHeaderDict(headers)) == expected
+
+    def test_check_range(self):
+        r = HTTPResponse(status=206, headers={"Content-Range": "bytes 5-9/10"})
+        assert check_range(r, 5, 10) == (5, 9, 10)
+        assert check_range(r, 5, 10, last=9) == (5, 9, 10)
+        with pytest.raises(ProtocolError):
+            check_range(r, 0)
+        with pytest.raises(ProtocolError):
+            check_range(r, 5, 10, last=8)
+        with pytest.raises(ProtocolError):
+            check_range(r, 5, 11)
+        with pytest.raises(ResourceChangedError):
+            check_range(HTTPResponse(status=200), 5)
+        with pytest.raises(ProtocolError):
+            check_range(HTTPResponse(status=416), 5)
+
+    @pytest.mark.parametrize(
+        "length, parts, expected",
+        [
+            (10, 3, [(0, 3), (4, 6), (7, 9)]),
+            (2, 4, [(0, 0), (1, 1)]),
+            (5, 1, [(0, 4)]),
+            (0, 4, []),
+        ],
+    )
+    def test_split_ranges(self, length, parts, expected):
+        assert split_ranges(length, parts) == expected
+
+    def test_write_into_preallocated_file(self, tmpdir):
+        path = str(tmpdir.join("file"))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            preallocate(fd, 6)
+            write_at(fd, b"def", 3)
+            write_at(fd, bytearray(b"abc"), 0)
+            assert os.fstat(fd).st_size == 6
+        finally:
+            os.close(fd)
+        with open(path, "rb") as f:
+            assert f.read() == b"abcdef"
+
+    @pytest.mark.parametrize(
+        "error, raised", [(errno.EINVAL, False), (errno.ENOSPC, True)]
+    )
+    def test_preallocate_errors(self, tmpdir, error, raised):
+        path = str(tmpdir.join("file"))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            with mock.patch.object(
+                os, "posix_fallocate", side_effect=OSError(error, "failed"), create=True
+            ):
+                if raised:
+                    with pytest.raises(OSError):
+                        preallocate(fd, 6)
+                else:
+                    preallocate(fd, 6)
+                    assert os.fstat(fd).st_size == 6
+        finally:
+            os.close(fd)
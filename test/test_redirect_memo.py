@@ -0,0 +1,174 @@
+import mock
+import pytest
+
+from hip.exceptions import NewConnectionError
+from hip.poolmanager import PoolManager
+from hip.response import HTTPResponse
+from hip.util.redirect_memo import RedirectMemo
+from hip.util.retry import Retry
+
+
+class TestRedirectMemo(object):
+    @pytest.mark.parametrize("status", [301, 308])
+    def test_remembers_permanent_redirects(self, status):
+        memo = RedirectMemo()
+        memo.remember("http://a/", "http://b/", status)
+        assert memo.redirect_for("http://a/") == ("http://b/", status)
+        assert memo.redirect_for("http://b/") is None
+
+    @pytest.mark.parametrize("status", [302, 303, 307])
+    def test_ignores_temporary_redirects(self, status):
+        memo = RedirectMemo()
+        memo.remember("http://a/", "http://b/", status)
+        assert len(memo) == 0
+
+    def test_ttl(self):
+        with mock.patch("hip.util.redirect_memo.current_time") as current_time:
+            current_time.return_value = 100
+            memo = RedirectMemo(ttl=10)
+            memo.remember("http://a/", "http://b/", 301)
+
+            current_time.return_value = 109
+            assert memo.redirect_for("http://a/") == ("http://b/", 301)
+            current_time.return_value = 110
+            assert memo.redirect_for("http://a/") is None
+            assert len(memo) == 0
+
+    def test_bounded(self):
+        memo = RedirectMemo(maxsize=2)
+        for name in "abc":
+            memo.remember("http://%s/" % name, "http://z/", 301)
+        assert len(memo) == 2
+        assert memo.redirect_for("http://a/") is None
+
+    def test_forget_and_clear(self):
+        memo = RedirectMemo()
+        memo.remember("http://a/", "http://b/", 301)
+        memo.remember("http://c/", "http://d/", 301)
+        memo.forget("http://a/")
+        memo.forget("http://a/")
+        assert memo.redirect_for("http://a/") is None
+        memo.clear()
+        assert len(memo) == 0
+
+
+def redirect(location, status=301):
+    return HTTPResponse(status=status, headers={"Location": location})
+
+
+class TestPoolManagerRedirectMemo(object):
+    def test_skips_known_redirect(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.side_effect = [
+                redirect("/new"),
+                HTTPResponse(status=200),
+                HTTPResponse(status=200),
+            ]
+            p.request("GET", "http://example.com/old")
+            r = p.request("GET", "http://example.com/old")
+
+        assert r.status == 200
+        assert [c[0][1] for c in pool.urlopen.call_args_list] == [
+            "/old",
+            "/new",
+            "/new",
+        ]
+
+    def test_remembered_loops_stop(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember("http://example.com/a", "http://example.com/b", 301)
+        p.redirect_memo.remember("http://example.com/b", "http://example.com/a", 301)
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.return_value = HTTPResponse(status=200)
+            p.request("GET", "http://example.com/a")
+
+        assert [c[0][1] for c in pool.urlopen.call_args_list] == ["/b"]
+
+    def test_not_used_without_redirects(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember(
+            "http://example.com/old", "http://example.com/new", 301
+        )
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.return_value = redirect("/new")
+            p.request("GET", "http://example.com/old", redirect=False)
+            p.request("GET", "http://example.com/old", retries=False)
+
+        assert [c[0][1] for c in pool.urlopen.call_args_list] == ["/old", "/old"]
+
+    def test_strips_headers_across_hosts(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember("http://a.com/", "http://b.com/", 301)
+        headers = {"Authorization": "secret", "X-Foo": "bar"}
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.return_value = HTTPResponse(status=200)
+            p.request("GET", "http://a.com/", headers=headers)
+
+        assert pool.urlopen.call_args[1]["headers"] == {"X-Foo": "bar"}
+        assert "Authorization" in headers
+        assert connection_from_host.call_count == 1
+
+    def test_strips_headers_at_intermediate_hops(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember("http://a.com/", "http://b.com/", 301)
+        p.redirect_memo.remember("http://b.com/", "http://a.com/new", 301)
+        headers = {"Authorization": "secret"}
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.return_value = HTTPResponse(status=200)
+            p.request("GET", "http://a.com/", headers=headers)
+
+        assert pool.urlopen.call_args[0][1] == "/new"
+        assert pool.urlopen.call_args[1]["headers"] == {}
+
+    def test_counts_against_redirects(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember("http://a.com/", "http://a.com/b", 301)
+        p.redirect_memo.remember("http://a.com/b", "http://a.com/c", 301)
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.return_value = HTTPResponse(status=200)
+            r = p.request("GET", "http://a.com/", retries=Retry(redirect=1))
+
+        # The second redirect would have been one too many.
+        assert pool.urlopen.call_args[0][1] == "/b"
+        retries = pool.urlopen.call_args[1]["retries"]
+        assert retries.redirect == 0
+        assert [h.redirect_location for h in retries.history] == ["http://a.com/b"]
+        assert r.status == 200
+
+    @pytest.mark.parametrize(
+        "outcome", [NewConnectionError(None, "refused"), HTTPResponse(status=404)]
+    )
+    def test_forgotten_when_target_fails(self, outcome):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember("http://a.com/", "http://b.com/", 301)
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.side_effect = [outcome]
+            try:
+                p.request("GET", "http://a.com/")
+            except NewConnectionError:
+                pass
+
+        assert pool.urlopen.call_args[0][1] == "/"
+        assert connection_from_host.call_args[0][0] == "b.com"
+        assert len(p.redirect_memo) == 0
+
+    def test_whole_chain_forgotten_when_target_fails(self):
+        p = PoolManager(redirect_memo=RedirectMemo())
+        p.redirect_memo.remember("http://a.com/", "http://b.com/", 301)
+        p.redirect_memo.remember("http://b.com/", "http://c.com/", 301)
+        p.redirect_memo.remember("http://x.com/", "http://y.com/", 301)
+        with mock.patch.object(p, "connection_from_host") as connection_from_host:
+            pool = connection_from_host.return_value
+            pool.urlopen.return_value = HTTPResponse(status=404)
+            p.request("GET", "http://a.com/")
+
+        assert connection_from_host.call_args[0][0] == "c.com"
+        assert len(p.redirect_memo) == 1
@@ -1,19 +1,30 @@
 # -*- coding: utf-8 -*-
 
 import re
+import socket
 import zlib
 
 from io import BytesIO, BufferedReader, TextIOWrapper
 
+import mock
 import pytest
 import six
 
 from hip.base import Response
-from hip.response import HTTPResponse, brotli
-from hip.exceptions import DecodeError
+from hip.response import HTTPResponse, brotli, zstd
+from hip.exceptions import (
+    BodyTooLargeError,
+    DecodeError,
+    HTTPError,
+    ProtocolError,
+    ReadTimeoutError,
+)
+from hip.util.drain import DrainBudget
+from hip.util.limits import BodyLimits
 from hip.util.retry import Retry
+from hip.util.timeout import Timeout
 
-from test import onlyBrotlipy
+from test import onlyBrotlipy, onlyZstd
 
 from base64 import b64decode
 
@@ -35,6 +46,11 @@ nP4HF2uWHA=="""
 )
 
 
+def gzip_compress(data):
+    compress = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compress.compress(data) + compress.flush()
+
+
 def get_response():
     return Response(
         status_code=200, headers={}, body=BytesIO(b"hello"), version=b"HTTP/1.1"
@@ -240,6 +256,66 @@ class TestResponse(object):
             r = HTTPResponse(fp, headers={"content-encoding": "br"})
             r.preload_content()
 
+    @onlyZstd()
+    def test_decode_zstd(self):
+        data = zstd.ZstdCompressor().compress(b"foo")
+
+        fp = BytesIO(data)
+        r = HTTPResponse(fp, headers={"content-encoding": "zstd"})
+        r.preload_content()
+        assert r.data == b"foo"
+
+    @onlyZstd()
+    def test_decode_multiframe_zstd(self):
+        data = zstd.ZstdCompressor().compress(b"foo") + zstd.ZstdCompressor().compress(
+            b"bar"
+        )
+
+        fp = BytesIO(data)
+        r = HTTPResponse(fp, headers={"content-encoding": "zstd"})
+        r.preload_content()
+        assert r.data == b"foobar"
+
+    @onlyZstd()
+    def test_chunked_decoding_zstd(self):
+        data = zstd.ZstdCompressor().compress(b"foobarbaz")
+
+        fp = BytesIO(data)
+        r = HTTPResponse(fp, headers={"content-encoding": "zstd"})
+
+        ret = b""
+        for _ in range(100):
+            ret += r.read(1)
+            if r.closed:
+                break
+        assert ret == b"foobarbaz"
+
+    @onlyZstd()
+    def test_decode_zstd_error(self):
+        fp = BytesIO(b"foo")
+        with pytest.raises(DecodeError):
+            r = HTTPResponse(fp, headers={"content-encoding": "zstd"})
+            r.preload_content()
+
+    @onlyZstd()
+    def test_zstd_output_is_bounded(self):
+        data = zstd.ZstdCompressor().compress(b"x" * 10 * 1024 * 1024)
+
+        fp = BytesIO(data)
+        r = HTTPResponse(fp, headers={"content-encoding": "zstd"})
+        chunks = list(r.stream())
+        assert max(len(chunk) for chunk in chunks) <= r.DECODED_CHUNK_SIZE
+        assert b"".join(chunks) == b"x" * 10 * 1024 * 1024
+
+    @onlyZstd()
+    def test_multi_decoding_gzip_zstd(self):
+        data = gzip_compress(zstd.ZstdCompressor().compress(b"foo"))
+
+        fp = BytesIO(data)
+        r = HTTPResponse(fp, headers={"content-encoding": "zstd, gzip"})
+        r.preload_content()
+        assert r.data == b"foo"
+
     def test_multi_decoding_deflate_deflate(self):
         data = zlib.compress(zlib.compress(b"foo"))
 
@@ -275,6 +351,39 @@ class TestResponse(object):
 
         assert r.data == b"foo"
 
+    @pytest.mark.parametrize(
+        "encoding, compress",
+        [
+            ("deflate", zlib.compress),
+            ("deflate", lambda data: zlib.compress(data)[2:-4]),
+            ("gzip", lambda d: gzip_compress(d[:9]) + gzip_compress(d[9:])),
+            ("gzip, gzip", lambda data: gzip_compress(gzip_compress(data))),
+            ("deflate, gzip", lambda data: gzip_compress(zlib.compress(data))),
+        ],
+    )
+    def test_decoding_is_bounded(self, encoding, compress):
+        body = b"x" * (1024 * 1024) + b"end"
+        fp = BytesIO(compress(body))
+        r = HTTPResponse(fp, headers={"content-encoding": encoding})
+
+        assert r.read(10) == b"x" * 10
+        assert len(r._buffer) <= r.DECODED_CHUNK_SIZE
+        chunks = list(r.stream())
+        assert max(len(chunk) for chunk in chunks) <= r.DECODED_CHUNK_SIZE
+        assert len(b"".join(chunks)) == len(body) - 10 - len(r._buffer)
+        assert r._buffer + b"".join(chunks) == body[10:]
+
+    @onlyBrotlipy()
+    def test_brotli_decoding_is_bounded(self):
+        body = b"x" * (1024 * 1024)
+        r = HTTPResponse(
+            BytesIO(brotli.compress(body)), headers={"content-encoding": "br"}
+        )
+        chunks = list(r.stream())
+        assert b"".join(chunks) == body
+        if hasattr(brotli.Decompressor(), "can_accept_more_data"):
+            assert len(chunks) > 1
+
     def test_body_blob(self):
         resp = HTTPResponse(b"foo")
         resp.preload_content()
@@ -612,3 +721,217 @@ class TestResponse(object):
         retry = Retry()
         resp = HTTPResponse(fp, retries=retry)
         assert resp.retries == retry
+
+    def test_drain_conn_reuses_connection(self):
+        pool, conn = mock.Mock(drain_budget=DrainBudget()), mock.Mock()
+        resp = HTTPResponse(BytesIO(b"foo"), pool=pool, connection=conn)
+        resp.drain_conn()
+
+        pool._put_conn.assert_called_once_with(conn)
+        assert not conn.close.called
+        assert resp.connection is None
+
+    @pytest.mark.parametrize(
+        "headers, body", [({"content-length": "100"}, b"x" * 100), ({}, b"x\n" * 50)],
+    )
+    def test_drain_conn_closes_when_body_is_large(self, headers, body):
+        pool, conn = mock.Mock(), mock.Mock()
+        resp = HTTPResponse(BytesIO(body), headers=headers, pool=pool, connection=conn)
+        resp.drain_conn(DrainBudget(max_bytes=50))
+
+        assert conn.close.called
+        pool._put_conn.assert_called_once_with(conn)
+        assert resp.connection is None
+
+    def test_drain_conn_closes_when_body_is_slow(self):
+        class SlowFP(object):
+            read_timeout = 5
+            reads = []
+
+            def close(self):
+                pass
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                self.reads.append(self.read_timeout)
+                return b"x"
+
+            next = __next__
+
+        pool, conn = mock.Mock(), mock.Mock()
+        resp = HTTPResponse(SlowFP(), pool=pool, connection=conn)
+        with mock.patch("hip.response.current_time") as current_time:
+            current_time.side_effect = [0, 0.75, 1.5]
+            resp.drain_conn(DrainBudget(max_bytes=None, max_time=1))
+
+        assert SlowFP.reads == [1, 0.25]
+        assert conn.close.called
+        pool._put_conn.assert_called_once_with(conn)
+
+    @pytest.mark.parametrize(
+        "error", [HTTPError("oops"), socket.error("reset"), ProtocolError("oops")]
+    )
+    def test_drain_conn_closes_on_error(self, error):
+        class BrokenFP(object):
+            def close(self):
+                pass
+
+            def __iter__(self):
+                raise error
+
+        pool, conn = mock.Mock(), mock.Mock()
+        resp = HTTPResponse(BrokenFP(), pool=pool, connection=conn)
+        resp.drain_conn(DrainBudget(max_bytes=None))
+
+        assert conn.close.called
+        pool._put_conn.assert_called_once_with(conn)
+
+    def test_low_speed_limit(self):
+        class DripFP(BytesIO):
+            read_timeout = 5
+
+            def __iter__(self):
+                return iter(lambda: self.read(1), b"")
+
+        resp = HTTPResponse(
+            DripFP(b"x" * 10), timeout=Timeout(low_speed_limit=2, low_speed_time=3),
+        )
+        with mock.patch("hip.response.current_time") as current_time:
+            # One byte per second, with a long pause by the caller.
+            current_time.side_effect = [0, 1, 100, 101, 101, 103]
+            assert resp.read(1) == b"x"
+            assert resp.read(1) == b"x"
+            assert resp._fp.read_timeout == 3
+            with pytest.raises(ReadTimeoutError):
+                resp.read(1)
+
+        assert resp.closed
+
+    def test_thread_decode_threshold(self):
+        class FP(BytesIO):
+            _backend = mock.Mock()
+
+            def __iter__(self):
+                return iter([data[:10], data[10:]])
+
+        FP._backend.run_sync_in_worker_thread.side_effect = lambda fn, *a: fn(*a)
+        data = gzip_compress(b"foo" * 10000)
+        r = HTTPResponse(
+            FP(), headers={"content-encoding": "gzip"}, thread_decode_threshold=20,
+        )
+
+        assert r.read() == b"foo" * 10000
+        calls = FP._backend.run_sync_in_worker_thread.call_args_list
+        assert [c[0][1] for c in calls] == [data[10:]]
+
+    def test_body_limits_encoded(self):
+        fp = BytesIO(b"x\n" * 50)
+        resp = HTTPResponse(fp, body_limits=BodyLimits(max_encoded_bytes=50))
+        with pytest.raises(BodyTooLargeError):
+            resp.read()
+        assert resp.closed
+
+        fp = BytesIO(b"x" * 100)
+        resp = HTTPResponse(
+            fp,
+            headers={"content-length": "100"},
+            body_limits=BodyLimits(max_encoded_bytes=50),
+        )
+        with pytest.raises(BodyTooLargeError):
+            resp.read()
+        assert resp.tell() == 0
+
+    @pytest.mark.parametrize(
+        "limits", [BodyLimits(max_decoded_bytes=500 * 1024), BodyLimits(max_ratio=100)],
+    )
+    def test_body_limits_decoded(self, limits):
+        data = gzip_compress(b"\0" * (1024 * 1024))
+        headers = {"content-encoding": "gzip"}
+
+        resp = HTTPResponse(BytesIO(data), headers=headers, body_limits=limits)
+        with pytest.raises(BodyTooLargeError):
+            resp.read()
+        assert resp._decoded_bytes_read <= 600 * 1024
+
+        resp = HTTPResponse(BytesIO(data), headers=headers, body_limits=limits)
+        assert resp.read(decode_content=False) == data
+
+        resp = HTTPResponse(
+            BytesIO(data), headers=headers, body_limits=BodyLimits(max_ratio=2000)
+        )
+        assert len(resp.read()) == 1024 * 1024
+
+    def test_drain_conn_respects_body_limits(self):
+        pool, conn = mock.Mock(), mock.Mock()
+        resp = HTTPResponse(
+            BytesIO(b"x\n" * 50),
+            pool=pool,
+            connection=conn,
+            body_limits=BodyLimits(max_encoded_bytes=50),
+        )
+        resp.drain_conn(DrainBudget(max_bytes=None))
+
+        assert conn.close.called
+        pool._put_conn.assert_called_once_with(conn)
+
+    def test_drain_budget(self):
+        budget = DrainBudget(max_bytes=10, max_time=1)
+        assert budget.allows(10, 0.5)
+        assert not budget.allows(11, 0.5)
+        assert not budget.allows(10, 1)
+        assert DrainBudget(max_bytes=None, max_time=None).allows(10 ** 9, 10 ** 9)
+
+    def test_save_to_path(self, tmpdir):
+        data = b"x" * 100 + b"y" * 100
+        fp = BytesIO(data)
+        resp = HTTPResponse(fp, headers={"content-length": str(len(data))})
+        resp.SAVE_BUFFER_SIZE = 64
+        path = str(tmpdir.join("file"))
+        with mock.patch("hip.response.preallocate") as preallocate:
+            assert resp.save_to(path) == len(data)
+        assert preallocate.call_args[0][1] == len(data)
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+    def test_save_to_path_removed_on_error(self, tmpdir):
+        class BrokenFP(BytesIO):
+            def __iter__(self):
+                yield b"x" * 100
+                raise socket.error("broken")
+
+        resp = HTTPResponse(BrokenFP(), headers={"content-length": "200"})
+        path = tmpdir.join("file")
+        with pytest.raises(ProtocolError):
+            resp.save_to(str(path))
+        assert not path.exists()
+
+    def test_save_to_path_removed_if_preallocating_fails(self, tmpdir):
+        resp = HTTPResponse(BytesIO(b"foo"), headers={"content-length": "3"})
+        path = tmpdir.join("file")
+        with mock.patch("hip.response.preallocate", side_effect=OSError("full")):
+            with pytest.raises(OSError):
+                resp.save_to(str(path))
+        assert not path.exists()
+
+    def test_save_to_fd(self, tmpdir):
+        data = zlib.compress(b"foo" * 1000)
+        fp = BytesIO(data)
+        resp = HTTPResponse(fp, headers={"content-encoding": "deflate"})
+        assert resp.read(3) == b"foo"
+        path = str(tmpdir.join("file"))
+        with open(path, "wb") as f:
+            f.write(b"bar")
+            f.flush()
+            assert resp.save_to(f.fileno(), fsync=True) == 2997
+        with open(path, "rb") as f:
+            assert f.read() == b"bar" + b"foo" * 999
+
+    def test_save_to_preloaded(self, tmpdir):
+        resp = HTTPResponse(BytesIO(b"foo"))
+        resp.preload_content()
+        path = str(tmpdir.join("file"))
+        assert resp.save_to(path) == 3
+        with open(path, "rb") as f:
+            assert f.read() == b"foo"
@@ -341,3 +341,16 @@ class TestRetry(object):
                 sleep_mock.assert_called_with(sleep_duration)
             else:
                 sleep_mock.assert_not_called()
+
+    @pytest.mark.parametrize("retry_after", [None, "20"])
+    def test_sleep_stops_at_deadline(self, retry_after):
+        retry = Retry(backoff_factor=10).increment(method="GET").increment(method="GET")
+        headers = {"Retry-After": retry_after} if retry_after else {}
+        response = HTTPResponse(status=503, headers=headers)
+        deadline = mock.Mock()
+        deadline.clamp.return_value = 0.5
+
+        with mock.patch("time.sleep") as sleep_mock:
+            retry.sleep(response, deadline=deadline)
+
+        sleep_mock.assert_called_once_with(0.5)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from hip._backends.sync_backend import SyncBackend
+from hip.util.single_flight import SingleFlight
+
+
+class CountingEvent(object):
+    waiters = 0
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def set(self):
+        self._event.set()
+
+    def wait(self):
+        CountingEvent.waiters += 1
+        self._event.wait()
+
+
+class CountingBackend(SyncBackend):
+    def create_event(self):
+        return CountingEvent()
+
+
+class TestSingleFlight(object):
+    def test_key_ignores_listed_headers(self):
+        sf = SingleFlight(ignore_headers=["User-Agent"])
+        a = sf.key_for("get", "http://example.com/", {"User-Agent": "a"})
+        b = sf.key_for("GET", "http://example.com/", {"user-agent": "b"})
+        assert a == b
+
+    @pytest.mark.parametrize("header", ["Authorization", "X-Api-Key"])
+    def test_key_includes_other_headers(self, header):
+        sf = SingleFlight()
+        a = sf.key_for("GET", "http://example.com/", {header: "a"})
+        b = sf.key_for("GET", "http://example.com/", {header.lower(): "b"})
+        assert a != b
+
+    def test_key_includes_request_options(self):
+        sf = SingleFlight()
+        url = "http://example.com/"
+        assert sf.key_for("GET", url, retries=3, redirect=True) == sf.key_for(
+            "GET", url, redirect=True, retries=3
+        )
+        assert sf.key_for("GET", url, redirect=True) != sf.key_for(
+            "GET", url, redirect=False
+        )
+        assert sf.key_for("GET", url, decode_content=False) != sf.key_for("GET", url)
+        # Unhashable options are compared by their repr.
+        assert sf.key_for("GET", url, timeout=[1]) != sf.key_for(
+            "GET", url, timeout=[2]
+        )
+
+    def test_streamed_requests_not_coalesced(self):
+        key = SingleFlight().key_for(
+            "GET", "http://example.com/", preload_content=False
+        )
+        assert key is None
+
+    @pytest.mark.parametrize(
+        "method, body, coalesced",
+        [
+            ("GET", None, True),
+            ("HEAD", None, True),
+            ("POST", None, False),
+            ("GET", b"", False),
+        ],
+    )
+    def test_key_eligibility(self, method, body, coalesced):
+        key = SingleFlight().key_for(method, "http://example.com/", body=body)
+        assert (key is not None) is coalesced
+
+    def test_concurrent_calls_share_result(self):
+        CountingEvent.waiters = 0
+        sf = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        def caller():
+            results.append(sf.do("key", fn, CountingBackend()))
+
+        leader = threading.Thread(target=caller)
+        leader.start()
+        started.wait(5)
+
+        followers = [threading.Thread(target=caller) for _ in range(3)]
+        for t in followers:
+            t.start()
+        while CountingEvent.waiters < len(followers):
+            time.sleep(0.01)
+        release.set()
+        for t in [leader] + followers:
+            t.join(5)
+
+        assert results == ["result"] * 4
+        assert calls == [1]
+        assert sf.in_flight == 0
+
+    def test_error_is_shared(self):
+        sf = SingleFlight()
+
+        def fn():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            sf.do("key", fn, SyncBackend())
+        assert sf.in_flight == 0
@@ -1,19 +1,30 @@
 # coding: utf-8
+import array
 import hashlib
 import warnings
 import logging
 import io
+import os
 import ssl
 import socket
+import zlib
 from itertools import chain
 
 from mock import patch, Mock
 import pytest
 
 from hip import add_stderr_logger, disable_warnings
-from hip.util.request import make_headers, rewind_body, _FAILEDTELL
+from hip.util.request import (
+    body_length,
+    CompressedBody,
+    brotli,
+    make_headers,
+    rewind_body,
+    zstd,
+    _FAILEDTELL,
+)
 from hip.util.retry import Retry
-from hip.util.timeout import Timeout
+from hip.util.timeout import Deadline, Timeout
 from hip.util.url import parse_url, Url
 from hip.util.ssl_ import (
     resolve_cert_reqs,
@@ -22,6 +33,7 @@ from hip.util.ssl_ import (
     _const_compare_digest_backport,
 )
 from hip.exceptions import (
+    DeadlineExceededError,
     LocationParseError,
     TimeoutStateError,
     InsecureRequestWarning,
@@ -35,7 +47,7 @@ from hip.packages import six
 
 from . import clear_warnings
 
-from test import onlyPy3, onlyPy2, onlyBrotlipy, notBrotlipy
+from test import onlyPy3, onlyPy2, onlyBrotlipy, notBrotlipy, onlyZstd, notZstd
 
 # This number represents a time in seconds, it doesn't mean anything in
 # isolation. Setting to a high-ish value to avoid conflicts with the smaller
@@ -537,24 +549,34 @@ class TestUtil(object):
             pytest.param(
                 {"accept_encoding": True},
                 {"accept-encoding": "gzip,deflate,br"},
-                marks=onlyBrotlipy(),
+                marks=[onlyBrotlipy(), notZstd()],
             ),
             pytest.param(
                 {"accept_encoding": True},
                 {"accept-encoding": "gzip,deflate"},
-                marks=notBrotlipy(),
+                marks=[notBrotlipy(), notZstd()],
+            ),
+            pytest.param(
+                {"accept_encoding": True},
+                {"accept-encoding": "gzip,deflate,br,zstd"},
+                marks=[onlyBrotlipy(), onlyZstd()],
+            ),
+            pytest.param(
+                {"accept_encoding": True},
+                {"accept-encoding": "gzip,deflate,zstd"},
+                marks=[notBrotlipy(), onlyZstd()],
             ),
             ({"accept_encoding": "foo,bar"}, {"accept-encoding": "foo,bar"}),
             ({"accept_encoding": ["foo", "bar"]}, {"accept-encoding": "foo,bar"}),
             pytest.param(
                 {"accept_encoding": True, "user_agent": "banana"},
                 {"accept-encoding": "gzip,deflate,br", "user-agent": "banana"},
-                marks=onlyBrotlipy(),
+                marks=[onlyBrotlipy(), notZstd()],
             ),
             pytest.param(
                 {"accept_encoding": True, "user_agent": "banana"},
                 {"accept-encoding": "gzip,deflate", "user-agent": "banana"},
-                marks=notBrotlipy(),
+                marks=[notBrotlipy(), notZstd()],
             ),
             ({"user_agent": "banana"}, {"user-agent": "banana"}),
             ({"keep_alive": True}, {"connection": "keep-alive"}),
@@ -607,6 +629,86 @@ class TestUtil(object):
         with pytest.raises(UnrewindableBodyError):
             rewind_body(BadSeek(), body_pos=2)
 
+    @pytest.mark.parametrize(
+        "encoding, decompress",
+        [
+            ("gzip", lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS)),
+            ("deflate", zlib.decompress),
+            pytest.param(
+                "br", lambda data: brotli.decompress(data), marks=onlyBrotlipy()
+            ),
+            pytest.param(
+                "zstd",
+                lambda data: zstd.ZstdDecompressor().decompressobj().decompress(data),
+                marks=onlyZstd(),
+            ),
+        ],
+    )
+    def test_compressed_body(self, encoding, decompress):
+        body = CompressedBody(b"foo", encoding, level=1)
+        compressor = body.compressor()
+        data = compressor.compress(b"foo" * 100) + compressor.flush()
+        assert decompress(data) == b"foo" * 100
+
+    def test_compressed_body_headers_and_rewind(self):
+        with pytest.raises(ValueError):
+            CompressedBody(b"foo", "compress")
+
+        body = CompressedBody(io.BytesIO(b"foo"))
+        headers = {"content-length": "3", "X-Foo": "bar"}
+        assert body.prepare_headers(headers) == {
+            "X-Foo": "bar",
+            "Content-Encoding": "gzip",
+        }
+        assert headers == {"content-length": "3", "X-Foo": "bar"}
+
+        body.body.read()
+        rewind_body(body, 1)
+        assert body.body.read() == b"oo"
+        with pytest.raises(AttributeError):
+            CompressedBody(b"foo").tell
+
+    @pytest.mark.parametrize(
+        "body, length",
+        [
+            (b"foo", 3),
+            (bytearray(b"foo"), 3),
+            (memoryview(b"foo"), 3),
+            (memoryview(array.array("i", [1, 2])), 8),
+            ([b"foo", b"bar"], None),
+            (iter([b"foo"]), None),
+            (io.BytesIO(b"foo"), None),
+            (CompressedBody(b"foo"), None),
+        ],
+    )
+    def test_body_length(self, body, length):
+        assert body_length(body) == length
+
+    def test_body_length_without_nbytes(self):
+        # Python 2's memoryview has no nbytes.
+        class View(object):
+            def __init__(self, obj):
+                self._view = memoryview(obj)
+
+            def tobytes(self):
+                return self._view.tobytes()
+
+        with patch("hip.util.request.memoryview", View, create=True):
+            assert body_length(array.array("i", [1, 2])) == 8
+
+    def test_body_length_of_file(self, tmpdir):
+        path = tmpdir.join("body")
+        path.write_binary(b"helloworld")
+        with open(str(path), "rb") as fp:
+            assert body_length(fp) == 10
+            fp.seek(5)
+            assert body_length(fp) == 5
+
+        read_fd, write_fd = os.pipe()
+        with io.open(read_fd, "rb") as fp:
+            os.close(write_fd)
+            assert body_length(fp) is None
+
     def test_add_stderr_logger(self):
         handler = add_stderr_logger(level=logging.INFO)  # Don't actually print debug
         logger = logging.getLogger("hip")
@@ -641,6 +743,9 @@ class TestUtil(object):
             ({"read": True}, "cannot be a boolean"),
             ({"connect": 0}, "less than or equal"),
             ({"read": "foo"}, "int, float or None"),
+            ({"low_speed_limit": 0, "low_speed_time": 1}, "less than"),
+            ({"low_speed_limit": 100}, "set together"),
+            ({"low_speed_time": 10}, "set together"),
         ],
     )
     def test_invalid_timeouts(self, kwargs, message):
@@ -712,6 +817,51 @@ class TestUtil(object):
         current_time.return_value = TIMEOUT_EPOCH + 37
         assert timeout.get_connect_duration() == 37
 
+    def test_low_speed_window(self):
+        assert Timeout().low_speed_window() is None
+        timeout = Timeout(low_speed_limit=10, low_speed_time=5).clone()
+        window = timeout.low_speed_window()
+        assert (window.min_bytes, window.period) == (50, 5)
+
+        # Too little data is fine until a whole window has gone by.
+        assert window.update(1, 4)
+        assert not window.update(1, 1)
+
+        window = timeout.low_speed_window()
+        assert window.update(60, 1)
+        assert window.update(0, 3)
+        # The first 60 bytes are now out of the window.
+        assert not window.update(20, 2)
+        assert window.update(30, 1)
+
+    @patch("hip.util.timeout.current_time")
+    def test_deadline(self, current_time):
+        current_time.return_value = TIMEOUT_EPOCH
+        deadline = Deadline.from_float(10)
+        assert Deadline.from_float(deadline) is deadline
+        assert Deadline.from_float(None) is None
+
+        current_time.return_value = TIMEOUT_EPOCH + 4
+        assert deadline.remaining() == 6
+        assert deadline.clamp(2) == 2
+        assert deadline.clamp(8) == 6
+        assert deadline.clamp(None) == 6
+        assert deadline.clamp(Timeout.DEFAULT_TIMEOUT) == 6
+        assert deadline.clamp_timeout(Timeout(total=20)).total == 6
+        timeout = deadline.clamp_timeout(Timeout(connect=1, read=2, total=3))
+        assert str(timeout) == "Timeout(connect=1, read=2, total=3)"
+        timeout = deadline.clamp_timeout(Timeout(low_speed_limit=10, low_speed_time=5))
+        assert (timeout.low_speed_limit, timeout.low_speed_time) == (10, 5)
+        deadline.check()
+
+        current_time.return_value = TIMEOUT_EPOCH + 11
+        assert deadline.expired
+        assert deadline.remaining() == 0
+        with pytest.raises(DeadlineExceededError):
+            deadline.check()
+        with pytest.raises(DeadlineExceededError):
+            deadline.clamp_timeout(Timeout(total=3))
+
     @pytest.mark.parametrize(
         "candidate, requirements",
         [
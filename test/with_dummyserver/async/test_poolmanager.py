@@ -2,9 +2,11 @@ import io
 import json
 import pytest
 import time
+import zlib
 from ahip.base import DEFAULT_PORTS
 from ahip import PoolManager, Retry
 from ahip.exceptions import MaxRetryError, NewConnectionError, UnrewindableBodyError
+from ahip.util.request import CompressedBody
 from hip.util.retry import RequestHistory
 
 from dummyserver.server import HAS_IPV6
@@ -68,6 +70,22 @@ class TestPoolManager(HTTPDummyServerTestCase):
             assert r.status == 200
             assert r.data == b"Dummy server!"
 
+    @conftest.test_all_backends
+    async def test_redirect_chain_releases_connections(self, backend, anyio_backend):
+        with PoolManager(backend=backend, maxsize=1, block=True) as http:
+            r = await http.request(
+                "GET",
+                "%s/redirect" % self.base_url,
+                fields={
+                    "target": "%s/redirect?target=%s/" % (self.base_url, self.base_url)
+                },
+                preload_content=False,
+                pool_timeout=LONG_TIMEOUT,
+            )
+
+            assert r.status == 200
+            assert await r.read() == b"Dummy server!"
+
     @conftest.test_all_backends
     async def test_redirect_to_relative_url(self, backend, anyio_backend):
         with PoolManager(backend=backend) as http:
@@ -408,6 +426,28 @@ class TestFileUploads(HTTPDummyServerTestCase):
             assert resp.status == 200
             assert resp.data == data
 
+    @conftest.test_all_backends
+    async def test_redirect_put_compressed_file(self, backend, anyio_backend):
+        data = b"A" * 65535
+        body = CompressedBody(io.BytesIO(data), "gzip")
+        headers = {"Content-Length": str(len(data))}
+
+        with PoolManager(backend=backend) as http:
+            resp = await http.urlopen(
+                "PUT", "%s/headers" % self.base_url, headers=headers, body=body
+            )
+            sent_headers = json.loads(resp.data.decode("utf-8"))
+            assert sent_headers["Content-Encoding"] == "gzip"
+            assert sent_headers["Transfer-Encoding"] == "chunked"
+            assert "Content-Length" not in sent_headers
+
+            body.seek(0)
+            url = "%s/redirect?target=/echo&status=307" % self.base_url
+            resp = await http.urlopen("PUT", url, headers=headers, body=body)
+            assert resp.status == 200
+            assert len(resp.data) < len(data)
+            assert zlib.decompress(resp.data, 16 + zlib.MAX_WBITS) == data
+
     @conftest.test_all_backends
     async def test_retries_put_filehandle(self, backend, anyio_backend):
         """HTTP PUT retry with a file-like object should not timeout"""
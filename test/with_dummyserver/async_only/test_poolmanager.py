@@ -34,6 +34,20 @@ class TestFileUploads(HTTPDummyServerTestCase):
                 assert resp.status == 200
                 assert resp.data == data
 
+    @conftest.test_all_backends
+    async def test_upload_async_generator(self, backend, anyio_backend):
+        """An async generator can be uploaded, chunked"""
+
+        async def body():
+            yield b"hello "
+            yield memoryview(bytearray(b"world"))
+
+        url = "%s/echo" % self.base_url
+        with PoolManager(backend=backend) as http:
+            resp = await http.urlopen("PUT", url, body=body())
+            assert resp.status == 200
+            assert resp.data == b"hello world"
+
     @pytest.mark.trio
     async def test_upload_trio_wrapped_files(self):
         """Uploading a file wrapped via 'trio.wrap_file()' should be possible"""
@@ -0,0 +1,386 @@
+import base64
+import hashlib
+import re
+import socket
+import threading
+import zlib
+from threading import Event
+
+import mock
+import pytest
+
+from ahip import HTTPConnectionPool, PoolManager
+from ahip.response import HTTPResponse
+from ahip.exceptions import DigestMismatchError, ProtocolError, ReadTimeoutError
+from ahip.util.timeout import Timeout
+
+from dummyserver.testcase import SocketDummyServerTestCase, consume_socket
+from test import SHORT_TIMEOUT
+from test.with_dummyserver import conftest
+
+
+class TestTimeouts(SocketDummyServerTestCase):
+    @conftest.test_all_backends
+    async def test_read_timeout(self, backend, anyio_backend):
+        timed_out = Event()
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            timed_out.wait(5)
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(
+            self.host,
+            self.port,
+            timeout=Timeout(connect=5, read=SHORT_TIMEOUT),
+            retries=False,
+            maxsize=1,
+            block=True,
+            backend=backend,
+        ) as pool:
+            try:
+                with pytest.raises(ReadTimeoutError):
+                    await pool.request("GET", "/")
+            finally:
+                timed_out.set()
+
+            assert pool.pool.qsize() == pool.pool.maxsize
+
+    @conftest.test_all_backends
+    async def test_body_read_timeout_discards_connection(self, backend, anyio_backend):
+        timed_out = Event()
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.send(b"HTTP/1.1 200 OK\r\n" b"Content-Length: 10\r\n" b"\r\n" b"12345")
+            timed_out.wait(5)
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(
+            self.host,
+            self.port,
+            timeout=Timeout(connect=5, read=SHORT_TIMEOUT),
+            retries=False,
+            backend=backend,
+        ) as pool:
+            response = await pool.request("GET", "/", preload_content=False)
+            conn = response.connection
+            try:
+                with pytest.raises(ReadTimeoutError):
+                    await response.read()
+            finally:
+                timed_out.set()
+
+            assert conn._sock is None
+
+    @conftest.test_all_backends
+    async def test_slow_drip_body_is_aborted(self, backend, anyio_backend):
+        done = Event()
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n")
+            # Always sends within the read timeout, but far too slowly.
+            while not done.wait(0.05):
+                try:
+                    sock.send(b"x")
+                except socket.error:
+                    break
+            sock.close()
+
+        self._start_server(socket_handler)
+        timeout = Timeout(connect=5, read=5, low_speed_limit=100, low_speed_time=0.5)
+        with HTTPConnectionPool(
+            self.host, self.port, timeout=timeout, retries=False, backend=backend
+        ) as pool:
+            response = await pool.request("GET", "/", preload_content=False)
+            conn = response.connection
+            try:
+                with pytest.raises(ReadTimeoutError):
+                    await response.read()
+            finally:
+                done.set()
+
+            assert conn._sock is None
+
+
+class TestDecoding(SocketDummyServerTestCase):
+    @conftest.test_all_backends
+    async def test_decode_in_worker_thread(self, backend, anyio_backend):
+        compress = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compress.compress(b"foo" * 100000) + compress.flush()
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Encoding: gzip\r\n"
+                b"Content-Length: %d\r\n"
+                b"\r\n" % len(body) + body
+            )
+            sock.close()
+
+        threads = []
+        decode = HTTPResponse._decode
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return decode(*args, **kwargs)
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port, backend=backend) as pool:
+            with mock.patch.object(HTTPResponse, "_decode", record_thread):
+                response = await pool.request("GET", "/", thread_decode_threshold=100)
+
+        assert response.data == b"foo" * 100000
+        assert threading.main_thread() in threads
+        assert len(set(threads)) > 1
+
+
+class TestExpectContinue(SocketDummyServerTestCase):
+    @conftest.test_all_backends
+    async def test_body_sent_after_100_continue(self, backend, anyio_backend):
+        received = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            received.append(consume_socket(sock))
+            sock.send(b"HTTP/1.1 100 Continue\r\n\r\n")
+            body = b""
+            while len(body) < 10:
+                body += sock.recv(65536)
+            received.append(body)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port, backend=backend) as pool:
+            response = await pool.urlopen(
+                "PUT", "/", body=b"helloworld", expect_continue=30
+            )
+            assert response.status == 200
+
+        assert b"expect: 100-continue\r\n" in received[0].lower()
+        assert received[1] == b"helloworld"
+
+    @conftest.test_all_backends
+    async def test_body_sent_after_waiting(self, backend, anyio_backend):
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            buf = b""
+            while not buf.endswith(b"helloworld"):
+                buf += sock.recv(65536)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            # The connection is still usable.
+            consume_socket(sock)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port, backend=backend) as pool:
+            response = await pool.urlopen(
+                "PUT", "/", body=b"helloworld", expect_continue=SHORT_TIMEOUT
+            )
+            assert response.status == 200
+            response = await pool.urlopen("GET", "/")
+            assert response.status == 200
+            assert pool.num_connections == 1
+
+
+class TestDownload(SocketDummyServerTestCase):
+    body = bytes(bytearray(i % 251 for i in range(1000)))
+
+    def _start_range_server(self, done, headers=b""):
+        """Answer every range request with that range of ``self.body``."""
+
+        def serve(sock):
+            # Keep the connection open until the download is done, so that the
+            # client never finds it closed under it.
+            sock.settimeout(0.1)
+            while not done.is_set():
+                try:
+                    head = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                except socket.error:
+                    break
+                if not head:
+                    break
+                first, last = re.search(br"bytes=(\d+)-(\d+)", head).groups()
+                first, last = int(first), int(last)
+                sock.sendall(
+                    b"HTTP/1.1 206 Partial Content\r\n"
+                    b"Content-Range: bytes %d-%d/%d\r\n"
+                    b"Content-Length: %d\r\n"
+                    % (first, last, len(self.body), last - first + 1)
+                    + headers
+                    + b"\r\n"
+                    + self.body[first : last + 1]
+                )
+            sock.close()
+
+        def socket_handler(listener):
+            listener.settimeout(0.1)
+            while not done.is_set():
+                try:
+                    sock = listener.accept()[0]
+                except socket.timeout:
+                    continue
+                threading.Thread(target=serve, args=(sock,)).start()
+
+        self._start_server(socket_handler)
+
+    @conftest.test_all_backends
+    async def test_download_in_ranges(self, backend, anyio_backend, tmpdir):
+        done = Event()
+        self._start_range_server(done)
+        dest = str(tmpdir.join("download"))
+        try:
+            with PoolManager(backend=backend) as http:
+                length = await http.download(
+                    "http://%s:%d/" % (self.host, self.port), dest, parts=3
+                )
+        finally:
+            done.set()
+
+        assert length == len(self.body)
+        with open(dest, "rb") as f:
+            assert f.read() == self.body
+
+    @pytest.mark.parametrize("matches", [True, False])
+    @conftest.test_all_backends
+    async def test_download_checks_digest_headers(
+        self, backend, anyio_backend, tmpdir, matches
+    ):
+        body = self.body if matches else b"other"
+        repr_digest = base64.b64encode(hashlib.sha256(body).digest())
+        done = Event()
+        # Content-MD5 is of each range, and is left alone.
+        self._start_range_server(
+            done,
+            b"Repr-Digest: sha-256=:%s:\r\nContent-MD5: AAAAAAAAAAAAAAAAAAAAAA==\r\n"
+            % repr_digest,
+        )
+        dest = tmpdir.join("download")
+        try:
+            with PoolManager(backend=backend) as http:
+                download = http.download(
+                    "http://%s:%d/" % (self.host, self.port),
+                    str(dest),
+                    parts=2,
+                    check_digest_headers=True,
+                )
+                if matches:
+                    assert await download == len(self.body)
+                else:
+                    with pytest.raises(DigestMismatchError):
+                        await download
+        finally:
+            done.set()
+
+        assert dest.exists() is matches
+
+    @conftest.test_all_backends
+    async def test_download_rejects_longer_range(self, backend, anyio_backend, tmpdir):
+        body = self.body
+        done = Event()
+
+        def socket_handler(listener):
+            listener.settimeout(0.1)
+            while not done.is_set():
+                try:
+                    sock = listener.accept()[0]
+                except socket.timeout:
+                    continue
+                head = consume_socket(sock)
+                first = int(re.search(br"bytes=(\d+)-", head).group(1))
+                # Ignore where the range should end and send the rest.
+                sock.sendall(
+                    b"HTTP/1.1 206 Partial Content\r\n"
+                    b"Content-Range: bytes %d-999/1000\r\n"
+                    b"Content-Length: %d\r\n"
+                    b"Connection: close\r\n"
+                    b"\r\n" % (first, 1000 - first) + body[first:]
+                )
+                sock.close()
+
+        self._start_server(socket_handler)
+        dest = tmpdir.join("download")
+        try:
+            with PoolManager(backend=backend, retries=False) as http:
+                with pytest.raises(ProtocolError):
+                    await http.download(
+                        "http://%s:%d/" % (self.host, self.port),
+                        str(dest),
+                        parts=2,
+                        retries=1,
+                    )
+        finally:
+            done.set()
+        assert not dest.exists()
+
+
+class TestResume(SocketDummyServerTestCase):
+    @conftest.test_all_backends
+    async def test_resume(self, backend, anyio_backend):
+        body = bytes(bytearray(i % 251 for i in range(1000)))
+        resumed = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\n"
+                b'ETag: "v1"\r\n'
+                b"Content-Length: 1000\r\n"
+                b"\r\n" + body[:400]
+            )
+            sock.close()
+
+            sock = listener.accept()[0]
+            resumed.append(consume_socket(sock))
+            sock.sendall(
+                b"HTTP/1.1 206 Partial Content\r\n"
+                b"Content-Range: bytes 400-999/1000\r\n"
+                b"Content-Length: 600\r\n"
+                b"\r\n" + body[400:]
+            )
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(
+            self.host, self.port, retries=False, backend=backend
+        ) as pool:
+            response = await pool.request("GET", "/", resume=1)
+            assert response.data == body
+
+        assert b"range: bytes=400-\r\n" in resumed[0].lower()
+
+
+class TestSaveTo(SocketDummyServerTestCase):
+    @conftest.test_all_backends
+    async def test_save_to(self, backend, anyio_backend, tmpdir):
+        body = bytes(bytearray(i % 251 for i in range(300000)))
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+            )
+            sock.close()
+
+        self._start_server(socket_handler)
+        path = str(tmpdir.join("file"))
+        with HTTPConnectionPool(self.host, self.port, backend=backend) as pool:
+            response = await pool.request("GET", "/", preload_content=False)
+            assert await response.save_to(path, fsync=True) == len(body)
+
+        with open(path, "rb") as f:
+            assert f.read() == body
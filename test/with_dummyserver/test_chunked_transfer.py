@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
+import array
 
 import pytest
 
 from hip import HTTPConnectionPool
 from hip.exceptions import InvalidBodyError
+from hip.packages import six
 from hip.util.retry import Retry
 from dummyserver.testcase import SocketDummyServerTestCase, consume_socket
 
@@ -46,15 +48,18 @@ class TestChunkedTransfer(SocketDummyServerTestCase):
                 assert lines[i * 2] == hex(len(chunk))[2:].encode("utf-8")
                 assert lines[i * 2 + 1] == chunk
 
-    def _test_body(self, data):
+    def _test_body(self, data, headers=None):
         self.start_chunked_handler()
         with HTTPConnectionPool(self.host, self.port, retries=False) as pool:
-            pool.urlopen("GET", "/", data)
+            pool.urlopen("GET", "/", data, headers=headers)
             header, body = self.buffer.split(b"\r\n\r\n", 1)
 
             assert b"transfer-encoding: chunked" in header.split(b"\r\n")
             if data:
-                bdata = data if isinstance(data, bytes) else data.encode("utf-8")
+                if isinstance(data, six.text_type):
+                    bdata = data.encode("utf-8")
+                else:
+                    bdata = bytes(data)
                 assert b"\r\n" + bdata + b"\r\n" in body
                 assert body.endswith(b"\r\n0\r\n\r\n")
 
@@ -65,7 +70,10 @@ class TestChunkedTransfer(SocketDummyServerTestCase):
                 assert body == b"0\r\n\r\n"
 
     def test_bytestring_body(self):
-        self._test_body(b"thisshouldbeonechunk\r\nasdf")
+        # Byte strings are sent with a content-length unless asked otherwise.
+        self._test_body(
+            b"thisshouldbeonechunk\r\nasdf", headers={"transfer-encoding": "chunked"}
+        )
 
     def test_unicode_body(self):
         # Unicode bodies are not supported.
@@ -73,8 +81,27 @@ class TestChunkedTransfer(SocketDummyServerTestCase):
         with pytest.raises(InvalidBodyError):
             self._test_body(chunk)
 
+    @pytest.mark.parametrize(
+        "data",
+        [
+            bytearray(b"thisshouldbeonechunk\r\nasdf"),
+            memoryview(b"xxthisshouldbeonechunk\r\nasdfxx")[2:-2],
+        ],
+    )
+    def test_buffer_body(self, data):
+        self._test_body(data, headers={"transfer-encoding": "chunked"})
+
+    def test_buffer_chunks(self):
+        self.start_chunked_handler()
+        chunks = [bytearray(b"foo"), memoryview(array.array("B", b"bar"))]
+        with HTTPConnectionPool(self.host, self.port, retries=False) as pool:
+            pool.urlopen("GET", "/", chunks)
+
+            body = self.buffer.split(b"\r\n\r\n", 1)[1]
+            assert body == b"3\r\nfoo\r\n3\r\nbar\r\n0\r\n\r\n"
+
     def test_empty_string_body(self):
-        self._test_body(b"")
+        self._test_body(b"", headers={"transfer-encoding": "chunked"})
 
     def test_empty_iterable_body(self):
         self._test_body([])
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import socket
 import sys
@@ -12,12 +13,14 @@ from hip.exceptions import (
     ConnectTimeoutError,
     EmptyPoolError,
     DecodeError,
+    DigestMismatchError,
     MaxRetryError,
     ReadTimeoutError,
     NewConnectionError,
 )
 from hip.packages.six import b, u
 from hip.packages.six.moves.urllib.parse import urlencode
+from hip.util.digest import BodyDigest
 from hip.util.retry import Retry
 from hip.util.timeout import Timeout
 
@@ -472,6 +475,38 @@ class TestConnectionPool(HTTPDummyServerTestCase):
             b"--boundary--\r\n",
         ]
 
+    def test_post_with_multipart_file(self, tmpdir):
+        path = tmpdir.join("upload.bin")
+        path.write_binary(b"x" * 100000)
+        with open(str(path), "rb") as fp:
+            fields = {"file": ("upload.bin", fp, "image/jpeg")}
+            r = self.pool.request(
+                "POST", "/echo", fields=fields, multipart_boundary="boundary"
+            )
+
+        expected = encode_multipart_formdata(
+            {"file": ("upload.bin", b"x" * 100000, "image/jpeg")}, boundary="boundary",
+        )[0]
+        assert r.data == expected
+
+    def test_body_digests(self):
+        expected = hashlib.sha256(b"hello, world!").hexdigest()
+        r = self.pool.request(
+            "GET",
+            "/encodingrequest",
+            headers={"accept-encoding": "gzip"},
+            digests=[BodyDigest("sha256", expected=expected)],
+        )
+        assert r.digests[0].hexdigest() == expected
+
+        with pytest.raises(DigestMismatchError):
+            self.pool.request(
+                "GET",
+                "/encodingrequest",
+                headers={"accept-encoding": "gzip"},
+                digests=[BodyDigest("sha256", expected=expected, raw=True)],
+            )
+
     def test_check_gzip(self):
         r = self.pool.request(
             "GET", "/encodingrequest", headers={"accept-encoding": "gzip"}
@@ -1,20 +1,26 @@
 # TODO: Break this module up into pieces. Maybe group by functionality tested
 # rather than the socket level-ness of it.
 from hip import HTTPConnectionPool, HTTPSConnectionPool
-from hip.poolmanager import proxy_from_url
+from hip.poolmanager import PoolManager, proxy_from_url
 from hip.exceptions import (
+    DeadlineExceededError,
+    DigestMismatchError,
     MaxRetryError,
     ProxyError,
     ReadTimeoutError,
     SSLError,
     ProtocolError,
+    ResourceChangedError,
     BadVersionError,
     FailedTunnelError,
 )
 from hip.util.ssl_ import HAS_SNI
 from hip.util import ssl_
-from hip.util.timeout import Timeout
+from hip.util.timeout import Deadline, Timeout
 from hip.util.retry import Retry
+from hip.util.hedge import Hedge
+from hip.util.single_flight import SingleFlight
+from hip.util.digest import BodyDigest
 from hip._collections import HTTPHeaderDict
 
 from test import skipPyPy3
@@ -36,11 +42,14 @@ except ImportError:
 
 
 from collections import OrderedDict
-from threading import Event
+from threading import Event, Thread
+import hashlib
 import io
 import select
 import socket
 import ssl
+import zlib
+import time
 import mock
 
 
@@ -1882,6 +1891,44 @@ class TestAutomaticHeaderInsertion(SocketDummyServerTestCase):
             assert b"transfer-encoding: chunked\r\n" in data[0]
             assert data[0].endswith(b"a\r\nhelloworld\r\n0\r\n\r\n")
 
+    @pytest.mark.parametrize("body", [b"helloworld", "file"])
+    def test_automatic_content_length(self, body, tmpdir):
+        """
+        A body whose size can be worked out is sent with a content-length
+        rather than chunked.
+        """
+        done_event = Event()
+        data = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+
+            buf = b""
+            while not buf.endswith(b"\r\n\r\nhelloworld"):
+                buf += sock.recv(65536)
+            data.append(buf)
+
+            sock.send(b"HTTP/1.1 200 OK\r\n" b"Content-Length: 0\r\n" b"\r\n")
+            done_event.wait(1)
+            sock.close()
+
+        if body == "file":
+            path = tmpdir.join("body")
+            path.write_binary(b"ignored" + b"helloworld")
+            body = open(str(path), "rb")
+            body.seek(7)
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port) as conn:
+            response = conn.request("POST", url="/", body=body)
+            assert response.status == 200
+
+            assert b"content-length: 10\r\n" in data[0]
+            assert b"transfer-encoding" not in data[0]
+
+        if hasattr(body, "close"):
+            body.close()
+
 
 class TestRetryPoolSizeDrainFail(SocketDummyServerTestCase):
     def test_pool_size_retry_drain_fail(self):
@@ -1908,3 +1955,553 @@ class TestRetryPoolSizeDrainFail(SocketDummyServerTestCase):
         ) as pool:
             pool.urlopen("GET", "/not_found", preload_content=False)
             assert pool.num_connections == 1
+
+
+class TestHedgedRequests(SocketDummyServerTestCase):
+    def test_hedge_wins_over_stalled_connection(self):
+        release_stalled = Event()
+
+        def socket_handler(listener):
+            stalled = listener.accept()[0]
+            consume_socket(stalled)
+
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.send(b"HTTP/1.1 200 OK\r\n" b"Content-Length: 6\r\n" b"\r\n" b"hedged")
+            sock.close()
+
+            release_stalled.wait(5)
+            stalled.close()
+
+        self._start_server(socket_handler)
+        hedge = Hedge(delay=0.05)
+        with HTTPConnectionPool(self.host, self.port, maxsize=2) as pool:
+            try:
+                r = pool.request("GET", "/", retries=0, hedge=hedge)
+                assert r.status == 200
+                assert r.data == b"hedged"
+            finally:
+                release_stalled.set()
+
+        assert len(hedge._latencies) == 1
+
+    def test_no_hedge_for_post(self):
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            sock.close()
+
+        self._start_server(socket_handler)
+        hedge = Hedge(delay=0.01)
+        with HTTPConnectionPool(self.host, self.port) as pool:
+            r = pool.request("POST", "/", retries=0, hedge=hedge)
+            assert r.status == 200
+            assert pool.num_connections == 1
+
+        assert len(hedge._latencies) == 0
+
+
+class TestSingleFlight(SocketDummyServerTestCase):
+    def test_concurrent_gets_share_one_request(self):
+        callers = 4
+        single_flight = SingleFlight()
+        requests = []
+        body = zlib.compress(b"config")
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            requests.append(consume_socket(sock))
+            # Hold the response until every other caller has joined in.
+            for _ in range(500):
+                if single_flight.coalesced == callers - 1:
+                    break
+                Event().wait(0.01)
+            sock.send(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Encoding: deflate\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"\r\n" + body
+            )
+            sock.close()
+
+        self._start_server(socket_handler)
+        url = "http://%s:%d/config" % (self.host, self.port)
+        responses = []
+
+        with PoolManager(single_flight=single_flight) as http:
+
+            def caller():
+                responses.append(
+                    http.request("GET", url, retries=0, digests=[BodyDigest("sha256")])
+                )
+
+            threads = [Thread(target=caller) for _ in range(callers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert len(requests) == 1
+        assert single_flight.coalesced == callers - 1
+        assert len(set(map(id, responses))) == callers
+        digests = set()
+        for r in responses:
+            assert r.status == 200
+            assert r.data == b"config"
+            assert r.digests[0].hexdigest() == hashlib.sha256(b"config").hexdigest()
+            digests.add(id(r.digests[0]))
+        assert len(digests) == callers
+
+
+class TestDeadline(SocketDummyServerTestCase):
+    def test_slow_body_exceeds_deadline(self):
+        done = Event()
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            consume_socket(sock)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n")
+            # Each byte arrives well within the read timeout.
+            while not done.wait(0.05):
+                try:
+                    sock.send(b"x")
+                except socket.error:
+                    break
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port, timeout=5) as pool:
+            start = time.time()
+            try:
+                with pytest.raises(DeadlineExceededError):
+                    pool.request("GET", "/", retries=False, deadline=0.3)
+            finally:
+                done.set()
+            assert time.time() - start < 2
+
+    def test_deadline_spans_retries(self):
+        done = Event()
+        attempts = []
+
+        def socket_handler(listener):
+            while not done.is_set():
+                sock = listener.accept()[0]
+                consume_socket(sock)
+                attempts.append(1)
+                sock.send(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Retry-After: 1\r\n"
+                    b"Content-Length: 0\r\n"
+                    b"Connection: close\r\n"
+                    b"\r\n"
+                )
+                sock.close()
+
+        self._start_server(socket_handler)
+        retries = Retry(total=100, status_forcelist=[503])
+        with HTTPConnectionPool(self.host, self.port, timeout=5) as pool:
+            start = time.time()
+            try:
+                with pytest.raises(DeadlineExceededError):
+                    pool.request("GET", "/", retries=retries, deadline=Deadline(1.5))
+            finally:
+                done.set()
+                # Unblock the server's accept().
+                socket.create_connection((self.host, self.port)).close()
+            # Retry-After says to wait a second, so there's only time for
+            # two attempts.
+            assert time.time() - start < 2
+        assert len(attempts) == 2
+
+
+class TestExpectContinue(SocketDummyServerTestCase):
+    def test_body_sent_after_100_continue(self):
+        received = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            head = consume_socket(sock)
+            received.append(head)
+            sock.send(b"HTTP/1.1 100 Continue\r\n\r\n")
+            body = b""
+            while len(body) < 10:
+                body += sock.recv(65536)
+            received.append(body)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port) as pool:
+            # Long enough that the test would time out if the body waited.
+            r = pool.urlopen("PUT", "/", body=b"helloworld", expect_continue=30)
+            assert r.status == 200
+
+        assert b"expect: 100-continue\r\n" in received[0].lower()
+        assert received[0].endswith(b"\r\n\r\n")
+        assert received[1] == b"helloworld"
+
+    def test_body_sent_after_waiting(self):
+        received = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            buf = b""
+            while not buf.endswith(b"helloworld"):
+                buf += sock.recv(65536)
+            received.append(buf)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port) as pool:
+            r = pool.urlopen(
+                "PUT", "/", body=b"helloworld", expect_continue=SHORT_TIMEOUT
+            )
+            assert r.status == 200
+        assert len(received) == 1
+
+    def test_chunked_body_not_sent_after_rejection(self):
+        requests = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            requests.append(consume_socket(sock))
+            sock.send(
+                b"HTTP/1.1 413 Payload Too Large\r\n"
+                b"Content-Length: 4\r\n"
+                b"\r\n"
+                b"nope"
+            )
+            # The empty chunked body, then the next request on the same
+            # connection.
+            buf = b""
+            while buf.count(b"\r\n\r\n") < 2:
+                buf += sock.recv(65536)
+            requests.append(buf)
+            sock.send(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            sock.close()
+
+        def body():
+            yield b"x" * 1024
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port) as pool:
+            r = pool.urlopen("PUT", "/", body=body(), expect_continue=30, retries=False)
+            assert r.status == 413
+            assert r.data == b"nope"
+
+            r = pool.urlopen("GET", "/", retries=False)
+            assert r.status == 200
+            assert pool.num_connections == 1
+
+        assert b"transfer-encoding: chunked\r\n" in requests[0]
+        assert requests[1].startswith(b"0\r\n\r\nGET / HTTP/1.1\r\n")
+
+    def test_sized_body_not_sent_after_rejection(self):
+        requests = []
+        done_receiving = Event()
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            requests.append(consume_socket(sock))
+            sock.send(b"HTTP/1.1 401 Unauthorized\r\n" b"Content-Length: 0\r\n" b"\r\n")
+            requests.append(sock.recv(65536))
+            done_receiving.set()
+            sock.close()
+
+        self._start_server(socket_handler)
+        with HTTPConnectionPool(self.host, self.port) as pool:
+            r = pool.urlopen(
+                "PUT", "/", body=b"x" * 100000, expect_continue=30, retries=False
+            )
+            assert r.status == 401
+            r.release_conn()
+
+        done_receiving.wait()
+        assert b"content-length: 100000\r\n" in requests[0]
+        # The connection was closed without the body being sent.
+        assert requests[1] == b""
+
+
+def read_request_head(sock):
+    buf = b""
+    while not buf.endswith(b"\r\n\r\n"):
+        try:
+            data = sock.recv(65536)
+        except socket.error:
+            data = b""
+        if not data:
+            return None
+        buf += data
+    return buf
+
+
+class TestDownload(SocketDummyServerTestCase):
+    body = bytes(bytearray(i % 251 for i in range(100000)))
+
+    def _start_range_server(self, respond):
+        """
+        Serve every connection in its own thread, calling ``respond(sock,
+        first, last)`` for each request. ``first`` and ``last`` are
+        None if the request has no Range header.
+        """
+        self.requests = []
+        self.done = Event()
+
+        def serve(sock):
+            while True:
+                head = read_request_head(sock)
+                if head is None:
+                    break
+                self.requests.append(head)
+                first = last = None
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"range: bytes="):
+                        first, last = line.split(b"=")[1].split(b"-")
+                        first, last = int(first), int(last)
+                if not respond(sock, first, last):
+                    break
+            sock.close()
+
+        def socket_handler(listener):
+            listener.settimeout(0.1)
+            while not self.done.is_set():
+                try:
+                    sock = listener.accept()[0]
+                except socket.timeout:
+                    continue
+                sock.settimeout(None)
+                Thread(target=serve, args=(sock,)).start()
+
+        self._start_server(socket_handler)
+
+    def send_range(self, sock, first, last):
+        sock.sendall(
+            b"HTTP/1.1 206 Partial Content\r\n"
+            b'ETag: "v1"\r\n'
+            b"Content-Range: bytes %d-%d/%d\r\n"
+            b"Content-Length: %d\r\n"
+            b"\r\n" % (first, last, len(self.body), last - first + 1)
+            + self.body[first : last + 1]
+        )
+        return True
+
+    def test_download_in_ranges(self, tmpdir):
+        self._start_range_server(self.send_range)
+        dest = str(tmpdir.join("download"))
+        try:
+            with PoolManager() as http:
+                length = http.download(
+                    "http://%s:%d/" % (self.host, self.port), dest, parts=4
+                )
+        finally:
+            self.done.set()
+
+        assert length == len(self.body)
+        with open(dest, "rb") as f:
+            assert f.read() == self.body
+        # The probe, then the four parts.
+        assert len(self.requests) == 5
+        for head in self.requests[1:]:
+            assert b'if-range: "v1"\r\n' in head.lower()
+            assert b"accept-encoding: identity\r\n" in head.lower()
+
+    def test_download_without_range_support(self, tmpdir):
+        def respond(sock, first, last):
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(self.body)
+                + self.body
+            )
+            return True
+
+        self._start_range_server(respond)
+        dest = str(tmpdir.join("download"))
+        try:
+            with PoolManager() as http:
+                length = http.download(
+                    "http://%s:%d/" % (self.host, self.port), dest, parts=4
+                )
+        finally:
+            self.done.set()
+
+        assert length == len(self.body)
+        with open(dest, "rb") as f:
+            assert f.read() == self.body
+        assert len(self.requests) == 1
+
+    def test_download_without_range_support_checks_digests(self, tmpdir):
+        def respond(sock, first, last):
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-MD5: AAAAAAAAAAAAAAAAAAAAAA==\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(self.body) + self.body
+            )
+            return True
+
+        self._start_range_server(respond)
+        dest = tmpdir.join("download")
+        try:
+            with PoolManager() as http:
+                with pytest.raises(DigestMismatchError):
+                    http.download(
+                        "http://%s:%d/" % (self.host, self.port),
+                        str(dest),
+                        check_digest_headers=True,
+                    )
+        finally:
+            self.done.set()
+        assert not dest.exists()
+
+    def test_download_resumes_failed_range(self, tmpdir):
+        failed = []
+
+        def respond(sock, first, last):
+            if first == 50000 and not failed:
+                failed.append(True)
+                # Send half the range, then drop the connection.
+                sock.sendall(
+                    b"HTTP/1.1 206 Partial Content\r\n"
+                    b'ETag: "v1"\r\n'
+                    b"Content-Range: bytes %d-%d/%d\r\n"
+                    b"Content-Length: %d\r\n"
+                    b"\r\n" % (first, last, len(self.body), last - first + 1)
+                    + self.body[first : first + 100]
+                )
+                return False
+            return self.send_range(sock, first, last)
+
+        self._start_range_server(respond)
+        dest = str(tmpdir.join("download"))
+        try:
+            with PoolManager() as http:
+                http.download(
+                    "http://%s:%d/" % (self.host, self.port), dest, parts=2, retries=1,
+                )
+        finally:
+            self.done.set()
+
+        with open(dest, "rb") as f:
+            assert f.read() == self.body
+        assert b"range: bytes=50100-99999\r\n" in self.requests[-1].lower()
+
+    def test_download_resource_changed(self, tmpdir):
+        def respond(sock, first, last):
+            if first == 0 and last == 0:
+                return self.send_range(sock, first, last)
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\n"
+                b'ETag: "v2"\r\n'
+                b"Content-Length: %d\r\n"
+                b"\r\n" % len(self.body) + self.body
+            )
+            return True
+
+        self._start_range_server(respond)
+        dest = str(tmpdir.join("download"))
+        try:
+            with PoolManager() as http:
+                with pytest.raises(ResourceChangedError):
+                    http.download(
+                        "http://%s:%d/" % (self.host, self.port), dest, parts=2
+                    )
+        finally:
+            self.done.set()
+
+
+class TestResume(SocketDummyServerTestCase):
+    body = bytes(bytearray(i % 251 for i in range(100000)))
+
+    def _start_flaky_server(self, resumed_response, validator=b'ETag: "v1"\r\n'):
+        """
+        Send half the body on the first connection and drop it, then answer
+        the next request with ``resumed_response(head)``.
+        """
+        self.requests = []
+
+        def socket_handler(listener):
+            sock = listener.accept()[0]
+            self.requests.append(consume_socket(sock))
+            sock.sendall(
+                b"HTTP/1.1 200 OK\r\n"
+                + validator
+                + b"Content-Length: %d\r\n\r\n" % len(self.body)
+                + self.body[:50000]
+            )
+            sock.close()
+
+            sock = listener.accept()[0]
+            head = consume_socket(sock)
+            self.requests.append(head)
+            sock.sendall(resumed_response(head))
+            sock.close()
+
+        self._start_server(socket_handler)
+
+    def rest(self, head):
+        return (
+            b"HTTP/1.1 206 Partial Content\r\n"
+            b'ETag: "v1"\r\n'
+            b"Content-Range: bytes 50000-99999/100000\r\n"
+            b"Content-Length: 50000\r\n"
+            b"\r\n" + self.body[50000:]
+        )
+
+    def test_resume(self):
+        self._start_flaky_server(self.rest)
+        with HTTPConnectionPool(self.host, self.port, retries=False) as pool:
+            r = pool.request("GET", "/", resume=1, preload_content=False)
+            assert r.read() == self.body
+            assert r.tell() == len(self.body)
+
+        resumed = self.requests[1].lower()
+        assert b"range: bytes=50000-\r\n" in resumed
+        assert b'if-range: "v1"\r\n' in resumed
+
+    def test_resume_gives_back_broken_connection(self):
+        self._start_flaky_server(self.rest)
+        with HTTPConnectionPool(
+            self.host, self.port, retries=False, maxsize=1, block=True
+        ) as pool:
+            r = pool.request("GET", "/", resume=1, pool_timeout=SHORT_TIMEOUT)
+            assert r.data == self.body
+            assert pool.pool.qsize() == 1
+
+    def test_resume_with_last_modified(self):
+        self._start_flaky_server(
+            self.rest, validator=b"Last-Modified: Sat, 01 Jan 2000 00:00:00 GMT\r\n"
+        )
+        with HTTPConnectionPool(self.host, self.port, retries=False) as pool:
+            r = pool.request("GET", "/", resume=1)
+            assert r.data == self.body
+
+        assert (
+            b"if-range: sat, 01 jan 2000 00:00:00 gmt\r\n" in self.requests[1].lower()
+        )
+
+    def test_resource_changed(self):
+        def changed(head):
+            return (
+                b"HTTP/1.1 200 OK\r\n"
+                b'ETag: "v2"\r\n'
+                b"Content-Length: %d\r\n\r\n" % len(self.body) + self.body
+            )
+
+        self._start_flaky_server(changed)
+        with HTTPConnectionPool(
+            self.host, self.port, retries=False, maxsize=1, block=True
+        ) as pool:
+            with pytest.raises(ResourceChangedError):
+                pool.request("GET", "/", resume=1, pool_timeout=SHORT_TIMEOUT)
+            assert pool.pool.qsize() == 1
+
+    def test_not_resumed_without_validator(self):
+        self._start_flaky_server(self.rest, validator=b'ETag: W/"v1"\r\n')
+        with HTTPConnectionPool(self.host, self.port, retries=False) as pool:
+            try:
+                with pytest.raises(ProtocolError):
+                    pool.request("GET", "/", resume=1)
+            finally:
+                # Unblock the server's accept().
+                socket.create_connection((self.host, self.port)).close()
+        assert len(self.requests) == 1